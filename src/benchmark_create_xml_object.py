@@ -0,0 +1,208 @@
+# __Author__: Khoi Van 2021
+
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path, PurePath
+from typing import Dict, List, Tuple
+
+from rich.console import Console
+from rich.table import Table
+
+import create_xml_object
+from create_xml_object import (CSV_EXTRA_INFO_FILE, CURRENT_XML_FILE, DEFAULT_COMPRESSLEVEL, NAPOLEON_DATABASE_FILE,
+                               Item, Option_Product, Variation_Product, get_item_extra_info,
+                               load_csv_info, load_db, load_xml_info, render_product, write_xml)
+
+console = Console()
+
+# Item class used for each kind of item in a series
+ITEM_CLASSES = {'units': Option_Product,
+                'variations': Variation_Product}
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    """Creating CLI helper"""
+    parser = argparse.ArgumentParser(
+        usage="python %(prog)s [OPTIONS]",
+        description="Measure the per-product cost of creating the catalog XML for the whole Napoleon database."
+    )
+    parser.add_argument('-x', '--xml-file',
+                        help=f'Current catalog XML file (default: {CURRENT_XML_FILE.name}).',
+                        type=Path,
+                        default=CURRENT_XML_FILE)
+    parser.add_argument('-n', '--repeat',
+                        help='Number of times every product is created (default: 5).',
+                        type=int,
+                        default=5)
+    parser.add_argument('-z', '--compression',
+                        help='Measure writing and reading the catalog XML gzipped instead.',
+                        action="store_true")
+    return parser
+
+
+def collect_items(database: Dict[str, Dict],
+                  csv_extra_info: Dict[str, Dict[str, str]],
+                  xml_extra_info: Dict[str, Dict]
+                  ) -> Tuple[List[Tuple[type, str, Dict]], int]:
+    """List (item class, sku, extra info) of every unit and variation of every series
+
+    Items that cannot be created from the current database are left out
+
+    Returns
+    -------
+    Tuple[List[Tuple[type, str, Dict]], int]
+        The items, and the number of items left out
+    """
+    items = []
+    skipped = 0
+    for series in database['series'].values():
+        for kind, item_class in ITEM_CLASSES.items():
+            for line in series.get(kind, []):
+                for detail in line['details']:
+                    sku = detail.get('manufacturerSku')
+                    if not sku:
+                        continue
+                    extra_info = get_item_extra_info(csv_extra_info=csv_extra_info,
+                                                     xml_extra_info=xml_extra_info,
+                                                     sku=sku)
+                    try:
+                        item_class(sku=sku, brand='Napoleon', catalog_info=database, extra_info=extra_info).to_xml()
+                    except Exception:
+                        skipped += 1
+                        continue
+                    items.append((item_class, sku, extra_info))
+    return items, skipped
+
+
+def benchmark(database_file: PurePath, xml_file: PurePath, repeat: int) -> Dict[str, Dict[str, float]]:
+    """Time creating every item and building its XML, `repeat` times
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        {item class name: {'products', 'create_us', 'to_xml_us', 'item_to_xml_us'}},
+        the times are per product, in microseconds.
+        'item_to_xml_us' is the part of `to_xml()` spent in `Item.to_xml()`, the tags shared by every item
+    """
+    database = load_db(database_file)
+    _, csv_extra_info = load_csv_info(CSV_EXTRA_INFO_FILE)
+    _, xml_extra_info = load_xml_info(xml_file)
+    items, skipped = collect_items(database, csv_extra_info, xml_extra_info)
+    if skipped:
+        console.log(f'{skipped} items cannot be created from the database and are not measured.')
+
+    results = {}
+    for item_class in ITEM_CLASSES.values():
+        class_items = [(sku, extra_info) for cls, sku, extra_info in items if cls is item_class]
+        create_seconds = to_xml_seconds = item_to_xml_seconds = 0.0
+        for _ in range(repeat):
+            for sku, extra_info in class_items:
+                start = time.perf_counter()
+                product = item_class(sku=sku, brand='Napoleon', catalog_info=database, extra_info=extra_info)
+                created = time.perf_counter()
+                product.to_xml()
+                to_xml_seconds += time.perf_counter() - created
+                create_seconds += created - start
+
+                start = time.perf_counter()
+                Item.to_xml(product)
+                item_to_xml_seconds += time.perf_counter() - start
+        runs = max(len(class_items) * repeat, 1)
+        results[item_class.__name__] = {'products': len(class_items),
+                                        'create_us': create_seconds / runs * 1e6,
+                                        'to_xml_us': to_xml_seconds / runs * 1e6,
+                                        'item_to_xml_us': item_to_xml_seconds / runs * 1e6}
+    return results
+
+
+def benchmark_compression(database_file: PurePath, xml_file: PurePath, repeat: int,
+                          compresslevels: Tuple[int, ...] = (1, DEFAULT_COMPRESSLEVEL, 9)
+                          ) -> Dict[str, Dict[str, float]]:
+    """Time writing the XML of every item and reading it back, uncompressed then gzipped at each level
+
+    Returns
+    -------
+    Dict[str, Dict[str, float]]
+        {output: {'bytes', 'write_ms', 'read_ms'}}, the times are per run, in milliseconds
+    """
+    database = load_db(database_file)
+    _, csv_extra_info = load_csv_info(CSV_EXTRA_INFO_FILE)
+    catalog, xml_extra_info = load_xml_info(xml_file)
+    items, _ = collect_items(database, csv_extra_info, xml_extra_info)
+    # Only measure the file, not creating the items
+    fragments = [render_product(item_class(sku=sku, brand='Napoleon', catalog_info=database,
+                                           extra_info=extra_info).to_xml()['product'])
+                 for item_class, sku, extra_info in items]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        outputs = [('xml', Path(folder) / 'napoleon.xml', None)]
+        outputs += [(f'xml.gz, level {level}', Path(folder) / f'napoleon-{level}.xml.gz', level)
+                    for level in compresslevels]
+        for name, target_file, level in outputs:
+            write_seconds = read_seconds = 0.0
+            for _ in range(repeat):
+                start = time.perf_counter()
+                write_xml(target_file, catalog, fragments, compresslevel=level or DEFAULT_COMPRESSLEVEL)
+                written = time.perf_counter()
+                load_xml_info(target_file)
+                read_seconds += time.perf_counter() - written
+                write_seconds += written - start
+            results[name] = {'bytes': target_file.stat().st_size,
+                             'write_ms': write_seconds / repeat * 1e3,
+                             'read_ms': read_seconds / repeat * 1e3}
+    return results
+
+
+def print_compression_results(results: Dict[str, Dict[str, float]]) -> None:
+    plain = next(iter(results.values()))
+    table = Table(title='Cost of the gzipped catalog XML')
+    table.add_column('Output', no_wrap=True)
+    table.add_column('Size', justify='right')
+    table.add_column('Write (ms)', justify='right')
+    table.add_column('Read (ms)', justify='right')
+    table.add_column('Write + read overhead', justify='right')
+    for name, result in results.items():
+        overhead = (result['write_ms'] + result['read_ms']) / (plain['write_ms'] + plain['read_ms']) - 1
+        table.add_row(name,
+                      f"{result['bytes']:,}",
+                      f"{result['write_ms']:,.1f}",
+                      f"{result['read_ms']:,.1f}",
+                      f"{overhead:+.0%}")
+    console.print(table)
+
+
+def print_results(results: Dict[str, Dict[str, float]]) -> None:
+    table = Table(title='Per-product cost of the catalog XML')
+    table.add_column('Item class', no_wrap=True)
+    table.add_column('Products', justify='right')
+    table.add_column('Create (µs)', justify='right')
+    table.add_column('to_xml (µs)', justify='right')
+    table.add_column('Item.to_xml (µs)', justify='right')
+    for name, result in results.items():
+        table.add_row(name,
+                      f"{result['products']:,}",
+                      f"{result['create_us']:,.1f}",
+                      f"{result['to_xml_us']:,.1f}",
+                      f"{result['item_to_xml_us']:,.1f}")
+    console.print(table)
+
+
+if __name__ == "__main__":
+    parser = init_argparse()
+    args = parser.parse_args()
+
+    # Items without info in the current XML are logged one by one, too noisy here
+    create_xml_object.log.setLevel(logging.WARNING)
+    create_xml_object.debug = False
+
+    if args.compression:
+        print_compression_results(benchmark_compression(database_file=NAPOLEON_DATABASE_FILE,
+                                                        xml_file=args.xml_file,
+                                                        repeat=args.repeat))
+    else:
+        print_results(benchmark(database_file=NAPOLEON_DATABASE_FILE,
+                                xml_file=args.xml_file,
+                                repeat=args.repeat))
@@ -2,17 +2,27 @@
 
 import argparse
 import csv
+import gzip
+import hashlib
+import io
 import json
 import logging
+import multiprocessing
 import re
+import sys
 import xml.etree.ElementTree as ET
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from functools import lru_cache
-from itertools import zip_longest
+from contextlib import nullcontext
+from functools import cached_property, lru_cache
+from itertools import groupby, zip_longest
 from pathlib import Path, PurePath
-from typing import Dict, List, Optional, Set, Union
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+from multiprocessing.pool import Pool
 from xml.dom import minidom
+from xml.sax.saxutils import XMLGenerator
+from xml.sax.xmlreader import AttributesImpl
 
 import pandas as pd
 import xmltodict
@@ -21,8 +31,8 @@ from rich.console import Console
 from rich.logging import RichHandler
 from rich.progress import BarColumn, Progress, SpinnerColumn, TimeElapsedColumn
 
-from extract_napoleon_data_from_catalog import \
-    extract_napoleon_data_from_catalog
+from extract_napoleon_data_from_catalog import (
+    extract_napoleon_data_from_catalog, get_sku_resolver)
 
 console = Console()
 # sys.setrecursionlimit(20000)
@@ -53,6 +63,12 @@ CSV_EXTRA_INFO_FILE = ORIGINAL_DATA_FOLDER / 'ncfCatalogTemplate.csv'
 CURRENT_XML_FILE = ORIGINAL_DATA_FOLDER / 'ncf-mc-all-6.4.21-bu.xml'
 XML_TEMPLATE = ORIGINAL_DATA_FOLDER / 'xml_template.xml'
 NAPOLEON_XML_FILE = XML_RESULT_FOLDER / 'napoleon.xml'
+BULK_XML_FILE = XML_RESULT_FOLDER / 'catalog.xml'
+
+# Brand of the items of the vendor database
+BRAND = 'Napoleon'
+# Vendor database of each brand, the items of the other brands are created from the NCF template columns
+VENDOR_DATABASE_FILES = {BRAND: NAPOLEON_DATABASE_FILE}
 
 # NCF_CSV_FILE = DATA_FOLDER / 'ncfNapoleonCatalogTemplate.csv'
 OPTIONAL_LOOKUP = {'mandatory': 'Required',
@@ -63,8 +79,69 @@ ADDITIONAL_OPTIONAL_LOOKUP = {'INC': 'Included',
                               'OPT': 'Optional',
                               'N/A': 'Not Available'}
 
+# Sections of the current catalog XML that are not carried over into the generated XML.
+# Except for 'header', they are generated from the products instead, see `CatalogSections`
+REMOVED_CATALOG_SECTIONS = ('variation-attribute', 'product-option', 'header', 'category')
+# Sections generated from the plan of the products, written before them (the schema order), see `plan_categories()`
+GENERATED_SECTIONS_BEFORE = ('category',)
+# Sections generated from the products, written after them in this order
+GENERATED_SECTIONS_AFTER = ('product-option', 'variation-attribute', 'category-assignment')
+# Parent of the generated product categories
+ROOT_CATEGORY_ID = 'root'
+# Fields of each `<product>` in the current catalog XML that are used by the `Item` classes
+PRODUCT_XML_FIELDS = ('upc', 'page-attributes')
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+
 Unit = namedtuple('Unit', 'sku info')
 
+# Set from the CLI, print more debug info
+debug = False
+
+# Read-only vendor databases by brand and extra info used by the generation worker processes,
+# set in the parent before forking so that the workers share them copy-on-write
+shared_generation_data = None
+
+# Attributes shared by every item of a series, see `get_series_attributes()`
+SeriesAttributes = namedtuple('SeriesAttributes', 'ignition_types venting top_and_rear_venting fuel_ignition_matrices')
+
+# Fuel and ignition types of the fuel/ignition SKU matrix, see `build_fuel_ignition_matrix()`
+FUEL_TYPES = ('propane', 'natural gas')
+IGNITION_TYPES = ('electronic', 'millivolt')
+
+# Only keep the series attributes of the latest database, the database is loaded once per run
+series_attributes_cache = (None, None)
+
+# Items of the full catalog: productTypeNonoperative, manufacturerSku, where the item is in the database
+# ('units', 'variations' or 'products', or `TEMPLATE_CATALOG_TYPE` for a row of the NCF template) and its brand
+CatalogItem = namedtuple('CatalogItem', 'product_type sku catalog_type brand', defaults=(BRAND,))
+# Items without vendor database, created from their row of the NCF template
+TEMPLATE_CATALOG_TYPE = 'template'
+# Number of NCF template items created by a worker at a time
+TEMPLATE_GROUP_SIZE = 100
+
+# Catalog XML files with this suffix, e.g. 'napoleon.xml.gz', are read and written through gzip
+GZIP_SUFFIX = '.gz'
+# gzip level of the compressed catalog XML files. Measured with `benchmark_create_xml_object.py --compression`,
+# level 6 shrinks the Napoleon XML ~40x for ~10 ms of CPU per MB written (under 2% of generating the full catalog),
+# and reading is bound by the XML parsing, not the decompression. Higher levels cost more for little gain
+DEFAULT_COMPRESSLEVEL = 6
+
+# Largest share of the planned items that may fail before the run fails instead of writing the catalog
+MAX_FAILED_ITEMS_RATIO = 0.1
+
+
+class MissingCatalogInfo(ValueError):
+    """The database has no record or no value of an item for the info needed to create it"""
+
+
+class CatalogGenerationError(RuntimeError):
+    """Too many items of the catalog cannot be created, see `MAX_FAILED_ITEMS_RATIO`"""
+
+
+# Version of the `<product>` XML rendering, part of the key of each cached fragment.
+# Bump it whenever the XML of an item changes for the same inputs (e.g. new tag in `Item.to_xml()`)
+FRAGMENT_RENDER_VERSION = 2
+
 
 def init_argparse() -> argparse.ArgumentParser:
     """Creating CLI helper"""
@@ -78,18 +155,606 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument('-r', '--reload-database',
                         help='Force reloading of database from pricebook.',
                         action="store_true")
+    parser.add_argument('-a', '--all',
+                        help='Generate the XML of the full catalog: every series and standalone product.',
+                        action="store_true")
+    parser.add_argument('-j', '--jobs',
+                        help='Number of worker processes sharing the series of the full catalog (default: 1).',
+                        type=int,
+                        default=1)
+    parser.add_argument('--max-shard-bytes',
+                        help='Split the XML into shards, each with at most this many bytes of products.',
+                        type=int)
+    parser.add_argument('--max-shard-products',
+                        help='Split the XML into shards, each with at most this many products.',
+                        type=int)
+    parser.add_argument('--delta',
+                        help='Only write the new and changed products compared to the current catalog XML, '
+                             'and list the removed product IDs.',
+                        action="store_true")
+    parser.add_argument('-x', '--xml-file',
+                        help=f'Current catalog XML file, can be gzipped (default: {CURRENT_XML_FILE.name}).',
+                        type=Path,
+                        default=CURRENT_XML_FILE)
+    parser.add_argument('-o', '--output',
+                        help=f'Catalog XML file to write, gzipped if it ends with ".gz" '
+                             f'(default: {NAPOLEON_XML_FILE.name}, {BULK_XML_FILE.name} with --brands).',
+                        type=Path)
+    parser.add_argument('-z', '--compresslevel',
+                        help=f'gzip level (1-9) of a ".gz" output (default: {DEFAULT_COMPRESSLEVEL}).',
+                        type=int,
+                        default=DEFAULT_COMPRESSLEVEL)
+    parser.add_argument('-i', '--incremental',
+                        help='Full catalog only: reuse the cached <product> of the items whose inputs did not change '
+                             'since the previous run.',
+                        action="store_true")
+    parser.add_argument('-b', '--brands',
+                        help='Bulk mode: generate the items of these brands of the NCF template, every brand if none '
+                             'is given. A brand with a vendor database is generated from it, the others from the '
+                             'template columns.',
+                        nargs='*')
+    parser.add_argument('--max-failures',
+                        help='Largest share of the items that may fail to be created (default: '
+                             f'{MAX_FAILED_ITEMS_RATIO}). Above it, the run fails without writing the catalog XML.',
+                        type=float,
+                        default=MAX_FAILED_ITEMS_RATIO)
+    parser.add_argument('--per-brand',
+                        help='Bulk mode: write one catalog XML per brand, named after the output file.',
+                        action="store_true")
     return parser
 
 
 def create_xml_object(database_file: PurePath,
                       csv_extra_info_file: PurePath,
                       xml_extra_info_file: PurePath,
+                      full_catalog: bool = False,
+                      jobs: int = 1,
+                      incremental: bool = False,
+                      max_shard_bytes: Optional[int] = None,
+                      max_shard_products: Optional[int] = None,
+                      delta: bool = False,
+                      target_file: PurePath = NAPOLEON_XML_FILE,
+                      compresslevel: int = DEFAULT_COMPRESSLEVEL,
+                      brands: Optional[List[str]] = None,
+                      per_brand: bool = False,
+                      max_failures: float = MAX_FAILED_ITEMS_RATIO,
                       ):
+    """Create the catalog XML file of the Napoleon items, or of several brands of the NCF template
+
+    Parameters
+    ----------
+    database_file : PurePath
+        file path to the database JSON
+    csv_extra_info_file : PurePath
+        file path to the NCF template csv file
+    xml_extra_info_file : PurePath
+        file path to the current catalog XML, read through gzip if it ends with '.gz'
+    full_catalog : bool, optional
+        generate every series and standalone product instead of the test series, by default False
+    jobs : int, optional
+        number of worker processes sharing the series of the full catalog, by default 1
+    incremental : bool, optional
+        full catalog only, only re-create the items whose inputs changed since the previous run
+        and reuse the cached XML of the others, by default False
+    max_shard_bytes : Optional[int], optional
+        split the XML into shards with at most this many bytes of products, by default None
+    max_shard_products : Optional[int], optional
+        split the XML into shards with at most this many products, by default None
+    delta : bool, optional
+        only write the products that are new or changed compared to `xml_extra_info_file`,
+        see `write_xml_delta()`, by default False
+    target_file : PurePath, optional
+        file path for the catalog XML, the other outputs are named after it, by default `NAPOLEON_XML_FILE`.
+        Written through gzip if it ends with '.gz'
+    compresslevel : int, optional
+        gzip level of a '.gz' output, by default `DEFAULT_COMPRESSLEVEL`
+    brands : Optional[List[str]], optional
+        bulk mode: generate the full catalog of these brands of the NCF template, every brand if empty,
+        see `plan_brand_items()`, by default None (the Napoleon items only)
+    per_brand : bool, optional
+        bulk mode: write one catalog XML per brand, named after `target_file`, by default False
+    max_failures : float, optional
+        largest share of the items that may fail to be created, by default `MAX_FAILED_ITEMS_RATIO`.
+        Above it, `CatalogGenerationError` is raised and no catalog XML is written
+    """
     db = load_db(database_file)
-    csv_extra_info = load_csv_info(csv_extra_info_file)
-    xml_extra_info = load_xml_info(xml_extra_info_file)
+    csv_lines, csv_extra_info = load_csv_info(csv_extra_info_file)
+    removed_sections = {}
+    catalog, xml_extra_info = load_xml_info(xml_extra_info_file, removed_sections=removed_sections)
+    output = dict(catalog=catalog,
+                  current_xml_file=xml_extra_info_file,
+                  max_shard_bytes=max_shard_bytes,
+                  max_shard_products=max_shard_products,
+                  delta=delta,
+                  jobs=jobs,
+                  compresslevel=compresslevel)
+
+    if brands is not None:
+        if incremental:
+            log.warning('The fragment cache is only used for the Napoleon catalog, ignored in bulk mode.')
+        # The vendor database of Napoleon is `database_file`, the other ones are loaded if they exist
+        databases = {brand: load_db(file) for brand, file in VENDOR_DATABASE_FILES.items()
+                     if brand != BRAND and Path(file).exists()}
+        databases[BRAND] = db
+        plan = plan_brand_items(csv_lines, databases, brands)
+        data = generate_planned_products(plan, databases, csv_extra_info, xml_extra_info,
+                                         jobs=jobs, max_failures=max_failures)
+        if not per_brand:
+            categories = plan_categories(plan, databases, csv_extra_info)
+            write_catalog(target_file, data=data,
+                          sections=CatalogSections(templates=removed_sections, categories=categories), **output)
+            return
+        # The products come brand after brand, like the groups of `plan`
+        for brand, products in groupby(data, key=lambda item: get_product_brand(item['product'])):
+            brand_plan = [items for items in plan if items and items[0].brand == brand]
+            categories = plan_categories(brand_plan, databases, csv_extra_info)
+            write_catalog(get_catalog_file(target_file, f'-{make_category_id(brand)}', keep_suffix=True),
+                          data=products,
+                          sections=CatalogSections(templates=removed_sections, categories=categories), **output)
+        return
+
+    if full_catalog and incremental:
+        data = generate_catalog_fragments(db, csv_extra_info, xml_extra_info,
+                                          cache_file=get_catalog_file(target_file, '.fragments.json'),
+                                          jobs=jobs, max_failures=max_failures)
+    elif full_catalog:
+        data = generate_catalog_products(db, csv_extra_info, xml_extra_info, jobs=jobs, max_failures=max_failures)
+    else:
+        # Only a few test products, their categories are read from them
+        data = list(generate_products(db, csv_extra_info, xml_extra_info))
+    if full_catalog:
+        categories = plan_categories(plan_catalog_items(db), {BRAND: db}, csv_extra_info)
+    else:
+        categories = [get_custom_attributes(item['product']).get('productCategory') for item in data]
+    # The categories are written before the products, the other sections are generated while the products
+    # are written, from the definitions of the current XML
+    write_catalog(target_file, data=data,
+                  sections=CatalogSections(templates=removed_sections, categories=categories), **output)
+
+
+def write_catalog(target_file: PurePath,
+                  catalog: Dict[str, Dict],
+                  data: Iterable[Union[Dict[str, Dict], str]],
+                  sections: 'CatalogSections',
+                  current_xml_file: PurePath,
+                  max_shard_bytes: Optional[int] = None,
+                  max_shard_products: Optional[int] = None,
+                  delta: bool = False,
+                  jobs: int = 1,
+                  compresslevel: int = DEFAULT_COMPRESSLEVEL) -> None:
+    """Write the generated products as a catalog XML, its shards, or its delta to `current_xml_file`,
+    see `create_xml_object()`
+    """
+    if delta:
+        write_xml_delta(target_file=get_catalog_file(target_file, '.delta', keep_suffix=True),
+                        catalog=catalog,
+                        data=data,
+                        current_xml_file=current_xml_file,
+                        sections=sections,
+                        compresslevel=compresslevel)
+        return
+
+    if max_shard_bytes or max_shard_products:
+        write_xml_shards(target_file=target_file,
+                         catalog=catalog,
+                         data=data,
+                         max_bytes=max_shard_bytes,
+                         max_products=max_shard_products,
+                         jobs=jobs,
+                         compresslevel=compresslevel,
+                         sections=sections)
+        return
+
+    # Each product is written as soon as it is created
+    write_xml(target_file=target_file,
+              catalog=catalog,
+              data=data,
+              compresslevel=compresslevel,
+              sections=sections)
+
+
+def generate_catalog_products(db: Dict[str, Dict],
+                              csv_extra_info: Dict[str, Dict[str, str]],
+                              xml_extra_info: Dict[str, Dict],
+                              jobs: int = 1,
+                              max_failures: float = MAX_FAILED_ITEMS_RATIO
+                              ) -> Iterator[Dict[str, Dict]]:
+    """Create every item of the full catalog and yield their XML, in the format of `xmltodict.parse()`
+
+    The series are shared among the worker processes, the products are yielded in the order
+    of `plan_catalog_items()` whatever the number of workers
+
+    Parameters
+    ----------
+    db : Dict[str, Dict]
+        the local database/catalog
+    csv_extra_info : Dict[str, Dict[str, str]]
+        the csv rows indexed by lowercase manufacturerSKU, from `load_csv_info()`
+    xml_extra_info : Dict[str, Dict]
+        the XML products indexed by '@product-id', from `load_xml_info()`
+    jobs : int, optional
+        number of worker processes, by default 1
+    max_failures : float, optional
+        largest share of the items that may fail to be created, by default `MAX_FAILED_ITEMS_RATIO`.
+        Above it, `CatalogGenerationError` is raised once every item was tried
+
+    Yields
+    -------
+    Iterator[Dict[str, Dict]]
+        The XML of each item
+    """
+    yield from generate_planned_products(plan_catalog_items(db), {BRAND: db}, csv_extra_info, xml_extra_info,
+                                         jobs=jobs, max_failures=max_failures)
+
+
+def plan_brand_items(csv_lines: List[Dict[str, str]],
+                     databases: Dict[str, Dict],
+                     brands: Optional[List[str]] = None) -> List[List[CatalogItem]]:
+    """List the items of each brand of the NCF template, in groups created by the same worker,
+    for `generate_planned_products()`
+
+    A brand with a vendor database is planned with `plan_catalog_items()`. The rows of the other brands are
+    grouped by `TEMPLATE_GROUP_SIZE`, a manufacturerSKU listed in several rows is only created once.
+    The groups of a brand are contiguous, in the order of the first row of each brand,
+    and all the groups of every brand are shared among the same worker processes
+
+    Parameters
+    ----------
+    csv_lines : List[Dict[str, str]]
+        the csv rows, from `load_csv_info()`
+    databases : Dict[str, Dict]
+        the vendor database of each brand that has one
+    brands : Optional[List[str]], optional
+        the brands to plan, in the order of the NCF template; every brand if None or empty, by default None
+
+    Returns
+    -------
+    List[List[CatalogItem]]
+        The groups of items of every brand
+    """
+    brand_lines = defaultdict(dict)
+    for line in csv_lines:
+        sku = line.get('manufacturerSKU')
+        if line.get('brand') and sku:
+            brand_lines[line['brand']].setdefault(sku.lower(), line)
+
+    unknown = [brand for brand in brands or [] if brand not in brand_lines and brand not in databases]
+    if unknown:
+        log.warning(f'No item of the brands {unknown} in the NCF template.')
+
+    plan = []
+    for brand in brands or list(brand_lines):
+        if brand in databases:
+            plan.extend(plan_catalog_items(databases[brand], brand=brand))
+            continue
+        items = [CatalogItem(line.get('c__productTypeNonoperative') or 'Product', line['manufacturerSKU'],
+                             TEMPLATE_CATALOG_TYPE, brand)
+                 for line in brand_lines.get(brand, {}).values()]
+        plan.extend(items[start:start + TEMPLATE_GROUP_SIZE] for start in range(0, len(items), TEMPLATE_GROUP_SIZE))
+    log.info(f'Bulk generation of {sum(len(items) for items in plan)} items of {len(brands or brand_lines)} brands.')
+    return plan
+
+
+def generate_planned_products(plan: List[List[CatalogItem]],
+                              databases: Dict[str, Dict],
+                              csv_extra_info: Dict[str, Dict[str, str]],
+                              xml_extra_info: Dict[str, Dict],
+                              jobs: int = 1,
+                              max_failures: float = MAX_FAILED_ITEMS_RATIO
+                              ) -> Iterator[Dict[str, Dict]]:
+    """Create the items of `plan`, group by group in the worker processes, and yield their XML in order
+
+    An item whose database info is missing (`MissingCatalogInfo`) is left out and logged, see `check_failures()`
+    """
+    set_shared_generation_data((databases, csv_extra_info, xml_extra_info))
+
+    progress = Progress(SpinnerColumn(),
+                        "[magenta]{task.description}",
+                        BarColumn(),
+                        "({task.completed} of {task.total})",
+                        TimeElapsedColumn(),
+                        console=console,
+                        transient=True)
+
+    failures = []
+    with progress, create_generation_pool(jobs) if jobs > 1 else nullcontext() as pool:
+        task = progress.add_task('Generating catalog XML...', total=len(plan), start=True)
+        # `imap()` returns the groups (e.g. series) in order, as soon as each one is done
+        results = pool.imap(generate_items, plan) if pool else map(generate_items, plan)
+        for products, item_failures in results:
+            yield from products
+            failures.extend(item_failures)
+            progress.advance(task)
+
+    check_failures(failures, total=sum(len(items) for items in plan), max_failures=max_failures)
+
+
+def check_failures(failures: List[Tuple[CatalogItem, str]], total: int, max_failures: float) -> None:
+    """Log every item that cannot be created, and fail the run if there are too many
+
+    Raises
+    ------
+    CatalogGenerationError
+        If more than `max_failures` of the `total` items failed
+    """
+    for item, error in failures:
+        log.warning(f'{item.product_type} "{item.sku}" ({item.brand}) is not in the XML: {error}')
+    if failures:
+        log.warning(f'{len(failures)} of {total} items cannot be created from the database and are not in the XML.')
+    if total and len(failures) / total > max_failures:
+        raise CatalogGenerationError(f'{len(failures)} of {total} items cannot be created, '
+                                     f'more than {max_failures:.0%}: the catalog XML is not written.')
+
+
+def plan_catalog_items(db: Dict[str, Dict], brand: str = BRAND) -> List[List[CatalogItem]]:
+    """List the items of the full catalog, grouped by series
+
+    Units are created according to their productTypeNonoperative and series variations as 'Variation Product'.
+    An item listed in several series is only created in the first one.
+    The products that are not in any series are grouped last, as 'Product'
+
+    Parameters
+    ----------
+    db : Dict[str, Dict]
+        the local database/catalog
+    brand : str, optional
+        the brand of the database, by default `BRAND`
+
+    Returns
+    -------
+    List[List[CatalogItem]]
+        The items of each series, then the standalone products
+    """
+    seen = set()
+    plan = []
+    for series in db['series'].values():
+        series_items = []
+        for item_type in ['units', 'variations']:
+            for line in series.get(item_type, []):
+                for details in line['details']:
+                    sku = details.get('manufacturerSku')
+                    product_type = details.get('productTypeNonoperative')
+                    if not sku or product_type not in ITEM_CLASSES or sku in seen:
+                        continue
+                    seen.add(sku)
+                    series_items.append(CatalogItem(product_type, sku, item_type, brand))
+        plan.append(series_items)
+
+    plan.append([CatalogItem('Product', sku, 'products', brand)
+                 for sku in db['products']
+                 if sku not in seen])
+    return plan
+
+
+def plan_categories(plan: List[List[CatalogItem]],
+                    databases: Dict[str, Dict],
+                    csv_extra_info: Dict[str, Dict[str, str]]) -> List[str]:
+    """List the product categories of the items of `plan`, before the items are created
+
+    The category of an item is looked up the same way as its 'productCategory' custom attribute,
+    see `get_product_category()` and `Template_Product`. An item that cannot be created still has its category
+    listed if the category is known
+
+    Returns
+    -------
+    List[str]
+        The categories, in the order of their first item
+    """
+    categories = {}
+    for items in plan:
+        for item in items:
+            csv_info = get_item_csv_info(csv_extra_info, item.sku)
+            if item.catalog_type == TEMPLATE_CATALOG_TYPE:
+                category = csv_info.get('c__productCategory')
+            else:
+                try:
+                    category = get_product_category(sku=item.sku, item_type=item.catalog_type,
+                                                    database=databases[item.brand], csv_info=csv_info)
+                except MissingCatalogInfo:
+                    continue
+            if category:
+                categories.setdefault(category, None)
+    return list(categories)
+
+
+def generate_items(items: List[CatalogItem]) -> Tuple[List[Dict[str, Dict]], List[Tuple[CatalogItem, str]]]:
+    """Create the XML of a group of items, using `shared_generation_data`
+
+    Returns
+    -------
+    Tuple[List[Dict[str, Dict]], List[Tuple[CatalogItem, str]]]
+        The XML of each item, and the items that cannot be created with the error
+    """
+    products = []
+    failures = []
+    for item in items:
+        try:
+            products.append(create_item_xml(item))
+        except MissingCatalogInfo as error:
+            # Any other error is a bug and stops the run
+            failures.append((item, repr(error)))
+    return products, failures
+
 
-    data = []
+def render_items(items: List[CatalogItem]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Create the XML of a group of items as `<product>` fragments, using `shared_generation_data`
+
+    Returns
+    -------
+    List[Tuple[Optional[str], Optional[str]]]
+        (fragment, None) of each item, or (None, error) if the item cannot be created
+    """
+    results = []
+    for item in items:
+        try:
+            results.append((render_product(create_item_xml(item)['product']), None))
+        except MissingCatalogInfo as error:
+            results.append((None, repr(error)))
+    return results
+
+
+def create_item_xml(item: CatalogItem) -> Dict[str, Dict]:
+    """Create an item of the full catalog and return its XML, using `shared_generation_data`"""
+    databases, csv_extra_info, xml_extra_info = shared_generation_data
+    extra_info = get_item_extra_info(csv_extra_info=csv_extra_info,
+                                     xml_extra_info=xml_extra_info,
+                                     sku=item.sku)
+    if item.catalog_type == TEMPLATE_CATALOG_TYPE:
+        product = Template_Product(sku=item.sku,
+                                   brand=item.brand,
+                                   catalog_info={},
+                                   extra_info=extra_info,
+                                   product_type_nonoperative=item.product_type)
+        return product.to_xml()
+    # Standalone products are not in a series, their info comes from the database 'products'
+    product = ITEM_CLASSES[item.product_type](sku=item.sku,
+                                              brand=item.brand,
+                                              catalog_info=databases[item.brand],
+                                              extra_info=extra_info,
+                                              catalog_type=item.catalog_type)
+    return product.to_xml()
+
+
+def set_shared_generation_data(data: Tuple[Dict, Dict, Dict]) -> None:
+    global shared_generation_data
+    shared_generation_data = data
+
+
+def create_generation_pool(jobs: int) -> Pool:
+    """Create the worker processes generating the full catalog, sharing `shared_generation_data`
+
+    With 'fork', the workers share the data of the parent copy-on-write;
+    otherwise the data is sent once to each worker
+    """
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork').Pool(processes=jobs)
+    return multiprocessing.Pool(processes=jobs,
+                                initializer=set_shared_generation_data,
+                                initargs=(shared_generation_data,))
+
+
+def generate_catalog_fragments(db: Dict[str, Dict],
+                               csv_extra_info: Dict[str, Dict[str, str]],
+                               xml_extra_info: Dict[str, Dict],
+                               cache_file: PurePath,
+                               jobs: int = 1,
+                               max_failures: float = MAX_FAILED_ITEMS_RATIO
+                               ) -> Iterator[str]:
+    """Yield the `<product>` fragment of every item of the full catalog, only re-creating the items
+    whose inputs changed since the previous run
+
+    Each fragment is cached in `cache_file` with a hash of the inputs of its item, see `get_fragment_keys()`.
+    The fragments are yielded in the order of `plan_catalog_items()`, the same as `generate_catalog_products()`
+
+    Parameters
+    ----------
+    db : Dict[str, Dict]
+        the local database/catalog
+    csv_extra_info : Dict[str, Dict[str, str]]
+        the csv rows indexed by lowercase manufacturerSKU, from `load_csv_info()`
+    xml_extra_info : Dict[str, Dict]
+        the XML products indexed by '@product-id', from `load_xml_info()`
+    cache_file : PurePath
+        file path for the cached fragments, created if it does not exist
+    jobs : int, optional
+        number of worker processes re-creating the changed items, by default 1
+    max_failures : float, optional
+        largest share of the items that may fail to be created, by default `MAX_FAILED_ITEMS_RATIO`.
+        Above it, `CatalogGenerationError` is raised once every item was tried
+
+    Yields
+    -------
+    Iterator[str]
+        The `<product>` XML of each item
+    """
+    plan = plan_catalog_items(db)
+    keys = get_fragment_keys(plan, db, csv_extra_info, xml_extra_info)
+
+    cache = {}
+    if Path(cache_file).exists():
+        with open(cache_file, 'r') as fin:
+            cache = json.load(fin)['fragments']
+
+    # Only the items whose key changed are created again
+    dirty = [[(item, key) for item, key in zip(items, item_keys) if cache.get(item.sku, [None])[0] != key]
+             for items, item_keys in zip(plan, keys)]
+    dirty_plan = [[item for item, _ in dirty_items] for dirty_items in dirty]
+    misses = sum(len(items) for items in dirty_plan)
+    set_shared_generation_data(({BRAND: db}, csv_extra_info, xml_extra_info))
+
+    progress = Progress(SpinnerColumn(),
+                        "[magenta]{task.description}",
+                        BarColumn(),
+                        "({task.completed} of {task.total})",
+                        TimeElapsedColumn(),
+                        console=console,
+                        transient=True)
+
+    fragments = {}
+    failures = []
+    with progress, create_generation_pool(jobs) if jobs > 1 and misses else nullcontext() as pool:
+        task = progress.add_task('Generating catalog XML...', total=len(plan), start=True)
+        results = pool.imap(render_items, dirty_plan) if pool else map(render_items, dirty_plan)
+        for items, dirty_items, rendered in zip(plan, dirty, results):
+            cache.update({item.sku: [key, fragment, error]
+                          for (item, key), (fragment, error) in zip(dirty_items, rendered)})
+            for item in items:
+                _, fragment, error = fragments[item.sku] = cache[item.sku]
+                if fragment is None:
+                    failures.append((item, error))
+                    continue
+                yield fragment
+            progress.advance(task)
+
+    # Only keep the items of the current catalog
+    with open(cache_file, 'w') as fout:
+        json.dump({'render_version': FRAGMENT_RENDER_VERSION, 'fragments': fragments}, fout)
+
+    total = sum(len(items) for items in plan)
+    log.info(f'Fragment cache: {total - misses} hits, {misses} misses (re-created) of {total} items.')
+    check_failures(failures, total=total, max_failures=max_failures)
+
+
+def get_fragment_keys(plan: List[List[CatalogItem]],
+                      db: Dict[str, Dict],
+                      csv_extra_info: Dict[str, Dict[str, str]],
+                      xml_extra_info: Dict[str, Dict]
+                      ) -> List[List[str]]:
+    """Hash the inputs of each item of `plan_catalog_items()`, for the cache of `generate_catalog_fragments()`
+
+    The inputs of an item are its series (the units and variations the series attributes are computed from),
+    its database records, its csv row, its current XML entry and `FRAGMENT_RENDER_VERSION`
+
+    Returns
+    -------
+    List[List[str]]
+        The key of each item, grouped like `plan`
+    """
+    # The series of each group of `plan`, the standalone products are last
+    series_hashes = [hash_json(series) for series in db['series'].values()] + [None]
+    keys = []
+    for items, series_hash in zip(plan, series_hashes):
+        keys.append([hash_json([FRAGMENT_RENDER_VERSION,
+                                item,
+                                series_hash,
+                                db['variations'].get(item.sku),
+                                db['products'].get(item.sku),
+                                get_item_extra_info(csv_extra_info=csv_extra_info,
+                                                    xml_extra_info=xml_extra_info,
+                                                    sku=item.sku)])
+                     for item in items])
+    return keys
+
+
+def hash_json(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def generate_products(db: Dict[str, Dict],
+                      csv_extra_info: Dict[str, Dict[str, str]],
+                      xml_extra_info: Dict[str, Dict]
+                      ) -> Iterator[Dict[str, Dict]]:
+    """Create the items and yield their XML, in the format of `xmltodict.parse()`"""
 
     # for unit in db['series']['series-7']['units'][0]['details']:
     # for unit in db['series']['series-16']['units'][0]['details']:   # has 'Electronic or Millivolt' ignition type option
@@ -120,7 +785,7 @@ def create_xml_object(database_file: PurePath,
     #                                 catalog_info=db,
     #                                 extra_info=test_item_extra_info)
 
-    #         data.append(product.to_xml())
+    #         yield product.to_xml()
 
     # # 'Product'
     # test_series = [
@@ -140,7 +805,7 @@ def create_xml_object(database_file: PurePath,
     #                                 catalog_info=db,
     #                                 extra_info=test_item_extra_info)
 
-    #         data.append(product.to_xml())
+    #         yield product.to_xml()
 
     # 'Variation Product'
     test_series = [
@@ -154,7 +819,7 @@ def create_xml_object(database_file: PurePath,
         for variation_line in db['series'][series]['variations']:    # venting 'Top & Rear', should NOT have `'selectOptionVentConfiguration'`
             for variation in variation_line['details']:    # venting 'Top & Rear', should NOT have `'selectOptionVentConfiguration'`
                 test_item_sku = variation['manufacturerSku']
-                test_item_brand = 'Napoleon'
+                test_item_brand = BRAND
                 test_item_extra_info = get_item_extra_info(csv_extra_info=csv_extra_info,
                                                         xml_extra_info=xml_extra_info,
                                                         sku=test_item_sku)
@@ -164,12 +829,7 @@ def create_xml_object(database_file: PurePath,
                                         catalog_info=db,
                                         extra_info=test_item_extra_info)
 
-                data.append(product.to_xml())
-
-    write_xml(target_file=NAPOLEON_XML_FILE,
-              current_xml_file=CURRENT_XML_FILE,
-              data=data)
-    # print(f'{test=}')
+                yield product.to_xml()
 
 
 def load_db(database_file: PurePath):
@@ -177,24 +837,148 @@ def load_db(database_file: PurePath):
         return json.load(fin)
 
 
-def load_csv_info(csv_file: PurePath) -> List[Dict[str, str]]:
+def load_csv_info(csv_file: PurePath) -> Tuple[List[Dict[str, str]], Dict[str, Dict[str, str]]]:
+    """Load the NCF template csv file
+
+    Returns
+    -------
+    Tuple[List[Dict[str, str]], Dict[str, Dict[str, str]]]
+        The rows of the csv file, and an index of the rows by lowercase manufacturerSKU.
+        Rows sharing the same manufacturerSKU are merged, the later row winning on the same column
+    """
     with open(csv_file, 'r') as fin:
         dict_reader = csv.DictReader(fin)
         # return {key: value
         #         for line in dict_reader
         #         for key, value in line.items()}
-        return [line for line in dict_reader]
+        lines = [line for line in dict_reader]
+
+    index = defaultdict(dict)
+    for line in lines:
+        index[line.get('manufacturerSKU').lower()].update(line)
+    return lines, dict(index)
+
+
+def load_xml_info(xml_file: PurePath,
+                  removed_sections: Optional[Dict[str, List]] = None
+                  ) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """Stream the current catalog XML file, keeping only what the XML generation uses
+
+    Each element is cleared as soon as it is read, so the memory used is the size of the returned index,
+    not the size of the whole XML tree. A '.gz' file is decompressed while it is read
+
+    Parameters
+    ----------
+    xml_file : PurePath
+        file path to the current catalog XML
+    removed_sections : Optional[Dict[str, List]], optional
+        if given, the `REMOVED_CATALOG_SECTIONS` are added to it, a list of elements by tag
+        (e.g. the templates of `CatalogSections`), by default None
+
+    Returns
+    -------
+    Tuple[Dict[str, Dict], Dict[str, Dict]]
+        The `<catalog>` without its `<product>` and without `REMOVED_CATALOG_SECTIONS`
+        (in the format of `xmltodict.parse()`, 'product' is kept as a placeholder at its position),
+        and an index of the '@product-id', 'upc' and 'page-attributes' of each `<product>` by '@product-id'.
+        Products sharing the same ID are merged, the later product winning on the same key
+    """
+    catalog = {}
+    index = defaultdict(dict)
+    prefixes = {XML_NAMESPACE: 'xml'}
+    depth = 0
+    with open_catalog_file(xml_file) as fin:
+        for event, elem in ET.iterparse(fin, events=('start-ns', 'start', 'end')):
+            if event == 'start-ns':
+                prefix, uri = elem
+                prefixes[uri] = prefix
+                # Namespace declarations of the root, the same as `xmltodict` reading them as attributes
+                if not depth:
+                    catalog[f'@xmlns:{prefix}' if prefix else '@xmlns'] = uri
+            elif event == 'start':
+                if not depth:
+                    root = elem
+                    catalog.update(convert_attributes(elem, prefixes))
+                depth += 1
+            else:
+                depth -= 1
+                if depth != 1:
+                    continue
+
+                tag = convert_name(elem.tag, prefixes)
+                if tag == 'product':
+                    product = element_to_dict(elem, prefixes)
+                    catalog.setdefault('product', None)
+                    index[product['@product-id']].update({key: value
+                                                          for key, value in product.items()
+                                                          if key == '@product-id' or key in PRODUCT_XML_FIELDS})
+                elif tag not in REMOVED_CATALOG_SECTIONS:
+                    add_child(catalog, tag, element_to_dict(elem, prefixes))
+                elif removed_sections is not None:
+                    removed_sections.setdefault(tag, []).append(element_to_dict(elem, prefixes))
+                # Done with this section, drop it from the tree
+                root.clear()
+    return catalog, dict(index)
+
+
+def element_to_dict(elem: ET.Element, prefixes: Dict[str, str]) -> Union[Dict, str, None]:
+    """Convert an ElementTree element into the same value as `xmltodict.parse()` gives for it"""
+    value = convert_attributes(elem, prefixes)
+    for child in elem:
+        add_child(value, convert_name(child.tag, prefixes), element_to_dict(child, prefixes))
+
+    # `xmltodict` joins all the text pieces, then strips the whitespace
+    text = ''.join([elem.text or ''] + [child.tail or '' for child in elem]).strip() or None
+    if not value:
+        return text
+    if text is not None:
+        value['#text'] = text
+    return value
+
+
+def add_child(value: Dict, tag: str, child: Union[Dict, str, None]) -> None:
+    """Add a child element to an `xmltodict` value, repeated tags becoming a list"""
+    if tag not in value:
+        value[tag] = child
+    elif isinstance(value[tag], list):
+        value[tag].append(child)
+    else:
+        value[tag] = [value[tag], child]
+
 
+def convert_attributes(elem: ET.Element, prefixes: Dict[str, str]) -> Dict[str, str]:
+    return {f'@{convert_name(name, prefixes)}': value for name, value in elem.attrib.items()}
 
-def load_xml_info(xml_file: PurePath) -> Dict[str, str]:
-    with open(xml_file) as fd:
-        return xmltodict.parse(fd.read())
 
+def convert_name(name: str, prefixes: Dict[str, str]) -> str:
+    """Turn the '{uri}name' of ElementTree back into the name written in the file, e.g. 'xml:lang'"""
+    if not name.startswith('{'):
+        return name
+    uri, name = name[1:].split('}')
+    prefix = prefixes.get(uri)
+    return f'{prefix}:{name}' if prefix else name
 
-def get_item_extra_info(csv_extra_info: List[Dict[str, str]],
-                        xml_extra_info: Dict[str, str],
+
+def get_item_extra_info(csv_extra_info: Dict[str, Dict[str, str]],
+                        xml_extra_info: Dict[str, Dict],
                         sku: str
                         ) -> Dict[str, Dict[str, str]]:
+    """Get the info of an item from the NCF template and from the current XML
+
+    Parameters
+    ----------
+    csv_extra_info : Dict[str, Dict[str, str]]
+        the csv rows indexed by lowercase manufacturerSKU, from `load_csv_info()`
+    xml_extra_info : Dict[str, Dict]
+        the XML products indexed by '@product-id', from `load_xml_info()`
+    sku : str
+        the manufacturerSKU of the item
+
+    Returns
+    -------
+    Dict[str, Dict[str, str]]
+        {'csv': row of the item, 'xml': product of the item}, empty dicts if not found
+    """
     # Get extra info from CSV file
     csv_info = get_item_csv_info(csv_extra_info, sku)
     item_id = csv_info.get('ID')
@@ -207,27 +991,41 @@ def get_item_extra_info(csv_extra_info: List[Dict[str, str]],
     return extra_info
 
 
-def get_item_csv_info(csv_extra_info: List[Dict[str, str]],
+def get_item_csv_info(csv_extra_info: Dict[str, Dict[str, str]],
                       sku: str
                       ) -> Dict[str, str]:
-    return {key: value
-            for item in csv_extra_info
-            if item.get('manufacturerSKU').lower() == sku.lower()
-            for key, value in item.items()}
+    # Copy so that the item never changes the shared index
+    return dict(csv_extra_info.get(sku.lower(), {}))
 
 
-def get_item_xml_info(xml_extra_info: Dict[str, str],
+def get_item_xml_info(xml_extra_info: Dict[str, Dict],
                       item_id: str
                       ) -> Dict[str, str]:
-    return {key: value
-            for product in xml_extra_info['catalog']['product']
-            if product['@product-id'] == item_id
-            for key, value in product.items()}
+    return dict(xml_extra_info.get(item_id, {}))
 
 
 def write_xml(target_file: PurePath,
-              current_xml_file: PurePath,
-              data: str) -> None:
+              catalog: Dict[str, Dict],
+              data: Iterable[Union[Dict[str, Dict], str]],
+              compresslevel: int = DEFAULT_COMPRESSLEVEL,
+              sections: Optional['CatalogSections'] = None) -> None:
+    """Write the generated products into the catalog XML file, one product at a time
+
+    Parameters
+    ----------
+    target_file : PurePath
+        file path for the catalog XML, compressed while it is written if it ends with '.gz'
+    catalog : Dict[str, Dict]
+        the `<catalog>` of the current XML, from `load_xml_info()`
+    data : Iterable[Union[Dict[str, Dict], str]]
+        the products, each one as {'product': ...} in the format of `xmltodict.parse()`,
+        or already written as a `<product>` fragment by `render_product()`
+    compresslevel : int, optional
+        gzip level of a '.gz' file, by default `DEFAULT_COMPRESSLEVEL`
+    sections : Optional[CatalogSections], optional
+        if given, the sections generated from the products, written instead of the same sections of `catalog`:
+        the planned categories before the products, the others after them, by default None
+    """
     # * Using ET
     # # To prevent ET from adding `ns` as namespace
     # ET.register_namespace('', 'http://www.demandware.com/xml/impex/catalog/2006-10-31')
@@ -238,26 +1036,586 @@ def write_xml(target_file: PurePath,
     # root.append(elements)
     # target_file.write_bytes(prettify(root))
 
-    # * Using xmltodict
-    result_xml = load_xml_info(current_xml_file)
+    # * Using xmltodict, the `<catalog>` read by `load_xml_info()` is already without `REMOVED_CATALOG_SECTIONS`
+    writer = CatalogXmlWriter(target_file, catalog, compresslevel=compresslevel)
+    if sections:
+        writer.sections_before = sections.merge_before(writer.sections_before)
+    with writer:
+        for item in data:
+            if isinstance(item, str):
+                writer.write_fragment(item)
+            else:
+                writer.write_product(item['product'])
+            if sections:
+                sections.add_product(item)
+        if sections:
+            writer.sections_after = sections.merge_after(writer.sections_after)
+
+
+def write_xml_shards(target_file: PurePath,
+                     catalog: Dict[str, Dict],
+                     data: Iterable[Union[Dict[str, Dict], str]],
+                     max_bytes: Optional[int] = None,
+                     max_products: Optional[int] = None,
+                     jobs: int = 1,
+                     compresslevel: int = DEFAULT_COMPRESSLEVEL,
+                     sections: Optional['CatalogSections'] = None) -> Dict:
+    """Write the generated products into several catalog XML files ("shards") and a manifest listing them
+
+    Each shard is a full `<catalog>` with the root attributes and the sections before the products
+    (e.g. the 'category's), the sections after the products (e.g. 'category-assignment') are only in the last shard.
+    A shard is written by a thread as soon as it is full, while the next products are still being generated.
+    The shards are named after `target_file`, e.g. 'napoleon-001.xml' (or 'napoleon-001.xml.gz' if it is gzipped),
+    and the manifest is 'napoleon.manifest.json'. The shards are kept as '.partial' files until all of them
+    are written, then renamed, and the manifest is replaced last. If the products cannot all be written,
+    only the '.partial' files are deleted: the shards and manifest of a previous run stay as they were
+
+    Parameters
+    ----------
+    target_file : PurePath
+        file path the shard and manifest names are based on
+    catalog : Dict[str, Dict]
+        the `<catalog>` of the current XML, from `load_xml_info()`
+    data : Iterable[Union[Dict[str, Dict], str]]
+        the products, like `write_xml()`
+    max_bytes : Optional[int], optional
+        maximum bytes of products in a shard, the root and other sections add to it, by default None.
+        A product larger than `max_bytes` is alone in its shard
+    max_products : Optional[int], optional
+        maximum number of products in a shard, by default None
+    jobs : int, optional
+        number of threads writing the shards, by default 1
+    compresslevel : int, optional
+        gzip level of '.gz' shards, by default `DEFAULT_COMPRESSLEVEL`
+    sections : Optional[CatalogSections], optional
+        if given, the sections generated from the products: the planned categories are written in every shard,
+        the other sections in the last shard, by default None
+
+    Returns
+    -------
+    Dict
+        The manifest: the total products, and the file, products, bytes and sha256 of each shard
+    """
+    target_file = Path(target_file)
+    manifest_file = get_catalog_file(target_file, '.manifest.json')
+
+    futures = []
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            fragments = []
+            size = 0
+            for item in data:
+                fragment = item if isinstance(item, str) else render_product(item['product'])
+                fragment_size = len(fragment.encode(CatalogXmlWriter.UNPARSE_OPTIONS['encoding']))
+                if fragments and ((max_products and len(fragments) >= max_products)
+                                  or (max_bytes and size + fragment_size > max_bytes)):
+                    # The shard is full, but not the last one since there is another product
+                    futures.append(executor.submit(write_xml_shard, get_shard_file(target_file, len(futures) + 1),
+                                                   catalog, fragments, False, compresslevel, sections))
+                    fragments = []
+                    size = 0
+                fragments.append(fragment)
+                size += fragment_size
+                if sections:
+                    sections.add_product(item)
+            futures.append(executor.submit(write_xml_shard, get_shard_file(target_file, len(futures) + 1),
+                                           catalog, fragments, True, compresslevel, sections))
+            shards = [future.result() for future in futures]
+    except Exception:
+        # Only the shards of the failed run are deleted, no shard of a previous run is replaced
+        for number in range(1, len(futures) + 1):
+            get_partial_file(get_shard_file(target_file, number)).unlink(missing_ok=True)
+        raise
+
+    for number in range(1, len(shards) + 1):
+        shard_file = get_shard_file(target_file, number)
+        get_partial_file(shard_file).replace(shard_file)
+
+    # Remove the shards of a previous run that are not overwritten
+    if manifest_file.exists():
+        with open(manifest_file, 'r') as fin:
+            previous_shards = {shard['file'] for shard in json.load(fin)['shards']}
+        for name in previous_shards - {shard['file'] for shard in shards}:
+            (target_file.parent / name).unlink(missing_ok=True)
+
+    manifest = {'products': sum(shard['products'] for shard in shards),
+                'max_bytes': max_bytes,
+                'max_products': max_products,
+                'shards': shards}
+    partial_manifest_file = get_partial_file(manifest_file)
+    with open(partial_manifest_file, 'w') as fout:
+        json.dump(manifest, fout, indent=4)
+    partial_manifest_file.replace(manifest_file)
+    log.info(f'Wrote {manifest["products"]} products into {len(shards)} shards, see "{manifest_file.name}".')
+    return manifest
+
+
+def write_xml_delta(target_file: PurePath,
+                    catalog: Dict[str, Dict],
+                    data: Iterable[Union[Dict[str, Dict], str]],
+                    current_xml_file: PurePath,
+                    sections: 'CatalogSections',
+                    compresslevel: int = DEFAULT_COMPRESSLEVEL) -> Dict[str, List[str]]:
+    """Write only the generated products that are new or changed compared to the current catalog XML
+
+    The products are compared with the hash of their canonical form and of their category assignments,
+    see `get_product_hash()`: a product moved to another category is changed.
+    Both sides are streamed: only the hash and brand of each current product are kept in memory.
+    The delta has the generated sections too (e.g. the categories), but only the category assignments
+    of its own products.
+    The new, changed and removed product IDs are saved next to `target_file`, as JSON,
+    a current product is removed if its brand is generated but its ID is not
+    (e.g. the other brands of the 'ncf-mc-all' export are never removed)
+
+    Parameters
+    ----------
+    target_file : PurePath
+        file path for the delta catalog XML
+    catalog : Dict[str, Dict]
+        the `<catalog>` of the current XML, from `load_xml_info()`, only its root attributes are written
+    data : Iterable[Union[Dict[str, Dict], str]]
+        the products, like `write_xml()`
+    current_xml_file : PurePath
+        file path to the catalog XML that is already live
+    sections : CatalogSections
+        the sections generated from the products, like `write_xml()`
+    compresslevel : int, optional
+        gzip level of a '.gz' target file, by default `DEFAULT_COMPRESSLEVEL`
+
+    Returns
+    -------
+    Dict[str, List[str]]
+        The 'new', 'changed' and 'removed' product IDs
+    """
+    current = load_product_hashes(current_xml_file)
+    delta = {'new': [], 'changed': [], 'removed': []}
+    generated_ids = set()
+    brands = set()
+    # The other sections of the current XML are already live
+    root = {key: value for key, value in catalog.items() if key.startswith('@')}
+    writer = CatalogXmlWriter(target_file, root, compresslevel=compresslevel)
+    writer.sections_before = sections.merge_before(writer.sections_before)
+    with writer:
+        for item in data:
+            fragment = item if isinstance(item, str) else render_product(item['product'])
+            product = element_to_dict(ET.fromstring(fragment), {XML_NAMESPACE: 'xml'})
+            product_id = product['@product-id']
+            category_id = sections.add_product({'product': product})
+            generated_ids.add(product_id)
+            brands.add(get_product_brand(product))
+            if product_id not in current:
+                delta['new'].append(product_id)
+            elif current[product_id][0] != get_product_hash(product, [category_id] if category_id else []):
+                delta['changed'].append(product_id)
+            else:
+                continue
+            writer.write_fragment(fragment)
+        writer.sections_after = sections.merge_after(writer.sections_after,
+                                                     product_ids=set(delta['new'] + delta['changed']))
+
+    delta['removed'] = sorted(product_id
+                              for product_id, (_, brand) in current.items()
+                              if brand in brands and product_id not in generated_ids)
+    with open(get_catalog_file(target_file, '.json'), 'w') as fout:
+        json.dump(delta, fout, indent=4)
+    log.info(f'Delta of {len(generated_ids)} products: {len(delta["new"])} new, {len(delta["changed"])} changed, '
+             f'{len(delta["removed"])} removed.')
+    return delta
+
+
+def load_product_hashes(xml_file: PurePath) -> Dict[str, Tuple[str, Optional[str]]]:
+    """Stream a catalog XML file and return the hash and brand of each `<product>` by '@product-id'
+
+    The hash covers the `<category-assignment>`s of the product, read in the same pass.
+    Products sharing the same ID are hashed separately, the later product winning
+    """
+    products = {}
+    category_ids = defaultdict(list)
+    prefixes = {XML_NAMESPACE: 'xml'}
+    depth = 0
+    with open_catalog_file(xml_file) as fin:
+        for event, elem in ET.iterparse(fin, events=('start-ns', 'start', 'end')):
+            if event == 'start-ns':
+                prefix, uri = elem
+                prefixes[uri] = prefix
+            elif event == 'start':
+                if not depth:
+                    root = elem
+                depth += 1
+            else:
+                depth -= 1
+                if depth != 1:
+                    continue
+                tag = convert_name(elem.tag, prefixes)
+                if tag == 'product':
+                    products[elem.get('product-id')] = element_to_dict(elem, prefixes)
+                elif tag == 'category-assignment':
+                    category_ids[elem.get('product-id')].append(elem.get('category-id'))
+                root.clear()
+    return {product_id: (get_product_hash(product, category_ids[product_id]), get_product_brand(product))
+            for product_id, product in products.items()}
+
+
+def get_product_hash(product: Dict, category_ids: Iterable[str] = ()) -> str:
+    """Hash a `<product>` in the format of `xmltodict.parse()`, with the IDs of the categories it is assigned to
+
+    The order of the attributes and of the repeated elements (e.g. the 'custom-attribute's or the categories)
+    does not change the hash, nor does the whitespace around the texts
+    """
+    return hash_json(canonicalize({'product': product, 'category-assignment': list(category_ids)}))
+
+
+def canonicalize(value: Union[Dict, List, str, None]) -> Union[Dict, List, str, None]:
+    if isinstance(value, dict):
+        return {key: canonicalize(child) for key, child in value.items()}
+    if isinstance(value, list):
+        return sorted((canonicalize(child) for child in value), key=lambda child: json.dumps(child, sort_keys=True))
+    return value
+
+
+def get_product_brand(product: Dict) -> Optional[str]:
+    brand = product.get('brand')
+    return brand.get('#text') if isinstance(brand, dict) else brand
 
-    # ! Remove `<variation-attribute>` tags for now,
-    # TODO remove this later for completion
-    remove_tags = ['variation-attribute', 'product-option', 'header', 'category']
-    for tag in remove_tags:
-        del result_xml['catalog'][tag]
 
-    # Update `<product>` tags with all new info
-    # result_xml['catalog'].update(xmltodict.parse(data))
-    result_xml['catalog']['product'] = []
-    for item in data:
-        result_xml['catalog']['product'].append(item['product'])
+def write_xml_shard(target_file: PurePath,
+                    catalog: Dict[str, Dict],
+                    fragments: List[str],
+                    last: bool,
+                    compresslevel: int = DEFAULT_COMPRESSLEVEL,
+                    sections: Optional['CatalogSections'] = None) -> Dict:
+    """Write one shard of `write_xml_shards()` into its '.partial' file and return its manifest entry"""
+    writer = CatalogXmlWriter(target_file, catalog, sections_after=last, compresslevel=compresslevel, commit=False)
+    if sections:
+        writer.sections_before = sections.merge_before(writer.sections_before)
+    with writer:
+        for fragment in fragments:
+            writer.write_fragment(fragment)
+        if sections and last:
+            writer.sections_after = sections.merge_after(writer.sections_after)
+    content = writer.partial_file.read_bytes()
+    return {'file': Path(target_file).name,
+            'products': len(fragments),
+            'bytes': len(content),
+            'sha256': hashlib.sha256(content).hexdigest()}
 
-    target_file.write_text(xmltodict.unparse(result_xml,
-                                             encoding='UTF-8',
-                                             pretty=True,
-                                             short_empty_elements=True,
-                                             indent='    '))
+
+def get_shard_file(target_file: PurePath, number: int) -> Path:
+    return get_catalog_file(target_file, f'-{number:03d}', keep_suffix=True)
+
+
+def get_partial_file(target_file: PurePath) -> Path:
+    """The file written before `target_file` is complete, e.g. 'napoleon.partial.xml' of 'napoleon.xml'"""
+    return get_catalog_file(target_file, '.partial', keep_suffix=True)
+
+
+def get_catalog_file(catalog_file: PurePath, name_suffix: str, keep_suffix: bool = False) -> Path:
+    """Name another file after a catalog XML file
+
+    e.g. 'napoleon.xml.gz' with '.manifest.json' is 'napoleon.manifest.json',
+    and with '.delta' and `keep_suffix` is 'napoleon.delta.xml.gz'
+    """
+    catalog_file = Path(catalog_file)
+    suffixes = catalog_file.suffixes[-2:] if catalog_file.suffix == GZIP_SUFFIX else catalog_file.suffixes[-1:]
+    stem = catalog_file.name[:len(catalog_file.name) - len(''.join(suffixes))]
+    return catalog_file.with_name(stem + name_suffix + (''.join(suffixes) if keep_suffix else ''))
+
+
+def open_catalog_file(catalog_file: PurePath, mode: str = 'rb',
+                      compresslevel: int = DEFAULT_COMPRESSLEVEL) -> BinaryIO:
+    """Open a catalog XML file in binary mode, through gzip if it ends with '.gz'
+
+    The gzip header has no modification time, so the same catalog is always compressed to the same bytes
+    """
+    if Path(catalog_file).suffix == GZIP_SUFFIX:
+        return gzip.GzipFile(catalog_file, mode, compresslevel=compresslevel, mtime=0)
+    return open(catalog_file, mode)
+
+
+def render_product(product: Dict) -> str:
+    """Return the `<product>` XML the way `CatalogXmlWriter` writes it, to be written later with `write_fragment()`"""
+    stream = io.BytesIO()
+    xmltodict.unparse({'product': product},
+                      output=stream,
+                      full_document=False,
+                      depth=1,
+                      **CatalogXmlWriter.UNPARSE_OPTIONS)
+    return stream.getvalue().decode(CatalogXmlWriter.UNPARSE_OPTIONS['encoding'])
+
+
+class CatalogXmlWriter:
+    """Stream a catalog XML file, writing each `<product>` as soon as it is given
+
+    The bytes written are the same as `xmltodict.unparse()` of the whole catalog
+    with `pretty=True`, `short_empty_elements=True` and `indent='    '`,
+    but only one product is held in memory at a time.
+
+    The catalog is written into a '.partial' file, renamed to `target_file` once complete. If the `with` block
+    raises, the partial file is deleted: a truncated catalog is never left behind, and a previous
+    `target_file` stays as it was
+
+    Parameters
+    ----------
+    target_file : PurePath
+        file path for the catalog XML
+    catalog : Dict[str, Dict]
+        the `<catalog>` root attributes and other sections, from `load_xml_info()`.
+        The other sections are written before or after the products, according to the position of 'product'
+    sections_after : bool, optional
+        write the sections after the products, by default True
+    compresslevel : int, optional
+        gzip level if `target_file` ends with '.gz', by default `DEFAULT_COMPRESSLEVEL`
+    commit : bool, optional
+        rename the complete partial file to `target_file`, otherwise the caller renames it, by default True
+    """
+
+    UNPARSE_OPTIONS = {'pretty': True, 'short_empty_elements': True, 'indent': '    ', 'encoding': 'UTF-8'}
+
+    def __init__(self, target_file: PurePath, catalog: Dict[str, Dict], sections_after: bool = True,
+                 compresslevel: int = DEFAULT_COMPRESSLEVEL, commit: bool = True) -> None:
+        self.target_file = target_file
+        self.partial_file = get_partial_file(target_file)
+        self.compresslevel = compresslevel
+        self.commit = commit
+        self.attributes = {key[1:]: value for key, value in catalog.items() if key.startswith('@')}
+        sections = [(key, value) for key, value in catalog.items() if not key.startswith('@')]
+        keys = [key for key, _ in sections]
+        product_position = keys.index('product') if 'product' in keys else len(sections)
+        self.sections_before = [(key, value) for key, value in sections[:product_position]]
+        self.sections_after = [(key, value) for key, value in sections[product_position + 1:]] if sections_after else []
+        self.stream = None
+        self.generator = None
+        self.root_started = False
+
+    def __enter__(self):
+        # Binary file, so that characters that cannot be encoded become character references like `xmltodict` does
+        self.stream = open_catalog_file(self.partial_file, 'wb', compresslevel=self.compresslevel)
+        self.generator = XMLGenerator(self.stream, self.UNPARSE_OPTIONS['encoding'], short_empty_elements=True)
+        self.generator.startDocument()
+        for tag, value in self.sections_before:
+            self.write_element(tag, value)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def write_product(self, product: Dict) -> None:
+        self.write_element('product', product)
+
+    def write_fragment(self, fragment: str) -> None:
+        """Write a `<product>` already rendered by `render_product()`"""
+        self.start_root()
+        self.stream.write(fragment.encode(self.UNPARSE_OPTIONS['encoding']))
+
+    def write_element(self, tag: str, value: Union[Dict, List, str, None]) -> None:
+        """Write a direct child of `<catalog>`, a list of values being written as repeated elements"""
+        self.start_root()
+        xmltodict.unparse({tag: value},
+                          output=self.stream,
+                          full_document=False,
+                          depth=1,
+                          **self.UNPARSE_OPTIONS)
+
+    def start_root(self) -> None:
+        if not self.root_started:
+            # Only open `<catalog>` with a child, without children it is written as an empty element
+            self.generator.startElement('catalog', AttributesImpl(self.attributes))
+            self.generator.ignorableWhitespace('\n')
+            self.root_started = True
+
+    def close(self) -> None:
+        if self.stream is None:
+            return
+        for tag, value in self.sections_after:
+            self.write_element(tag, value)
+        if not self.root_started:
+            self.generator.startElement('catalog', AttributesImpl(self.attributes))
+        self.generator.endElement('catalog')
+        self.generator.endDocument()
+        self.stream.close()
+        self.stream = None
+        if self.commit:
+            self.partial_file.replace(self.target_file)
+
+    def discard(self) -> None:
+        """Delete the partial catalog, without completing it"""
+        if self.stream is None:
+            return
+        self.stream.close()
+        self.stream = None
+        self.partial_file.unlink(missing_ok=True)
+
+
+class CatalogSections:
+    """Build the catalog sections that describe the products
+
+    Written before the products (`GENERATED_SECTIONS_BEFORE`), from the planned categories:
+
+    - 'category': the root category and a category for each product category
+
+    Written after the products (`GENERATED_SECTIONS_AFTER`), built while the products are written:
+
+    - 'product-option': the definition of each shared option of the products
+    - 'variation-attribute': for each product category, the variation products that have a parent unit
+    - 'category-assignment': the category of each product
+
+    The definitions (option values, variation attribute IDs and names, root category) come from the
+    same sections of the current catalog XML. A product category without variation attribute definition
+    gets one named like the others, e.g. 'selectVariant-frontAccents' for 'Front Accents'
+
+    Parameters
+    ----------
+    templates : Dict[str, List], optional
+        the `REMOVED_CATALOG_SECTIONS` of the current catalog XML, from `load_xml_info()`, by default None
+    categories : Iterable[Optional[str]], optional
+        the product categories of the products, e.g. from `plan_categories()`, by default ().
+        A product of another category is not assigned to it, since the categories are already written
+    """
+
+    def __init__(self, templates: Optional[Dict[str, List]] = None,
+                 categories: Iterable[Optional[str]] = ()) -> None:
+        templates = templates or {}
+        self.option_templates = {option['@option-id']: option for option in templates.get('product-option', [])}
+        self.attribute_templates = {get_xml_text(attribute.get('display-name')): attribute
+                                    for attribute in templates.get('variation-attribute', [])}
+        self.root_categories = [category for category in templates.get('category', [])
+                                if category['@category-id'] == ROOT_CATEGORY_ID]
+        self.option_ids = {}
+        # Variation values of each product category, by SKU
+        self.variation_values = defaultdict(dict)
+        self.categories = {make_category_id(category): category for category in categories if category}
+        self.category_assignments = []
+        self.unplanned_categories = set()
+
+    def add_product(self, item: Union[Dict[str, Dict], str]) -> Optional[str]:
+        """Add a generated product, as {'product': ...} or as a `<product>` fragment,
+        and return the ID of the category it is assigned to
+        """
+        if isinstance(item, str):
+            product = element_to_dict(ET.fromstring(item), {XML_NAMESPACE: 'xml'})
+        else:
+            product = item['product']
+        custom_attributes = get_custom_attributes(product)
+
+        for option in as_list(get_path(product, 'options', 'shared-option')):
+            self.option_ids.setdefault(option['@option-id'], None)
+
+        category = custom_attributes.get('productCategory')
+        if not category:
+            return None
+        category_id = make_category_id(category)
+        if category_id in self.categories:
+            self.category_assignments.append({'@category-id': category_id, '@product-id': product['@product-id']})
+        else:
+            if category_id not in self.unplanned_categories:
+                self.unplanned_categories.add(category_id)
+                log.warning(f'The category "{category}" was not planned, its products are not assigned to a category.')
+            category_id = None
+
+        sku = custom_attributes.get('sku')
+        if (custom_attributes.get('productTypeNonoperative') == 'Variation Product'
+                and custom_attributes.get('parentSku') and sku):
+            self.variation_values[category].setdefault(sku, {
+                '@value': sku,
+                'display-value': {'@xml:lang': 'x-default', '#text': get_xml_text(product.get('display-name'))}})
+        return category_id
+
+    def merge_before(self, sections: List[Tuple[str, Union[Dict, List, str, None]]]
+                     ) -> List[Tuple[str, Union[Dict, List, str, None]]]:
+        """Return the sections of a catalog before the products with the generated ones instead of its own,
+        see `CatalogXmlWriter`
+        """
+        return merge_sections(sections, GENERATED_SECTIONS_BEFORE, self.sections_before())
+
+    def merge_after(self, sections: List[Tuple[str, Union[Dict, List, str, None]]],
+                    product_ids: Optional[Set[str]] = None) -> List[Tuple[str, Union[Dict, List, str, None]]]:
+        """Return the sections of a catalog after the products with the generated ones instead of its own,
+        see `CatalogXmlWriter`. Only the category assignments of `product_ids` are kept, if given
+        """
+        return merge_sections(sections, GENERATED_SECTIONS_AFTER, self.sections_after(product_ids))
+
+    def sections_before(self) -> Dict[str, List[Dict]]:
+        """The generated sections before the products by tag, in the order of `GENERATED_SECTIONS_BEFORE`"""
+        categories = self.root_categories + [{'@category-id': category_id,
+                                              'display-name': {'@xml:lang': 'x-default', '#text': category},
+                                              'online-flag': 'true',
+                                              'parent': ROOT_CATEGORY_ID}
+                                             for category_id, category in sorted(self.categories.items())]
+        return {'category': categories}
+
+    def sections_after(self, product_ids: Optional[Set[str]] = None) -> Dict[str, List[Dict]]:
+        """The generated sections after the products by tag, in the order of `GENERATED_SECTIONS_AFTER`,
+        with only the category assignments of `product_ids` if given
+        """
+        missing = [option_id for option_id in self.option_ids if option_id not in self.option_templates]
+        if missing:
+            log.warning(f'No definition of the product options {missing} in the current XML.')
+        options = [option for option_id, option in self.option_templates.items() if option_id in self.option_ids]
+
+        attributes = []
+        for category, values in self.variation_values.items():
+            attribute = self.attribute_templates.get(category) or make_variation_attribute(category)
+            attribute = {key: value for key, value in attribute.items() if key != 'variation-attribute-values'}
+            attribute['variation-attribute-values'] = {'variation-attribute-value': list(values.values())}
+            attributes.append(attribute)
+        attributes.sort(key=lambda attribute: attribute['@attribute-id'])
+        return {'product-option': options,
+                'variation-attribute': attributes,
+                'category-assignment': [assignment for assignment in self.category_assignments
+                                        if product_ids is None or assignment['@product-id'] in product_ids]}
+
+
+def merge_sections(sections: List[Tuple[str, Union[Dict, List, str, None]]],
+                   tags: Tuple[str, ...],
+                   generated: Dict[str, List[Dict]]) -> List[Tuple[str, Union[Dict, List, str, None]]]:
+    """Replace the sections `tags` of a catalog with the `generated` ones, the non-empty ones are written
+    after the others in the order of `tags`
+    """
+    return ([(tag, value) for tag, value in sections if tag not in tags]
+            + [(tag, generated[tag]) for tag in tags if generated[tag]])
+
+
+def get_custom_attributes(product: Dict) -> Dict[str, Optional[str]]:
+    """The custom attributes of a `<product>` in the format of `xmltodict.parse()`, by '@attribute-id'"""
+    return {attribute['@attribute-id']: get_xml_text(attribute)
+            for attribute in as_list(get_path(product, 'custom-attributes', 'custom-attribute'))}
+
+
+def make_category_id(category: str) -> str:
+    """e.g. 'Media Kits' -> 'media-kits'"""
+    return re.sub(r'[^a-z0-9]+', '-', category.lower()).strip('-')
+
+
+def make_variation_attribute(category: str) -> Dict[str, Dict]:
+    """Variation attribute of a product category, named like the ones of the current XML"""
+    words = re.findall(r'[a-z0-9]+', category.lower())
+    attribute_id = words[0] + ''.join(word.capitalize() for word in words[1:])
+    return {'@attribute-id': f'selectVariant-{attribute_id}',
+            '@variation-attribute-id': attribute_id,
+            'display-name': {'@xml:lang': 'x-default', '#text': category}}
+
+
+def get_xml_text(value: Union[Dict, str, None]) -> Optional[str]:
+    """The text of an element in the format of `xmltodict.parse()`"""
+    return value.get('#text') if isinstance(value, dict) else value
+
+
+def get_path(value: Union[Dict, str, None], *tags: str) -> Union[Dict, List, str, None]:
+    for tag in tags:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(tag)
+    return value
+
+
+def as_list(value: Union[Dict, List, str, None]) -> List:
+    """A repeated element in the format of `xmltodict.parse()`: a list, one value, or None"""
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
 
 
 def make_item_id(sku: str) -> str:
@@ -446,27 +1804,15 @@ def get_units_with_same_series_number(sku: str,
                                       database: Dict[str, Dict]
                                       ) -> List[Unit]:
     series_units = []
-    series_info = get_series_info_from_catalog(sku=sku, type='series',
-                                               item_type='units',
-                                               database=database)
-
-    # Get series' unit containing the SKU
-    unit_details = next((unit
-                            for unit in series_info['units']
-                            for item in unit['details']
-                            if item and sku == item['manufacturerSku']),
-                        None)
-    item_details = next((item
-                            for item in unit_details['details']
-                            if item and sku == item['manufacturerSku']),
-                        None)
-    # breakpoint()
-    item_index = unit_details['details'].index(item_details)
-
-    # Get all units that have the same index
+    # The column of the SKU in the series' units, from the location index
+    location = get_sku_resolver(database).locate(sku, kind='unit')
+    series_info = database['series'][location.series]
+    item_index = location.column
+
+    # Get all units that have the same index, the lines of a series do not all have the same number of columns
     series_units = [Unit(unit['details'][item_index]['manufacturerSku'], unit['details'][item_index])
                     for unit in series_info['units']
-                    if unit['details'] and unit['details'][item_index]]
+                    if item_index < len(unit['details']) and unit['details'][item_index]]
     return series_units
 
 
@@ -486,34 +1832,115 @@ def get_unit_sku_with_specific_fuel_ignition(requirements: Dict[str, str],
     return desired_unit
 
 
+def get_fuel_ignition_matrix(sku: str,
+                             database: Dict[str, Dict]
+                             ) -> Dict[Tuple[Optional[str], str], str]:
+    """Return the fuel/ignition SKU matrix of the units with the same series number as the unit
+
+    The matrix is built once per series column and shared by all the units of that column
+    """
+    location = get_sku_resolver(database).locate(sku, kind='unit')
+    matrices = get_series_attributes(database)[location.series].fuel_ignition_matrices
+    if location.column not in matrices:
+        matrices[location.column] = build_fuel_ignition_matrix(
+            get_units_with_same_series_number(sku=sku, database=database))
+    return matrices[location.column]
+
+
+def build_fuel_ignition_matrix(units: List[Unit]) -> Dict[Tuple[Optional[str], str], str]:
+    """Map each (gas fuel type, ignition type) to the first unit with them
+
+    Same first match as `get_unit_sku_with_specific_fuel_ignition()` with the matching requirements,
+    a fuel type of None standing for the ignition type alone
+
+    Parameters
+    ----------
+    units : List[Unit]
+        the units, from `get_units_with_same_series_number()`
+
+    Returns
+    -------
+    Dict[Tuple[Optional[str], str], str]
+        e.g. {('propane', 'electronic'): 'AX42PTE', (None, 'electronic'): 'AX42NTE', ...},
+        fuel types from `FUEL_TYPES` and ignition types from `IGNITION_TYPES`
+    """
+    matrix = {}
+    for unit in units:
+        gas_fuel_type = (unit.info.get('gas_fuel_type') or '').lower()
+        ignition_type = (unit.info.get('ignition_type') or '').lower()
+        for ignition in IGNITION_TYPES:
+            if ignition not in ignition_type:
+                continue
+            matrix.setdefault((None, ignition), unit.sku)
+            for fuel in FUEL_TYPES:
+                if fuel in gas_fuel_type:
+                    matrix.setdefault((fuel, ignition), unit.sku)
+    return matrix
+
+
 def has_top_and_rear_venting_options(sku: str,
                                      database: Dict[str, Dict]
                                      ) -> bool:
-    return re.search(r'top or rear',
-                     get_series_venting_options(sku=sku,
-                                                database=database),
-                     flags=re.IGNORECASE)
+    location = get_sku_resolver(database).locate(sku, kind='unit')
+    if not location:
+        return False
+    return get_series_attributes(database)[location.series].top_and_rear_venting
 
 
 def get_series_venting_options(sku: str,
                                database: Dict[str, Dict]
                                ) -> str:
-    # To tolerate input typo (lower case) in ncf that causes issue: e.g,  in ncf file, line 748, 603, 543
-    # Cannot fix with a simple `str.upper()` due to there is SKU such as 'S20i' and 'S25i'
-    manufacturerSku = sku
-    if not re.search(r'[A-Z]', manufacturerSku):
-        manufacturerSku = sku.upper()
-    venting = ''
-    # Extract the `units` part for the series that contains the units
-    for series in database['series'].values():
-        if manufacturerSku in (i['manufacturerSku']
-                                for unit in series['units']
-                                for i in unit['details']
-                                if i):
-            # Get series' venting option:
-            venting = series.get('venting', '')
-            break
-    return venting
+    # The resolver tolerates input typo (lower case) in ncf, e.g. in ncf file, line 748, 603, 543
+    location = get_sku_resolver(database).locate(sku, kind='unit')
+    if not location:
+        return ''
+    # Get series' venting option:
+    return get_series_attributes(database)[location.series].venting
+
+
+def get_series_attributes(database: Dict[str, Dict]) -> Dict[str, SeriesAttributes]:
+    """Return the `SeriesAttributes` of every series of the database, computing them on first use"""
+    global series_attributes_cache
+    cached_database, series_attributes = series_attributes_cache
+    if cached_database is not database:
+        series_attributes = {series_key: build_series_attributes(series)
+                             for series_key, series in database['series'].items()}
+        series_attributes_cache = (database, series_attributes)
+    return series_attributes
+
+
+def build_series_attributes(series: Dict) -> SeriesAttributes:
+    """Compute the attributes shared by the items of a series
+
+    Parameters
+    ----------
+    series : Dict
+        a series of the database
+
+    Returns
+    -------
+    SeriesAttributes
+        **ignition_types**: {'units' or 'variations': every ignition type of the section, e.g. 'Electronic or Millivolt Ignition'},
+        **venting**: the venting options of the series, e.g. 'Top or Rear',
+        **top_and_rear_venting**: whether the units can be vented either top or rear,
+        **fuel_ignition_matrices**: {column: the fuel/ignition SKU matrix of the units in that column}
+    """
+    ignition_types = {}
+    for item_type in ['units', 'variations']:
+        types = {unit.get('ignition_type', '')
+                 for product_line in series.get(item_type, [])
+                 for unit in product_line['details']
+                 if unit}
+        ignition_type_string = ' or '.join(sorted(types)).lower()
+        count = ignition_type_string.count("ignition") - 1
+        ignition_types[item_type] = re.sub(r'\s{2,}', ' ', ignition_type_string.replace('ignition', '', count).title()).replace('Or', 'or')
+
+    venting = series.get('venting', '')
+    return SeriesAttributes(ignition_types=ignition_types,
+                            venting=venting,
+                            top_and_rear_venting=bool(re.search(r'top or rear', venting, flags=re.IGNORECASE)),
+                            # Filled on first use by `get_fuel_ignition_matrix()`
+                            fuel_ignition_matrices={})
 
 
 def get_series_info_from_catalog(sku: str,
@@ -523,21 +1950,14 @@ def get_series_info_from_catalog(sku: str,
                                  ) -> Dict[str, Dict]:
     '''Return the series containing the sku from the JSON database created from the catalog'''
 
-    # To tolerate input typo (lower case) in ncf that causes issue: e.g,  in ncf file, line 748, 603, 543
-    # Cannot fix with a simple `str.upper()` due to there is SKU such as 'S20i' and 'S25i'
-    manufacturerSku = sku
-    if not re.search(r'[A-Z]', manufacturerSku):
-        manufacturerSku = sku.upper()
+    # The resolver tolerates input typo (lower case) in ncf, e.g. in ncf file, line 748, 603, 543
+    resolver = get_sku_resolver(database)
     if type in ['variations', 'products']:
-        return database[type].get(manufacturerSku)
+        return database[type].get(resolver.resolve(sku))
     elif type == 'series':
-        for series in database['series'].values():
-            if manufacturerSku in (i['manufacturerSku']
-                                    for unit in series[item_type]
-                                    for i in unit['details']
-                                    if i):
-                # Get series' venting option:
-                return series
+        location = resolver.locate(sku, kind='unit' if item_type == 'units' else 'variation')
+        if location and location.series:
+            return database['series'][location.series]
 
 
 def get_info(sku: str,
@@ -546,28 +1966,48 @@ def get_info(sku: str,
              info_name: str
              ) -> Optional[str]:
     product_info = ''
-    series_info = get_series_info_from_catalog(sku=sku, type='series',
+    if item_type == 'products':
+        # Standalone product, not in any series
+        product = get_series_info_from_catalog(sku=sku, type='products',
                                                item_type=item_type,
-                                               database=database)
-    if info_name == 'ignition_type':
-        ignition_types = {unit.get(info_name, '')
-                          for product_line in series_info[item_type]
-                          for unit in product_line['details']
-                          if unit}
-        ignition_type_string = ' or '.join(sorted(ignition_types)).lower()
-        count = ignition_type_string.count("ignition") - 1
-        ignition_type_string = re.sub(r'\s{2,}', ' ', ignition_type_string.replace('ignition', '', count).title()).replace('Or', 'or')
+                                               database=database) or {}
+        return product.get(info_name, '')
 
-        product_info = ignition_type_string
+    location = get_sku_resolver(database).locate(sku, kind='unit' if item_type == 'units' else 'variation')
+    if not location or location.series is None:
+        raise MissingCatalogInfo(f'"{sku}" is not in the {item_type} of any series')
+    if info_name == 'ignition_type':
+        # Same for every item of the series, computed once per series
+        product_info = get_series_attributes(database)[location.series].ignition_types[item_type]
+    elif location.record['manufacturerSku'] == sku:
+        # The first listing of the SKU in its series, the same record a scan of the series would find
+        if info_name not in location.record:
+            raise MissingCatalogInfo(f'"{sku}" has no {info_name} in the database')
+        product_info = location.record[info_name]
     else:
-        product_info = next((unit[info_name]
-                                 for product_line in series_info[item_type]
-                                 for unit in product_line['details']
-                                 if unit.get('manufacturerSku') and unit['manufacturerSku'] == sku),
-                                None)
+        product_info = None
     return product_info
 
 
+def get_product_category(sku: str,
+                         item_type: str,
+                         database: Dict[str, Dict],
+                         csv_info: Dict[str, str]
+                         ) -> str:
+    """Return the productCategory of an item from the database, or from its row of the NCF template
+
+    The database only categorizes the variations matching `VARIATION_PRODUCT_CATEGORY_MAPPING`,
+    the NCF template has the category of most of the others
+    """
+    try:
+        return get_info(sku=sku, item_type=item_type, database=database, info_name='product_category')
+    except MissingCatalogInfo:
+        product_category = csv_info.get('c__productCategory')
+        if not product_category:
+            raise
+        return product_category
+
+
 def get_parent_skus(sku: str, database: Dict[str, Dict]) -> str:
     """Return full parentSku for each item
 
@@ -592,11 +2032,15 @@ def get_parent_skus(sku: str, database: Dict[str, Dict]) -> str:
     manufacturerSku = sku
     # if not re.search(r'[A-Z]', manufacturerSku):
     #     manufacturerSku = sku.upper()
-    variation = database['variations'].get(manufacturerSku)
-    parent_sku = ''
-    if variation:
-        parent_sku = ','.join(sorted({sku for sku, _ in variation['variation_parents']}))
-    return parent_sku
+    return ','.join(get_parent_sku_list(sku=manufacturerSku, database=database))
+
+
+def get_parent_sku_list(sku: str, database: Dict[str, Dict]) -> List[str]:
+    """Return the sorted, unique parent unit SKUs of a variation, [] if `sku` is not a variation"""
+    variation = database['variations'].get(sku)
+    if not variation:
+        return []
+    return sorted({parent_sku for parent_sku, _ in variation['variation_parents']})
 
 
 def get_parent_set_names(parent_skus: str) -> str:
@@ -717,88 +2161,133 @@ class Item:
             #     self.display_name = self.extra_info['xml']['display-name'].get('#text', '').rstrip('|')
 
 
-    def to_xml(self) -> ET.Element:
-        XML_TAG_MAPPING = {'ean': {'text': ''},
-                           'upc': {'text': self.upc},
-                           'unit':{'text': '1'},
-                           'min-order-quantity': {'text': '1'},
-                           'step-quantity': {'text': '1'},
-                           'display-name': {
-                               'attributes': {'xml:lang': "x-default"},
-                               'text': self.display_name},
-                           'store-force-price-flag': {'text': 'false'},
-                           'store-non-inventory-flag': {'text': 'false'},
-                           'store-non-revenue-flag': {'text': 'false'},
-                           'store-non-discountable-flag': {'text': 'false'},
-                           'online-flag': {'text': 'true'},
-                           'available-flag': {'text': 'true'},
-                           'searchable-flag': {'text': 'true'},
-                           'tax-class-id': {'text': 'standard'},
-                           'classification-category': {
-                               'attributes': {'catalog-id': "northcountryfire-storefront",},
-                               'text': self.classification_category,},
-                           'pinterest-enabled-flag': {'text': 'false'},
-                           'facebook-enabled-flag': {'text': 'false'},
-                           'store-attributes': {
-                               'sub-tags' : {'force-price-flag': {'text': 'false',},
-                                             'non-inventory-flag': {'text': 'false',},
-                                             'non-revenue-flag': {'text': 'false',},
-                                             'non-discountable-flag': {'text': 'false',},
-                                             }},
-                           }
-        # create the file structure
-        data = ET.Element('product')
-        data.set('product-id', self.item_id)
-
-        # Set trivial tags
-        for name, var in XML_TAG_MAPPING.items():
-            tag = ET.SubElement(data, name,
-                                attrib=var.get('attributes', {}))
-            tag.text = str(var.get('text', ''))
-            # Create sub tags if exist
-            sub_tags = var.get('sub-tags')
-            if sub_tags:
-                for sub_tag_name, sub_tag_attr in sub_tags.items():
-                    sub_tag = ET.SubElement(tag, sub_tag_name)
-                    sub_tag.text = str(sub_tag_attr.get('text'))
+    def to_xml(self) -> Dict[str, Dict]:
+        # Create the `<product>` directly in the format of `xmltodict.parse()`, the subclasses add their own tags to it.
+        # Start from the constant tags, built once, then set the tags of this item at their position
+        data = {'@product-id': self.item_id, **ITEM_XML_TEMPLATE}
+        for name, attribute in ITEM_XML_FIELDS.items():
+            data[name] = convert_xml_tag({**ITEM_XML_TAG_MAPPING[name], 'text': getattr(self, attribute)})
 
         # create a new XML file with the results
-        return data
+        return {'product': data}
+
+
+# Tags shared by every item, in order. The text of `ITEM_XML_FIELDS` is set per item
+ITEM_XML_TAG_MAPPING = {'ean': {'text': ''},
+                        'upc': {'text': ''},
+                        'unit':{'text': '1'},
+                        'min-order-quantity': {'text': '1'},
+                        'step-quantity': {'text': '1'},
+                        'display-name': {
+                            'attributes': {'xml:lang': "x-default"},
+                            'text': ''},
+                        'store-force-price-flag': {'text': 'false'},
+                        'store-non-inventory-flag': {'text': 'false'},
+                        'store-non-revenue-flag': {'text': 'false'},
+                        'store-non-discountable-flag': {'text': 'false'},
+                        'online-flag': {'text': 'true'},
+                        'available-flag': {'text': 'true'},
+                        'searchable-flag': {'text': 'true'},
+                        'tax-class-id': {'text': 'standard'},
+                        'classification-category': {
+                            'attributes': {'catalog-id': "northcountryfire-storefront",},
+                            'text': '',},
+                        'pinterest-enabled-flag': {'text': 'false'},
+                        'facebook-enabled-flag': {'text': 'false'},
+                        'store-attributes': {
+                            'sub-tags' : {'force-price-flag': {'text': 'false',},
+                                          'non-inventory-flag': {'text': 'false',},
+                                          'non-revenue-flag': {'text': 'false',},
+                                          'non-discountable-flag': {'text': 'false',},
+                                          }},
+                        }
+
+# Tag: `Item` attribute of its text
+ITEM_XML_FIELDS = {'upc': 'upc',
+                   'display-name': 'display_name',
+                   'classification-category': 'classification_category'}
+
+
+def convert_xml_tag(var: Dict[str, Dict]) -> Union[Dict, str, None]:
+    """Convert a tag of `ITEM_XML_TAG_MAPPING` into the format of `xmltodict.parse()`"""
+    tag = {f'@{attribute}': value for attribute, value in var.get('attributes', {}).items()}
+    text = xml_text(var.get('text', ''))
+    # Create sub tags if exist
+    sub_tags = var.get('sub-tags')
+    if sub_tags:
+        tag.update({sub_tag_name: xml_text(sub_tag_attr.get('text'))
+                    for sub_tag_name, sub_tag_attr in sub_tags.items()})
+    if not tag:
+        return text
+    if text is not None:
+        tag['#text'] = text
+    return tag
+
+
+def xml_text(value) -> Optional[str]:
+    """Return the text of an XML tag the way `xmltodict.parse()` reads it back: stripped, None if empty"""
+    return str(value).strip() or None
+
+
+# The constant tags of `Item.to_xml()`, converted once and shared by every product: do not modify them
+ITEM_XML_TEMPLATE = {name: convert_xml_tag(var) for name, var in ITEM_XML_TAG_MAPPING.items()}
 
 
 @dataclass
-class Product(Item):
+class Database_Item(Item):
+    """Item created from the vendor database, `catalog_info`, where it is in `catalog_type`
+    ('units', 'variations' or 'products')
+
+    The attributes read from the database are only looked up when first read (e.g. by `to_xml()`),
+    except the display name: it is a dataclass field and stays eager
+    """
     brand: str = ''
-    product_type_nonoperative: str = 'Product'
-    classification_category: str = 'all'
-    # catalog_type: str = 'units'
+    catalog_type: str = 'units'
 
     def __post_init__(self):
         super().__post_init__()
-        self.base_sku = get_info(sku=self.sku, item_type=self.catalog_type,
-                                 database=self.catalog_info,
-                                 info_name='base_sku')
-        self.product_set_id = f'{self.item_id}-set'
-
-        # Use info from catalog
-        self.display_name = get_info(sku=self.sku, item_type=self.catalog_type,
-                                     database=self.catalog_info,
-                                     info_name='display_name')
-        self.product_category = get_info(sku=self.sku, item_type=self.catalog_type,
-                                         database=self.catalog_info,
-                                         info_name='product_category')
-        self.series_name = get_info(sku=self.sku, item_type=self.catalog_type,
-                                    database=self.catalog_info,
-                                    info_name='series_name')
-        self.series_number = get_info(sku=self.sku, item_type=self.catalog_type,
-                                      database=self.catalog_info,
-                                      info_name='series_number')
-        self.fuel_type = get_info(sku=self.sku, item_type=self.catalog_type,
-                                  database=self.catalog_info,
-                                  info_name='fuel_type')
+        self.display_name = self.get_catalog_info('display_name')
+
+    def get_catalog_info(self, info_name: str) -> str:
+        return get_info(sku=self.sku, item_type=self.catalog_type,
+                        database=self.catalog_info,
+                        info_name=info_name)
+
+    @cached_property
+    def base_sku(self) -> str:
+        return self.get_catalog_info('base_sku')
+
+    @cached_property
+    def product_set_id(self) -> str:
+        return f'{self.item_id}-set'
+
+    @cached_property
+    def product_category(self) -> str:
+        return get_product_category(sku=self.sku, item_type=self.catalog_type,
+                                    database=self.catalog_info, csv_info=self.extra_info['csv'])
+
+
+@dataclass
+class Product(Database_Item):
+    brand: str = ''
+    product_type_nonoperative: str = 'Product'
+    classification_category: str = 'all'
+    catalog_type: str = 'units'
+
+    @cached_property
+    def series_name(self) -> str:
+        return self.get_catalog_info('series_name')
+
+    @cached_property
+    def series_number(self) -> str:
+        return self.get_catalog_info('series_number')
+
+    @cached_property
+    def fuel_type(self) -> str:
+        return self.get_catalog_info('fuel_type')
 
     def to_xml(self):
-        data = xmltodict.parse(ET.tostring(super().to_xml()))
+        data = super().to_xml()
         page_attributes = self.extra_info['xml'].get('page-attributes', {})
         mapping = {
             'brand': {'#text': self.brand},
@@ -830,92 +2319,63 @@ class Option_Product(Product):
     classification_category: str = 'gas-fireplaces'
     catalog_type: str = 'units'    # For clarity, technically does not need it since already set in Class Product
 
-    def __post_init__(self):
-        super().__post_init__()
-        # # self.base_sku = get_base_sku(sku=self.sku, database=self.catalog_info)
-        # self.base_sku = get_info(sku=self.sku, database=self.catalog_info, info_name='base_sku')
-        # self.name_in_catalog = get_name_in_catalog(sku=self.sku, database=self.catalog_info)
-        # self.ignition_type = get_ignition_type(name_in_catalog=self.name_in_catalog)
-        self.ignition_type = get_info(sku=self.sku, item_type=self.catalog_type,
-                                      database=self.catalog_info,
-                                      info_name='ignition_type')
-        # self.product_set_id = f'{self.item_id}-set'
-
-        # # ! Use current XML file, info not always correct
-        # self.product_category = self.extra_info['csv'].get('c__productCategory', '')
-        # self.series_name = self.extra_info['csv'].get('c__series', '')
-        # self.series_number = self.extra_info['csv'].get('c__seriesNumber', '')
-
-        # # Use info from catalog
-        # self.product_category = get_info(sku=self.sku, database=self.catalog_info, info_name='product_category')
-        # self.series_name = get_info(sku=self.sku, database=self.catalog_info, info_name='series_name')
-        # self.series_number = get_info(sku=self.sku, database=self.catalog_info, info_name='series_number')
-
-        units_with_same_series_number = get_units_with_same_series_number(sku=self.sku,
-                                                                          database=self.catalog_info)
-
-        # self.skuLP = get_unit_sku_with_specific_fuel_ignition(requirements=r'electronic.*propane',
-        #                                                       units=units_with_same_series_number)
-        # self.skuNG = get_unit_sku_with_specific_fuel_ignition(requirements=r'electronic.*natural gas',
-        #                                                       units=units_with_same_series_number)
-        self.skuLP = get_unit_sku_with_specific_fuel_ignition(
-            requirements={"gas_fuel_type": "propane",
-                          "ignition_type": "electronic",},
-            units=units_with_same_series_number)
-        self.skuNG = get_unit_sku_with_specific_fuel_ignition(
-            requirements={"gas_fuel_type": "natural gas",
-                          "ignition_type": "electronic",},
-            units=units_with_same_series_number)
-
-        # # SKU if fuel = propane + electronic ignition sku
-        # self.skuLpIpi = get_unit_sku_with_specific_fuel_ignition(requirements=r'electronic.*propane',
-        #                                                       units=units_with_same_series_number)
-        self.skuLpIpi = get_unit_sku_with_specific_fuel_ignition(
-            requirements={"gas_fuel_type": "propane",
-                          "ignition_type": "electronic",},
-            units=units_with_same_series_number)
-
-        # # SKU if fuel = natural gas + electronic ignition
-        # self.skuNgIpi = get_unit_sku_with_specific_fuel_ignition(requirements=r'electronic.*natural gas',
-        #                                                       units=units_with_same_series_number)
-        self.skuNgIpi = get_unit_sku_with_specific_fuel_ignition(
-            requirements={"gas_fuel_type": "natural gas",
-                          "ignition_type": "electronic",},
-            units=units_with_same_series_number)
-
-        # # SKU if fuel = propane + millivolt
-        # self.skuLpMv = get_unit_sku_with_specific_fuel_ignition(requirements=r'millivolt.*propane',
-        #                                                       units=units_with_same_series_number)
-        self.skuLpMv = get_unit_sku_with_specific_fuel_ignition(
-            requirements={"gas_fuel_type": "propane",
-                          "ignition_type": "millivolt",},
-            units=units_with_same_series_number)
-
-        # # SKU if fuel = natural gas + millivolt
-        # self.skuNgMv = get_unit_sku_with_specific_fuel_ignition(requirements=r'millivolt.*natural gas',
-        #                                                       units=units_with_same_series_number)
-        self.skuNgMv = get_unit_sku_with_specific_fuel_ignition(
-            requirements={"gas_fuel_type": "natural gas",
-                          "ignition_type": "millivolt",},
-            units=units_with_same_series_number)
-
-        # If a unit set (units with the same series + seriesNumber) has more than one ignition type
-        self.selectOptionIgnitionType = bool(
-            # get_unit_sku_with_specific_fuel_ignition(requirements=r'millivolt',
-            #                                          units=units_with_same_series_number)
-            # and
-            # get_unit_sku_with_specific_fuel_ignition(requirements=r'electronic',
-            #                                          units=units_with_same_series_number)
-            get_unit_sku_with_specific_fuel_ignition(requirements={"ignition_type": "millivolt"},
-                                                     units=units_with_same_series_number)
-            and
-            get_unit_sku_with_specific_fuel_ignition(requirements={"ignition_type": "electronic"},
-                                                     units=units_with_same_series_number)
-
-            )
-
-        self.selectOptionVentConfiguration = has_top_and_rear_venting_options(sku=self.sku,
-                                                                              database=self.catalog_info)
+    # # self.base_sku = get_base_sku(sku=self.sku, database=self.catalog_info)
+    # self.base_sku = get_info(sku=self.sku, database=self.catalog_info, info_name='base_sku')
+    # self.name_in_catalog = get_name_in_catalog(sku=self.sku, database=self.catalog_info)
+    # self.ignition_type = get_ignition_type(name_in_catalog=self.name_in_catalog)
+    @cached_property
+    def ignition_type(self) -> str:
+        return self.get_catalog_info('ignition_type')
+
+    # # ! Use current XML file, info not always correct
+    # self.product_category = self.extra_info['csv'].get('c__productCategory', '')
+    # self.series_name = self.extra_info['csv'].get('c__series', '')
+    # self.series_number = self.extra_info['csv'].get('c__seriesNumber', '')
+
+    @cached_property
+    def fuel_ignition_matrix(self) -> Dict[Tuple[Optional[str], str], str]:
+        """SKU of each (fuel, ignition) combination among the units with the same series number,
+        shared by all these units
+        """
+        return get_fuel_ignition_matrix(sku=self.sku, database=self.catalog_info)
+
+    @property
+    def skuLP(self) -> str:
+        return self.fuel_ignition_matrix.get(('propane', 'electronic'), '')
+
+    @property
+    def skuNG(self) -> str:
+        return self.fuel_ignition_matrix.get(('natural gas', 'electronic'), '')
+
+    @property
+    def skuLpIpi(self) -> str:
+        """SKU if fuel = propane + electronic ignition sku"""
+        return self.fuel_ignition_matrix.get(('propane', 'electronic'), '')
+
+    @property
+    def skuNgIpi(self) -> str:
+        """SKU if fuel = natural gas + electronic ignition"""
+        return self.fuel_ignition_matrix.get(('natural gas', 'electronic'), '')
+
+    @property
+    def skuLpMv(self) -> str:
+        """SKU if fuel = propane + millivolt"""
+        return self.fuel_ignition_matrix.get(('propane', 'millivolt'), '')
+
+    @property
+    def skuNgMv(self) -> str:
+        """SKU if fuel = natural gas + millivolt"""
+        return self.fuel_ignition_matrix.get(('natural gas', 'millivolt'), '')
+
+    @property
+    def selectOptionIgnitionType(self) -> bool:
+        """If a unit set (units with the same series + seriesNumber) has more than one ignition type"""
+        return bool(self.fuel_ignition_matrix.get((None, 'millivolt'))
+                    and self.fuel_ignition_matrix.get((None, 'electronic')))
+
+    @cached_property
+    def selectOptionVentConfiguration(self) -> bool:
+        return has_top_and_rear_venting_options(sku=self.sku, database=self.catalog_info)
 
     def to_xml(self):
         data = super().to_xml()
@@ -964,39 +2424,42 @@ class Option_Product(Product):
 
 
 @dataclass
-class Variation_Product(Item):
+class Variation_Product(Database_Item):
     brand: str = ''
     product_type_nonoperative: str = 'Variation Product'
-    catalog_type: str = 'variations'    # For clarity, technically does not need it since already set in Class Product
+    catalog_type: str = 'variations'
 
     def __post_init__(self):
-        super().__post_init__()
         if debug:
             log.info(f'{self.sku=}')
-        self.base_sku = get_info(sku=self.sku, item_type=self.catalog_type,
-                                 database=self.catalog_info,
-                                 info_name='base_sku')
-        self.product_set_id = f'{self.item_id}-set'
-
-        # Use info from catalog
-        self.display_name = get_info(sku=self.sku, item_type=self.catalog_type,
-                                     database=self.catalog_info,
-                                     info_name='display_name')
-        self.product_category = get_info(sku=self.sku, item_type=self.catalog_type,
-                                         database=self.catalog_info,
-                                         info_name='product_category')
-
-        self.requiredOrOptionalVariation = required_or_optional_variation(sku=self.sku,
-                                                                          database=self.catalog_info)
-        self.parentSku = get_parent_skus(sku=self.sku, database=self.catalog_info)
-        self.parentSetName = get_parent_set_names(parent_skus=self.parentSku)
-        self.variationMasterStepName = get_variation_master_step_names(parent_skus=self.parentSku,
-                                                                       product_category=self.product_category)
-        self.isSharedVariationProduct = is_shared_variation_product(parent_skus=self.parentSku)
-        self.isStepVariationProduct = is_step_variation_product(parent_skus=self.parentSku)
+        super().__post_init__()
+
+    @cached_property
+    def requiredOrOptionalVariation(self) -> str:
+        return required_or_optional_variation(sku=self.sku, database=self.catalog_info)
+
+    @cached_property
+    def parentSku(self) -> str:
+        return get_parent_skus(sku=self.sku, database=self.catalog_info)
+
+    @cached_property
+    def parentSetName(self) -> str:
+        return get_parent_set_names(self.parentSku)
+
+    @cached_property
+    def variationMasterStepName(self) -> str:
+        return get_variation_master_step_names(self.parentSku, self.product_category)
+
+    @property
+    def isSharedVariationProduct(self) -> str:
+        return is_shared_variation_product(self.parentSku)
+
+    @property
+    def isStepVariationProduct(self) -> str:
+        return is_step_variation_product(self.parentSku)
 
     def to_xml(self):
-        data = xmltodict.parse(ET.tostring(super().to_xml()))
+        data = super().to_xml()
         page_attributes = self.extra_info['xml'].get('page-attributes', {})
         mapping = {
             'brand': {'#text': self.brand},
@@ -1020,6 +2483,52 @@ class Variation_Product(Item):
         return data
 
 
+@dataclass
+class Template_Product(Item):
+    """Item of a brand without vendor database, created from its row of the NCF template
+
+    Every 'c__' column of the row with a value is a custom attribute, e.g. 'c__productCategory' is 'productCategory'
+    """
+    brand: str = ''
+    product_type_nonoperative: str = 'Product'
+
+    def __post_init__(self):
+        super().__post_init__()
+        csv_info = self.extra_info['csv']
+        if not self.extra_info['xml'] and csv_info.get('ID'):
+            self.item_id = csv_info['ID']
+        self.upc = self.upc or csv_info.get('UPC', '')
+        self.display_name = csv_info.get('name__default', '').rstrip('|').strip()
+
+    def to_xml(self):
+        data = super().to_xml()
+        custom_attributes = {column[len(TEMPLATE_ATTRIBUTE_PREFIX):]: value
+                             for column, value in self.extra_info['csv'].items()
+                             if column.startswith(TEMPLATE_ATTRIBUTE_PREFIX) and value}
+        custom_attributes.update(productTypeNonoperative=self.product_type_nonoperative, sku=self.sku)
+        mapping = {
+            'brand': {'#text': self.brand},
+            'manufacturer-sku': {'#text': self.sku},
+            'page-attributes': self.extra_info['xml'].get('page-attributes', {}),
+            'custom-attributes': {
+                'custom-attribute': [{'@attribute-id': attribute_id, '#text': value}
+                                     for attribute_id, value in custom_attributes.items()]
+                },
+            }
+        data['product'].update(mapping)
+        return data
+
+
+# Prefix of the NCF template columns of the custom attributes
+TEMPLATE_ATTRIBUTE_PREFIX = 'c__'
+
+
+# Item class created for each productTypeNonoperative of the database
+ITEM_CLASSES = {'Option Product': Option_Product,
+                'Product': Product,
+                'Variation Product': Variation_Product}
+
+
 def prettify(elem: ET.Element) -> bytes:
     """Return a pretty-printed XML string for the Element.
     """
@@ -1033,6 +2542,18 @@ if __name__ == "__main__":
     parser = init_argparse()
     debug = parser.parse_args().debug
     reload_db = parser.parse_args().reload_database
+    full_catalog = parser.parse_args().all
+    jobs = parser.parse_args().jobs
+    incremental = parser.parse_args().incremental
+    max_shard_bytes = parser.parse_args().max_shard_bytes
+    max_shard_products = parser.parse_args().max_shard_products
+    delta = parser.parse_args().delta
+    xml_file = parser.parse_args().xml_file
+    compresslevel = parser.parse_args().compresslevel
+    brands = parser.parse_args().brands
+    per_brand = parser.parse_args().per_brand
+    max_failures = parser.parse_args().max_failures
+    target_file = parser.parse_args().output or (BULK_XML_FILE if brands is not None else NAPOLEON_XML_FILE)
 
     database = {}
 
@@ -1043,11 +2564,26 @@ if __name__ == "__main__":
                         console=console,
                         transient=True)
 
-    create_xml_object(database_file=NAPOLEON_DATABASE_FILE,
-                      csv_extra_info_file=CSV_EXTRA_INFO_FILE,
-                      xml_extra_info_file=CURRENT_XML_FILE)
+    try:
+        create_xml_object(database_file=NAPOLEON_DATABASE_FILE,
+                          csv_extra_info_file=CSV_EXTRA_INFO_FILE,
+                          xml_extra_info_file=xml_file,
+                          full_catalog=full_catalog,
+                          jobs=jobs,
+                          incremental=incremental,
+                          max_shard_bytes=max_shard_bytes,
+                          max_shard_products=max_shard_products,
+                          delta=delta,
+                          target_file=target_file,
+                          compresslevel=compresslevel,
+                          brands=brands,
+                          per_brand=per_brand,
+                          max_failures=max_failures)
+    except CatalogGenerationError as error:
+        log.error(error)
+        sys.exit(1)
 
     # Print CLI helper if the code was not called with any argument
-    if not (debug or reload_db):
+    if not (debug or reload_db or full_catalog or brands is not None):
         console.print('\n\nCLI info:', style='bold red')
         parser.print_help()
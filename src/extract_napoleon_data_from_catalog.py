@@ -1,18 +1,29 @@
 # __Author__: Khoi Van 2021
 
 import argparse
+import hashlib
 import json
 import logging
+import multiprocessing
 import re
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, namedtuple
+from contextlib import contextmanager, nullcontext
 from itertools import zip_longest
+from multiprocessing.pool import Pool
 from pathlib import Path, PurePath
-from typing import Dict, List, Set, Union
+from typing import Dict, List, Optional, Set, Tuple, Union
 
 import pandas as pd
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
 from rich.console import Console
 from rich.logging import RichHandler
-from rich.progress import Progress, BarColumn, SpinnerColumn, TimeElapsedColumn
+from rich.progress import Progress, ProgressColumn, BarColumn, SpinnerColumn, TimeElapsedColumn
+from rich.table import Table
+from rich.text import Text
 
 # from upload import write_csv_to_google_sheet
 
@@ -40,6 +51,12 @@ BUILD_DATA_FOLDER.mkdir(exist_ok=True)
 PRICEBOOK_FILE = ORIGINAL_DATA_FOLDER / 'Napoleon 2021-sanitized.xlsx'
 NAPOLEON_CRUDE_DATA_FILE = BUILD_DATA_FOLDER / 'napoleon-crude-data.json'
 NAPOLEON_DATABASE_FILE = BUILD_DATA_FOLDER / 'napoleon-database.json'
+NCF_CSV_FILE = ORIGINAL_DATA_FOLDER / 'ncfCatalogTemplate.csv'
+VALIDATED_NCF_FILE = BUILD_DATA_FOLDER / 'ncfCatalogTemplate-validated.csv'
+
+# Read-only SKU table used by the validation worker processes,
+# set in the parent before forking so that the workers share it copy-on-write
+shared_sku_table = None
 
 OPTIONAL_LOOKUP = {'mandatory': 'Required',
                    'optional': 'Optional'}
@@ -47,6 +64,19 @@ ADDITIONAL_OPTIONAL_LOOKUP = {'INC': 'Included',
                               'OPT': 'Optional',
                               'N/A': 'Not Available'}
 
+# Validation rule (same name as the per-row function) filling each 'c__*' column of the NCF template
+VALIDATION_RULES = {'is_unit': 'c__unitTrueOrFalse',
+                    'check_base_sku': 'c__baseSku',
+                    'check_parent_sku': 'c__parentSku',
+                    'is_shared_variation_product': 'c__isSharedVariationProduct',
+                    'is_step_variation_product': 'c__isStepVariationProduct',
+                    'required_or_optional_variation': 'c__requiredOrOptionalVariation'}
+
+# Where a SKU is listed in the database: `section` is 'units' or 'variations' inside the series,
+# `record` is the item itself. `series`, `line` and `column` are None for variations and products
+# that are not inside a series, their `section` is then 'variations' or 'products' of the database
+SkuLocation = namedtuple('SkuLocation', 'kind series section line column record')
+
 
 def init_argparse() -> argparse.ArgumentParser:
     """Creating CLI helper"""
@@ -60,9 +90,31 @@ def init_argparse() -> argparse.ArgumentParser:
     parser.add_argument('-r', '--reload-database',
                         help='Force reloading of database from pricebook.',
                         action="store_true")
+    parser.add_argument('-v', '--validate',
+                        help='Validate the NCF template file against the database.',
+                        action="store_true")
+    parser.add_argument('-c', '--chunksize',
+                        help='Stream the NCF template file, validating this many rows at a time.',
+                        type=int,
+                        default=None)
+    parser.add_argument('-j', '--jobs',
+                        help='Number of worker processes used to validate the NCF template file (default: 1).',
+                        type=int,
+                        default=1)
+    parser.add_argument('-u', '--revalidate',
+                        help='Only validate the NCF rows changed since the previous --revalidate run. '
+                             'The rule report only covers these rows.',
+                        action="store_true")
     return parser
 
 
+class RowsPerSecondColumn(ProgressColumn):
+    """Rich progress column showing the processing speed in rows per second"""
+
+    def render(self, task) -> Text:
+        return Text(f'{task.speed or 0:,.0f} rows/s', style='progress.data.speed')
+
+
 def extract_napoleon_data_from_catalog() -> Dict[str, Dict]:
     """Create a local database using the pricebook xlsx file
 
@@ -480,9 +532,107 @@ def get_all_unit_sku(database: Dict[str, Dict]) -> Set[str]:
     }
 
 
+def normalize_sku(sku: str) -> str:
+    """Return the SKU as it is looked up in the database
+
+    To tolerate input typo (lower case) in ncf that causes issue: e.g,  in ncf file, line 748, 603, 543
+    Cannot fix with a simple `str.upper()` due to there is SKU such as 'S20i' and 'S25i'
+    """
+    return sku if re.search(r'[A-Z]', sku) else sku.upper()
+
+
+class SkuResolver:
+    """Resolve a manufacturerSku from any input to where it is in the local database/catalog
+
+    Build once per database with `get_sku_resolver()`. Every input form accepted by
+    `normalize_sku()` is mapped to its canonical SKU ahead of time, so looking up a SKU,
+    including a SKU that is not in the database, is a single set/dict lookup instead of
+    a scan over all series
+
+    Attributes
+    ----------
+    forms : Dict[str, str]
+        every accepted input form (the SKU itself, or its lowercase typo) -> canonical SKU
+    known_forms : frozenset
+        the keys of `forms`, to reject unknown SKU right away
+    locations : Dict[str, Dict[str, SkuLocation]]
+        canonical SKU -> {kind: location}, kind is 'unit', 'variation' or 'product'
+        (series key, section, line and column index, and the record itself)
+    """
+    # Same precedence as the validation: an item in 'variations' or 'products' is never a 'unit'
+    KIND_PRECEDENCE = ('variation', 'product', 'unit')
+
+    def __init__(self, database: Dict[str, Dict]):
+        self.locations = {}
+        for series_key, series in database['series'].items():
+            for section, kind in (('units', 'unit'), ('variations', 'variation')):
+                for line_index, line in enumerate(series.get(section, [])):
+                    for column_index, item in enumerate(line['details']):
+                        # A SKU listed in more than one series keeps the first series
+                        if item:
+                            self.locations.setdefault(item['manufacturerSku'], {}).setdefault(
+                                kind, SkuLocation(kind, series_key, section, line_index, column_index, item))
+
+        # Variations from 'Additional Options' tables and products are not inside any series
+        for section, kind in (('variations', 'variation'), ('products', 'product')):
+            for manufacturerSku, item in database[section].items():
+                self.locations.setdefault(manufacturerSku, {}).setdefault(
+                    kind, SkuLocation(kind, None, section, None, None, item))
+
+        self.forms = {}
+        for manufacturerSku in self.locations:
+            if normalize_sku(manufacturerSku) == manufacturerSku:
+                self.forms[manufacturerSku] = manufacturerSku
+            # Lowercase typo of an all uppercase SKU, e.g. 'gdsll-kt' for 'GDSLL-KT'
+            lowercase_sku = manufacturerSku.lower()
+            if normalize_sku(lowercase_sku) == manufacturerSku:
+                self.forms[lowercase_sku] = manufacturerSku
+        self.known_forms = frozenset(self.forms)
+
+    def resolve(self, sku: str) -> Optional[str]:
+        """Return the canonical SKU in the database, None if not found"""
+        if sku not in self.known_forms:
+            return None
+        return self.forms[sku]
+
+    def kind(self, sku: str) -> Optional[str]:
+        """Return 'variation', 'product' or 'unit' for the SKU, None if not found"""
+        manufacturerSku = self.resolve(sku)
+        if manufacturerSku is None:
+            return None
+        kinds = self.locations[manufacturerSku]
+        return next(kind for kind in self.KIND_PRECEDENCE if kind in kinds)
+
+    def locate(self, sku: str, kind: str) -> Optional[SkuLocation]:
+        """Return where the SKU is listed as `kind` in the database, None if not found"""
+        manufacturerSku = self.resolve(sku)
+        if manufacturerSku is None:
+            return None
+        return self.locations[manufacturerSku].get(kind)
+
+
+# Only keep the resolver of the latest database, the database is loaded once per run
+sku_resolver_cache = (None, None)
+
+
+def get_sku_resolver(database: Dict[str, Dict]) -> SkuResolver:
+    """Return the `SkuResolver` of the database, building it on first use
+
+    The database has to be complete (all series, variations and products added) before the first call
+    """
+    global sku_resolver_cache
+    cached_database, resolver = sku_resolver_cache
+    if cached_database is not database:
+        resolver = SkuResolver(database)
+        sku_resolver_cache = (database, resolver)
+    return resolver
+
+
 def validate_ncf(file_to_validate: PurePath,
                  database: Dict[str, Dict],
-                 target_file:  PurePath = None) -> None:
+                 target_file:  PurePath = None,
+                 chunksize: int = None,
+                 jobs: int = 1) -> None:
     """Main function to validate the North Country Fire template file
 
     Parameters
@@ -493,57 +643,610 @@ def validate_ncf(file_to_validate: PurePath,
         the current database/catalog to look up info
     target_file : PurePath, optional
         file path for the desired validated output, by default None
+    chunksize : int, optional
+        if set, stream the template file and validate this many rows at a time, by default None
+    jobs : int, optional
+        number of worker processes sharing the validation, by default 1
     """
     # Set default validated output file if not set
     if not target_file:
         target_file = VALIDATED_NCF_FILE
 
-    # # !Using excel have consequences of Excel interpreting data in the different way,
-    # # such as '2200-1' is thought (by Excel, or google sheet as date format)
-    # excel_file = file_to_validate
-    # ncf_data = pd.read_excel(excel_file, dtype=object)
+    # Flatten the database once, then validate every row with vectorized lookups
+    sku_table = build_sku_table(database)
+    report = ValidationReport()
+
+    with create_validation_pool(sku_table, jobs) if jobs > 1 else nullcontext() as pool:
+        if chunksize:
+            validate_ncf_in_chunks(file_to_validate=file_to_validate,
+                                   sku_table=sku_table,
+                                   target_file=target_file,
+                                   chunksize=chunksize,
+                                   pool=pool,
+                                   jobs=jobs,
+                                   report=report)
+            report.save(target_file.with_suffix('.report.json'))
+            report.print_table()
+            return
+
+        # # !Using excel have consequences of Excel interpreting data in the different way,
+        # # such as '2200-1' is thought (by Excel, or google sheet as date format)
+        # excel_file = file_to_validate
+        # ncf_data = pd.read_excel(excel_file, dtype=object)
+
+        # !Use csv input ncf template file instead
+        ncf_data = pd.read_csv(file_to_validate, dtype=object)
+        ncf_data = validate_ncf_rows(ncf_data, sku_table, pool=pool, jobs=jobs, report=report)
+
+    # Save the validated result, csv for easy checking, otherwise streamed into an Excel file
+    with open_validated_ncf_writer(target_file) as writer:
+        writer.write(ncf_data)
+
+    # Save and show how long each validation rule took
+    report.save(target_file.with_suffix('.report.json'))
+    report.print_table()
+
+
+def revalidate_ncf(file_to_validate: PurePath,
+                   database: Dict[str, Dict],
+                   target_file: PurePath = None,
+                   state_file: PurePath = None) -> int:
+    """Validate only the NCF rows changed since the previous run and merge them into its validated output
+
+    A row is revalidated if it is new, if any of its cells changed, or if the database changed
+    the way its manufacturerSKU is validated. Without a previous run, every row is validated.
+    The rule report, saved next to the target file like `validate_ncf()`, only covers the revalidated rows
+
+    Parameters
+    ----------
+    file_to_validate : PurePath
+        file path to the template file
+    database : Dict[str, Dict]
+        the current database/catalog to look up info
+    target_file : PurePath, optional
+        file path for the validated output (csv), read back as the previous output, by default None
+    state_file : PurePath, optional
+        file path for the per-row hashes of the previous run,
+        by default the target file with a '.state.json' suffix
+
+    Returns
+    -------
+    int
+        The number of revalidated rows
+    """
+    # Set default validated output file if not set
+    if not target_file:
+        target_file = VALIDATED_NCF_FILE
+    if Path(target_file).suffix != '.csv':
+        raise ValueError(f'Revalidation can only merge into csv files, not "{Path(target_file).name}"')
+    if not state_file:
+        state_file = Path(target_file).with_suffix('.state.json')
 
-    # !Use csv input ncf template file instead
     ncf_data = pd.read_csv(file_to_validate, dtype=object)
+    sku_table = build_sku_table(database)
+    keys = get_ncf_row_keys(ncf_data)
+    input_hashes = pd.util.hash_pandas_object(ncf_data, index=False).to_numpy()
+    entry_hashes = get_sku_entry_hashes(ncf_data, sku_table)
+    database_fingerprint = get_database_fingerprint(database)
+
+    # Previous hashes and validated row position of each key
+    previous_hashes = {}
+    previous_output = None
+    previous_positions = pd.Series(dtype=int)
+    database_changed = True
+    if Path(state_file).exists() and Path(target_file).exists():
+        with open(state_file, 'r') as fin:
+            state = json.load(fin)
+        previous_hashes = state['rows']
+        previous_output = pd.read_csv(target_file, dtype=object)
+        previous_positions = pd.Series(range(len(previous_output)), index=get_ncf_row_keys(previous_output))
+        # Ambiguous keys cannot be matched to one previous row
+        previous_positions = previous_positions[~previous_positions.index.duplicated(keep=False)]
+        database_changed = state['database_fingerprint'] != database_fingerprint
+
+    dirty = []
+    for key, input_hash, entry_hash, duplicated in zip(keys, input_hashes, entry_hashes, keys.duplicated(keep=False)):
+        previous = previous_hashes.get(key)
+        dirty.append(duplicated
+                     or previous is None
+                     or key not in previous_positions
+                     or previous[0] != int(input_hash)
+                     or (database_changed and previous[1] != int(entry_hash)))
+    dirty = pd.Series(dirty, index=ncf_data.index, dtype=bool)
+
+    report = ValidationReport()
+    validated = validate_ncf_data(ncf_data[dirty].copy(), sku_table, report=report)
+    if previous_output is not None and not dirty.all():
+        # Reuse the previous validated rows, placed back at the position of their current row
+        unchanged = previous_output.iloc[previous_positions[keys[~dirty]].to_numpy()]
+        unchanged = unchanged.reindex(columns=validated.columns)
+        unchanged.index = ncf_data.index[~dirty]
+        validated = pd.concat([validated, unchanged]).sort_index()
+    validated.to_csv(target_file, index=False)
+
+    with open(state_file, 'w') as fout:
+        json.dump({'database_fingerprint': database_fingerprint,
+                   'rows': {key: [int(input_hash), int(entry_hash)]
+                            for key, input_hash, entry_hash in zip(keys, input_hashes, entry_hashes)}},
+                  fout)
+
+    # Save and show how long each validation rule took on the revalidated rows
+    report.save(Path(target_file).with_suffix('.report.json'))
+    report.print_table()
+
+    log.info(f'Revalidated {dirty.sum()} of {len(ncf_data)} NCF rows.')
+    return int(dirty.sum())
+
+
+def validate_ncf_in_chunks(file_to_validate: PurePath,
+                           sku_table: pd.DataFrame,
+                           target_file: PurePath,
+                           chunksize: int,
+                           pool: Pool = None,
+                           jobs: int = 1,
+                           report: 'ValidationReport' = None,
+                           total_rows: int = None) -> None:
+    """Validate the North Country Fire template file chunk by chunk
+
+    Only one chunk of the template is held in memory at a time,
+    each validated chunk is appended to the target file right away.
+    The output always has the header, even if the template has no row
+
+    Parameters
+    ----------
+    file_to_validate : PurePath
+        file path to the template file
+    sku_table : pd.DataFrame
+        the flattened database, created by `build_sku_table()`
+    target_file : PurePath
+        file path for the validated output, a csv or an Excel file
+    chunksize : int
+        number of rows to validate at a time
+    pool : Pool, optional
+        worker processes created by `create_validation_pool()`, by default None
+    jobs : int, optional
+        number of worker processes in the pool, by default 1
+    report : ValidationReport, optional
+        if set, add the timing of each validation rule, by default None
+    total_rows : int, optional
+        number of rows of the template, if known, for the progress bar; without it the progress
+        only counts the validated rows, the template is not read an extra time, by default None
+    """
+    progress = Progress(SpinnerColumn(),
+                        "[magenta]{task.description}",
+                        BarColumn(),
+                        "({task.completed:,} rows)",
+                        RowsPerSecondColumn(),
+                        TimeElapsedColumn(),
+                        console=console,
+                        transient=True)
+
+    with progress, open_validated_ncf_writer(target_file) as writer:
+        task = progress.add_task('Validating NCF file...', total=total_rows, start=True)
+        chunks = pd.read_csv(file_to_validate, dtype=object, chunksize=chunksize)
+        for chunk in chunks:
+            chunk = validate_ncf_rows(chunk, sku_table, pool=pool, jobs=jobs, report=report)
+            writer.write(chunk)
+            progress.advance(task, len(chunk))
+
+        if not writer.header_written:
+            # A template without row has no chunk, write the validated header alone like `validate_ncf()`
+            writer.write(validate_ncf_data(pd.read_csv(file_to_validate, dtype=object, nrows=0), sku_table))
+
+
+def validate_ncf_rows(ncf_data: pd.DataFrame,
+                      sku_table: pd.DataFrame,
+                      pool: Pool = None,
+                      jobs: int = 1,
+                      report: 'ValidationReport' = None) -> pd.DataFrame:
+    """Validate the NCF rows, partitioned across the worker processes if there is a pool
+
+    Parameters
+    ----------
+    ncf_data : pd.DataFrame
+        the NCF template data, read with `dtype=object`
+    sku_table : pd.DataFrame
+        the flattened database, created by `build_sku_table()`
+    pool : Pool, optional
+        worker processes created by `create_validation_pool()`, by default None
+    jobs : int, optional
+        number of worker processes in the pool, by default 1
+    report : ValidationReport, optional
+        if set, add the timing of each validation rule, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        The validated rows, in their original order
+    """
+    if not pool or len(ncf_data) < jobs:
+        return validate_ncf_data(ncf_data, sku_table, report=report)
+
+    # One contiguous partition per worker, `Pool.map()` returns them in order
+    partition_size = -(-len(ncf_data) // jobs)
+    partitions = [ncf_data.iloc[start:start + partition_size]
+                  for start in range(0, len(ncf_data), partition_size)]
+    results = pool.map(validate_ncf_partition, partitions)
+    if report is not None:
+        # The rule timings of the workers add up to their total time, not to the elapsed time
+        for _, partition_report in results:
+            report.merge(partition_report)
+    return pd.concat([partition for partition, _ in results])
+
+
+def validate_ncf_partition(ncf_data: pd.DataFrame) -> Tuple[pd.DataFrame, 'ValidationReport']:
+    """Validate a partition of the NCF rows inside a worker process, using `shared_sku_table`"""
+    report = ValidationReport()
+    return validate_ncf_data(ncf_data, shared_sku_table, report=report), report
+
+
+def set_shared_sku_table(sku_table: pd.DataFrame) -> None:
+    global shared_sku_table
+    shared_sku_table = sku_table
+
+
+def create_validation_pool(sku_table: pd.DataFrame, jobs: int) -> Pool:
+    """Create the worker processes for validating the NCF rows
+
+    With 'fork', the workers share the SKU table of the parent copy-on-write;
+    otherwise the table is sent once to each worker, never once per partition
+
+    Parameters
+    ----------
+    sku_table : pd.DataFrame
+        the flattened database, created by `build_sku_table()`
+    jobs : int
+        number of worker processes
+
+    Returns
+    -------
+    Pool
+        The pool of worker processes
+    """
+    set_shared_sku_table(sku_table)
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork').Pool(processes=jobs)
+    return multiprocessing.Pool(processes=jobs,
+                                initializer=set_shared_sku_table,
+                                initargs=(sku_table,))
+
+
+class ChunkWriter(ABC):
+    """Base of the writers of the validated output, writing DataFrame chunks one after another
+
+    The chunks are written into a '.partial' file, e.g. 'ncf.partial.xlsx' of 'ncf.xlsx', renamed to
+    `target_file` once complete. Used as a context manager: the output is only completed if the `with` block
+    succeeds. On an exception only the partial file is deleted, so that a partial output never looks like
+    a complete validated file, and a previous `target_file` stays as it was
+    """
+
+    def __init__(self, target_file: PurePath) -> None:
+        self.target_file = Path(target_file)
+        self.partial_file = self.target_file.with_name(f'{self.target_file.stem}.partial{self.target_file.suffix}')
+        self.header_written = False
+
+    @abstractmethod
+    def write(self, chunk: pd.DataFrame) -> None:
+        """Write the next chunk, with the header before the first one"""
+
+    def close(self) -> None:
+        if self.partial_file.exists():
+            self.partial_file.replace(self.target_file)
+
+    def discard(self) -> None:
+        self.partial_file.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class CsvChunkWriter(ChunkWriter):
+    """Write DataFrame chunks one after another into a csv file"""
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        # Only the first chunk creates the file and writes the header
+        chunk.to_csv(self.partial_file,
+                     mode='a' if self.header_written else 'w',
+                     header=not self.header_written,
+                     index=False)
+        self.header_written = True
+
+
+class ExcelChunkWriter(ChunkWriter):
+    """Stream DataFrame chunks into an Excel file with a write-only openpyxl workbook
+
+    Rows are written out as they are appended, instead of keeping every cell in memory like `DataFrame.to_excel()`.
+    Every value is written as a text cell, so that Excel never turns SKUs like '2200-1' into dates
+    """
+
+    def __init__(self, target_file: PurePath) -> None:
+        super().__init__(target_file)
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet()
+        self.sheet.freeze_panes = 'A2'
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        if not self.header_written:
+            self.sheet.append([self.create_cell(column, bold=True) for column in chunk.columns])
+            self.header_written = True
+        for row in chunk.itertuples(index=False, name=None):
+            # Leave missing values (NaN or None) as empty cells
+            self.sheet.append([self.create_cell(value) if not pd.isna(value) else None
+                               for value in row])
+
+    def create_cell(self, value, bold: bool = False) -> WriteOnlyCell:
+        cell = WriteOnlyCell(self.sheet, value=str(value))
+        cell.number_format = '@'
+        if bold:
+            cell.font = Font(bold=True)
+        return cell
+
+    def close(self) -> None:
+        # The write-only workbook only creates the file when saved
+        self.workbook.save(self.partial_file)
+        super().close()
 
-    # Fill SKU (same as manufacturerSku)
-    ncf_data['c__sku'] = ncf_data['manufacturerSKU']
-
-    # Validate 'c__unitTrueOrFalse'
-    ncf_data['c__unitTrueOrFalse'] = ncf_data.apply(is_unit,
-                                                    axis=1,     # Apply for column
-                                                    args=(database,))
-
-    # Validate baseSku
-    ncf_data['c__baseSku'] = ncf_data.apply(check_base_sku,
-                                            axis=1,
-                                            args=(database,))
-
-    # Validate 'parentSku'
-    ncf_data['c__parentSku'] = ncf_data.apply(check_parent_sku,
-                                              axis=1,
-                                              args=(database,))
-
-    # Validate 'c__isSharedVariationProduct', run AFTER `check_parent_sku`
-    ncf_data['c__isSharedVariationProduct'] = ncf_data.apply(is_shared_variation_product,
-                                                             axis=1)
-
-    # Validate 'c__isStepVariationProduct', run AFTER `check_parent_sku`
-    ncf_data['c__isStepVariationProduct'] = ncf_data.apply(is_step_variation_product,
-                                                           axis=1)
-
-    # Validate 'c__isStepVariationProduct', run AFTER `is_step_variation_product`
-    ncf_data['c__requiredOrOptionalVariation'] = ncf_data.apply(required_or_optional_variation,
-                                                                axis=1,
-                                                                args=(database,))
-
-    # Save the validated result
-    file_extension = target_file.suffix
-    if file_extension == '.csv':
-        # Save to csv file for easy checking
-        ncf_data.to_csv(target_file, index=False)
+    def discard(self) -> None:
+        # Release the temporary file of the rows written so far, the workbook is never saved
+        self.sheet.close()
+        super().discard()
+
+
+def open_validated_ncf_writer(target_file: PurePath) -> ChunkWriter:
+    """Return the chunk writer for the validated output: csv for a '.csv' file, Excel otherwise"""
+    if Path(target_file).suffix == '.csv':
+        return CsvChunkWriter(target_file)
+    return ExcelChunkWriter(target_file)
+
+
+def get_ncf_row_keys(ncf_data: pd.DataFrame) -> pd.Series:
+    """Return the key of each NCF row: its 'ID', or its manufacturerSKU if the row has no ID"""
+    return ncf_data['ID'].fillna(ncf_data['manufacturerSKU']).fillna('').astype(str)
+
+
+def get_sku_entry_hashes(ncf_data: pd.DataFrame, sku_table: pd.DataFrame) -> pd.Series:
+    """Hash the database entry used to validate each NCF row, 0 for a manufacturerSKU not in the database"""
+    entries = sku_table.set_index('form')
+    entry_hashes = pd.util.hash_pandas_object(entries, index=False)
+    return ncf_data['manufacturerSKU'].fillna('').map(entry_hashes).fillna(0).astype('uint64')
+
+
+def get_database_fingerprint(database: Dict[str, Dict]) -> str:
+    """Return a hash of the whole database/catalog, to tell if it changed since a previous run"""
+    return hashlib.sha256(json.dumps(database, sort_keys=True).encode()).hexdigest()
+
+
+def build_sku_table(database: Dict[str, Dict]) -> pd.DataFrame:
+    """Flatten the local database into one row per accepted manufacturerSku input form
+
+    The lookup precedence is the same as the per-row validation functions:
+    an item in 'variations' or 'products' is never treated as a 'unit'
+
+    Parameters
+    ----------
+    database : Dict[str, Dict]
+        the local database/catalog
+
+    Returns
+    -------
+    pd.DataFrame
+        Columns: **form** (the SKU as it may be typed in the NCF template), **sku**,
+        **kind** ('variation', 'product' or 'unit'), **base_sku** (only for 'unit'),
+        **parents** (comma-separated parentSku, only for 'variation')
+        and **requirement** (only for 'variation')
+    """
+    resolver = get_sku_resolver(database)
+    records = {}
+    for manufacturerSku in resolver.locations:
+        kind = resolver.kind(manufacturerSku)
+        record = {'sku': manufacturerSku, 'kind': kind, 'base_sku': '', 'parents': '', 'requirement': ''}
+        if kind == 'variation':
+            variation = database['variations'][manufacturerSku]
+            record['parents'] = join_parent_skus(variation)
+            record['requirement'] = get_variation_requirement(variation)
+        elif kind == 'unit':
+            series = database['series'][resolver.locate(manufacturerSku, kind='unit').series]
+            record['base_sku'] = get_unit_base_sku(manufacturerSku, series)
+        records[manufacturerSku] = record
+
+    return pd.DataFrame([{'form': form, **records[manufacturerSku]}
+                         for form, manufacturerSku in resolver.forms.items()],
+                        columns=['form', 'sku', 'kind', 'base_sku', 'parents', 'requirement'])
+
+
+def validate_ncf_data(ncf_data: pd.DataFrame,
+                      sku_table: pd.DataFrame,
+                      report: 'ValidationReport' = None) -> pd.DataFrame:
+    """Fill all the 'c__*' validation columns of the NCF template in one vectorized pass
+
+    Give the same results as applying `is_unit`, `check_base_sku`, `check_parent_sku`,
+    `is_shared_variation_product`, `is_step_variation_product` and
+    `required_or_optional_variation` row by row
+
+    Parameters
+    ----------
+    ncf_data : pd.DataFrame
+        the NCF template data, read with `dtype=object`
+    sku_table : pd.DataFrame
+        the flattened database, created by `build_sku_table()`
+    report : ValidationReport, optional
+        if set, add the timing and result values of each validation rule, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        The same DataFrame with the validated columns filled
+    """
+    with measure_rule(report, 'sku_lookup', ncf_data):
+        # The table already lists the lowercase typo of each SKU, missing SKU are blank
+        keys = pd.DataFrame({'form': ncf_data['manufacturerSKU'].fillna('').to_numpy()})
+        # A left merge keeps the order of the NCF rows
+        matched = keys.merge(sku_table, how='left', on='form', validate='many_to_one')
+        kind = matched['kind']
+        parents = matched['parents'].fillna('')
+
+        # Fill SKU (same as manufacturerSku)
+        ncf_data['c__sku'] = ncf_data['manufacturerSKU']
+    with measure_rule(report, 'is_unit', ncf_data):
+        ncf_data['c__unitTrueOrFalse'] = kind.map({'unit': 'TRUE', 'variation': '', 'product': ''}).fillna('Not found').to_numpy()
+    with measure_rule(report, 'check_base_sku', ncf_data):
+        ncf_data['c__baseSku'] = matched['base_sku'].fillna('Not found').to_numpy()
+    with measure_rule(report, 'check_parent_sku', ncf_data):
+        ncf_data['c__parentSku'] = parents.to_numpy()
+    with measure_rule(report, 'is_shared_variation_product', ncf_data):
+        # Only need one comma for 2 parents
+        ncf_data['c__isSharedVariationProduct'] = parents.str.contains(',', regex=False).map({True: 'TRUE', False: ''}).to_numpy()
+    with measure_rule(report, 'is_step_variation_product', ncf_data):
+        ncf_data['c__isStepVariationProduct'] = (parents != '').map({True: 'TRUE', False: ''}).to_numpy()
+    with measure_rule(report, 'required_or_optional_variation', ncf_data):
+        ncf_data['c__requiredOrOptionalVariation'] = matched['requirement'].where(parents != '', '').fillna('').to_numpy()
+    return ncf_data
+
+
+@contextmanager
+def measure_rule(report: Optional['ValidationReport'], rule: str, ncf_data: pd.DataFrame):
+    """Time the validation rule inside the `with` block and add it to the report, if any
+
+    The values of the column filled by the rule (see `VALIDATION_RULES`) are counted after the timing stops
+    """
+    if report is None:
+        yield
+        return
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    column = VALIDATION_RULES.get(rule)
+    report.add(rule, seconds, len(ncf_data), ncf_data[column] if column else None)
+
+
+class ValidationReport:
+    """Wall time, number of rows and distribution of the result values of each validation rule
+
+    Accumulated over the chunks and worker partitions of one validation run
+    """
+
+    # Result values are grouped into these buckets
+    BUCKETS = ('TRUE', 'Not found', 'blank', 'other')
+
+    def __init__(self) -> None:
+        self.rules = {}
+
+    def add(self, rule: str, seconds: float, rows: int, values: pd.Series = None) -> None:
+        stats = self.rules.setdefault(rule, {'seconds': 0.0, 'rows': 0, 'values': Counter()})
+        stats['seconds'] += seconds
+        stats['rows'] += rows
+        if values is not None:
+            # Count the distinct values first, then group them into the buckets
+            for value, count in values.fillna('').value_counts().items():
+                bucket = value if value in ('TRUE', 'Not found') else 'blank' if value == '' else 'other'
+                stats['values'][bucket] += count
+
+    def merge(self, other: 'ValidationReport') -> None:
+        for rule, stats in other.rules.items():
+            merged = self.rules.setdefault(rule, {'seconds': 0.0, 'rows': 0, 'values': Counter()})
+            merged['seconds'] += stats['seconds']
+            merged['rows'] += stats['rows']
+            merged['values'].update(stats['values'])
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """Return the report as {rule: {'seconds', 'rows', 'rows_per_second', 'values'}}"""
+        return {rule: {'seconds': stats['seconds'],
+                       'rows': stats['rows'],
+                       'rows_per_second': stats['rows'] / stats['seconds'] if stats['seconds'] else None,
+                       'values': {bucket: stats['values'][bucket] for bucket in self.BUCKETS}
+                                 if rule in VALIDATION_RULES else {}}
+                for rule, stats in self.rules.items()}
+
+    def save(self, report_file: PurePath) -> None:
+        with open(report_file, 'w') as fout:
+            json.dump(self.to_dict(), fout, indent=2)
+
+    def print_table(self) -> None:
+        table = Table(title='NCF validation rules')
+        table.add_column('Rule', no_wrap=True)
+        table.add_column('Time (ms)', justify='right')
+        table.add_column('Rows/s', justify='right')
+        for bucket in self.BUCKETS:
+            table.add_column(bucket, justify='right')
+        for rule, stats in self.to_dict().items():
+            table.add_row(rule,
+                          f"{stats['seconds'] * 1000:,.1f}",
+                          f"{stats['rows_per_second'] or 0:,.0f}",
+                          *(f"{stats['values'][bucket]:,}" if stats['values'] else ''
+                            for bucket in self.BUCKETS))
+        console.print(table)
+
+
+def join_parent_skus(variation: Dict) -> str:
+    """Return the sorted, comma-separated parentSku of a 'variation' in the database"""
+    return ','.join(sorted({sku for sku, _ in variation['variation_parents']}))
+
+
+def get_variation_requirement(variation: Dict) -> str:
+    """Return 'Required', 'Optional', 'Required/Optional' or 'Included/Optional' for a 'variation' in the database"""
+    # Remove 'Not Available'
+    requirements = {requirement
+                    for _, requirement in variation['variation_parents']
+                    if requirement != 'Not Available'
+                    }
+    value = sorted(requirements) if 'Included' in requirements else sorted(requirements, reverse=True)
+    return '/'.join(value)
+
+
+def get_unit_base_sku(manufacturerSku: str, series: Dict) -> str:
+    """Return the baseSku of a 'unit' inside its series
+
+    Parameters
+    ----------
+    manufacturerSku : str
+        manufacturerSku of the 'unit'
+    series : Dict
+        the series in the local database/catalog containing the 'unit'
+
+    Returns
+    -------
+    str
+        The baseSku
+    """
+    # Most of the series have 'baseSku'
+    if series['baseSku']:
+        # baseSku = ','.join(sku for sku in series['baseSku'] if manufacturerSku.startswith(sku))
+        baseSku = next((sku for sku in series['baseSku']
+                        if manufacturerSku.startswith(sku)),
+                       None)
+
+        # For cases such as pricebook lines 614-615. 'manufacturerSku': 'BHD4STFCN' <--> 'baseSku': 'BHD4-Cradle'
+        if not baseSku:
+            unit_details = next((unit
+                                 for unit in series['units']
+                                 for item in unit['details']
+                                 if item and manufacturerSku == item['manufacturerSku']),
+                                None)
+            unit_index = series['units'].index(unit_details)
+            baseSku = series['baseSku'][unit_index]
+
+        # Special cases such as for ncf lines: 112, 113, 262, 372, 663, 821, 836, 837, 853, 637-40 and 727
+        # Example: 'BHD4-Glass', 'BHD4-Cradle', 'NEFB33H', 'NEFB40H',
+        # 'NEFBD50HE', 'NEFB36H-BS', 'GDIZC', 'GDI3N', 'GDIG3N',
+        # 'GDIX3N', 'GDIX4N', 'GD82NT-PA', 'GSS36CF', 'S20i',
+        # 'NEFP33-0214W', 'NEFB50H-3SV', 'NEFB60H-3SV',
+        # !IMPORTANT: leave these baseSku the way they are: 'BHD4-Glass', 'BHD4-Cradle', 'S20i'
+        if not baseSku[-1].islower():
+            baseSku = re.search(r'^[A-Z]*\d*', baseSku)[0]
+
+    # For some rare case without 'baseSku', e.g. pricebook lines 1818-1819, 1841-1842
     else:
-        ncf_data.to_excel(target_file, index=False)
+        # console.log(manufacturerSku)
+        # See here for info on the regex: https://regex101.com/r/E9id2S/1/
+        baseSku = re.search(r'^[A-Z]*\d*', manufacturerSku)[0]
+
+    return baseSku
 
 
 def is_unit(row: pd.Series, database: Dict[str, Dict]) -> str:
@@ -565,25 +1268,11 @@ def is_unit(row: pd.Series, database: Dict[str, Dict]) -> str:
         'Not found' if item does not exist in database,
         '' (blank) if found but not a 'unit'
     """
-    # To tolerate input typo (lower case) in ncf that causes issue: e.g,  in ncf file, line 748, 603, 543
-    # Cannot fix with a simple `str.upper()` due to there is SKU such as 'S20i' and 'S25i'
-    manufacturerSku = row['manufacturerSKU']
-    if not re.search(r'[A-Z]', manufacturerSku):
-        manufacturerSku = row['manufacturerSKU'].upper()
-    result = ''
-    variation = database['variations'].get(manufacturerSku)
-    product = database['products'].get(manufacturerSku)
-    if not variation and not product:
-        for series in database['series'].values():
-            if manufacturerSku in (i['manufacturerSku']
-                                   for unit in series['units']
-                                   for i in unit['details']
-                                   if i):
-                result = 'TRUE'
-                break
-        else:
-            result = 'Not found'
-    return result
+    # The resolver tolerates input typo (lower case) in ncf, e.g. in ncf file, line 748, 603, 543
+    kind = get_sku_resolver(database).kind(row['manufacturerSKU'])
+    if kind is None:
+        return 'Not found'
+    return 'TRUE' if kind == 'unit' else ''
 
 
 def check_base_sku(row: pd.Series, database: Dict[str, Dict]) -> str:
@@ -606,56 +1295,16 @@ def check_base_sku(row: pd.Series, database: Dict[str, Dict]) -> str:
         'Not found' if does not exist in database,
         '' (blank) if found but not a 'unit'
     """
-    # To tolerate input typo (lower case) in ncf that causes issue: e.g,  in ncf file, line 748, 603, 543
-    # Cannot fix with a simple `str.upper()` due to there is SKU such as 'S20i' and 'S25i'
-    manufacturerSku = row['manufacturerSKU']
-    if not re.search(r'[A-Z]', manufacturerSku):
-        manufacturerSku = row['manufacturerSKU'].upper()
-    baseSku = ''
-    variation = database['variations'].get(manufacturerSku)
-    product = database['products'].get(manufacturerSku)
-    if not variation and not product:
-        for series in database['series'].values():
-            if manufacturerSku in (i['manufacturerSku']
-                                   for unit in series['units']
-                                   for i in unit['details']
-                                   if i):
-                # Most of the series have 'baseSku'
-                if series['baseSku']:
-                    # baseSku = ','.join(sku for sku in series['baseSku'] if manufacturerSku.startswith(sku))
-                    baseSku = next((sku for sku in series['baseSku']
-                                    if manufacturerSku.startswith(sku)),
-                                   None)
-
-                    # For cases such as pricebook lines 614-615. 'manufacturerSku': 'BHD4STFCN' <--> 'baseSku': 'BHD4-Cradle'
-                    if not baseSku:
-                        unit_details = next((unit
-                                             for unit in series['units']
-                                             for item in unit['details']
-                                             if item and manufacturerSku == item['manufacturerSku']),
-                                            None)
-                        unit_index = series['units'].index(unit_details)
-                        baseSku = series['baseSku'][unit_index]
-
-                    # Special cases such as for ncf lines: 112, 113, 262, 372, 663, 821, 836, 837, 853, 637-40 and 727
-                    # Example: 'BHD4-Glass', 'BHD4-Cradle', 'NEFB33H', 'NEFB40H',
-                    # 'NEFBD50HE', 'NEFB36H-BS', 'GDIZC', 'GDI3N', 'GDIG3N',
-                    # 'GDIX3N', 'GDIX4N', 'GD82NT-PA', 'GSS36CF', 'S20i',
-                    # 'NEFP33-0214W', 'NEFB50H-3SV', 'NEFB60H-3SV',
-                    # !IMPORTANT: leave these baseSku the way they are: 'BHD4-Glass', 'BHD4-Cradle', 'S20i'
-                    if not baseSku[-1].islower():
-                        baseSku = re.search(r'^[A-Z]*\d*', baseSku)[0]
-
-                # For some rare case without 'baseSku', e.g. pricebook lines 1818-1819, 1841-1842
-                else:
-                    # console.log(manufacturerSku)
-                    # See here for info on the regex: https://regex101.com/r/E9id2S/1/
-                    baseSku = re.search(r'^[A-Z]*\d*', manufacturerSku)[0]
-
-                break
-        else:
-            baseSku = 'Not found'
-    return baseSku
+    # The resolver tolerates input typo (lower case) in ncf, e.g. in ncf file, line 748, 603, 543
+    resolver = get_sku_resolver(database)
+    kind = resolver.kind(row['manufacturerSKU'])
+    if kind is None:
+        return 'Not found'
+    if kind != 'unit':
+        return ''
+    manufacturerSku = resolver.resolve(row['manufacturerSKU'])
+    series = database['series'][resolver.locate(manufacturerSku, kind='unit').series]
+    return get_unit_base_sku(manufacturerSku, series)
 
 
 def check_parent_sku(row: pd.Series, database: Dict[str, Dict]) -> str:
@@ -677,15 +1326,12 @@ def check_parent_sku(row: pd.Series, database: Dict[str, Dict]) -> str:
         The baseSku if 'unit',
         '' (blank) if not 'variation' (e.g. 'unit', 'product')
     """
-    # To tolerate input typo (lower case) in ncf that causes issue: e.g,  in ncf file, line 748, 603, 543
-    # Cannot fix with a simple `str.upper()` due to there is SKU such as 'S20i' and 'S25i'
-    manufacturerSku = row['manufacturerSKU']
-    if not re.search(r'[A-Z]', manufacturerSku):
-        manufacturerSku = row['manufacturerSKU'].upper()
+    # The resolver tolerates input typo (lower case) in ncf, e.g. in ncf file, line 748, 603, 543
+    manufacturerSku = get_sku_resolver(database).resolve(row['manufacturerSKU'])
     variation = database['variations'].get(manufacturerSku)
     parent_sku = ''
     if variation:
-        parent_sku = ','.join(sorted({sku for sku, _ in variation['variation_parents']}))
+        parent_sku = join_parent_skus(variation)
     return parent_sku
 
 
@@ -750,21 +1396,11 @@ def required_or_optional_variation(row: pd.Series, database: Dict[str, Dict]) ->
         'Required', 'Optional', 'Required/Optional', 'Included/Optional'
     """
     if row['c__isStepVariationProduct'] == 'TRUE':
-        # To tolerate input typo (lower case) in ncf that causes issue: e.g,  in ncf file, line 748, 603, 543
-        # Cannot fix with a simple `str.upper()` due to there is SKU such as 'S20i' and 'S25i'
-        manufacturerSku = row['manufacturerSKU']
-        if not re.search(r'[A-Z]', manufacturerSku):
-            manufacturerSku = row['manufacturerSKU'].upper()
-
+        # The resolver tolerates input typo (lower case) in ncf, e.g. in ncf file, line 748, 603, 543
+        manufacturerSku = get_sku_resolver(database).resolve(row['manufacturerSKU'])
         variation = database['variations'].get(manufacturerSku)
         if variation:
-            # Remove 'Not Available'
-            requirements = {requirement
-                            for _, requirement in variation['variation_parents']
-                            if requirement != 'Not Available'
-                            }
-            value = sorted(requirements) if 'Included' in requirements else sorted(requirements, reverse=True)
-            return '/'.join(value)
+            return get_variation_requirement(variation)
     return ''
 
 
@@ -772,6 +1408,10 @@ if __name__ == "__main__":
     parser = init_argparse()
     debug = parser.parse_args().debug
     reload_db = parser.parse_args().reload_database
+    validate = parser.parse_args().validate
+    chunksize = parser.parse_args().chunksize
+    jobs = parser.parse_args().jobs
+    revalidate = parser.parse_args().revalidate
 
     database = {}
 
@@ -825,14 +1465,20 @@ if __name__ == "__main__":
     log.info(f"Number of variations: {len(database['variations'])}")
     log.info(f"Number of products: {len(database['products'])}")
 
-    # with console.status("[bold green]Validating NCF file...") as status:
-    #     # Validate NCF file
-    #     validate_ncf(file_to_validate=NCF_CSV_FILE,
-    #                 database=database,
-    #                 target_file=VALIDATED_NCF_CSV_FILE,
-    #                 #  target_file=VALIDATED_NCF_FILE,
-    #                 )
-    #     console.log('NCF file is populated and validated!')
+    if revalidate:
+        # Only validate the NCF rows changed since the previous run
+        revalidate_ncf(file_to_validate=NCF_CSV_FILE,
+                       database=database,
+                       target_file=VALIDATED_NCF_FILE)
+        console.log(f'NCF file is populated and validated! Result: {VALIDATED_NCF_FILE}')
+    elif validate:
+        # Validate NCF file
+        validate_ncf(file_to_validate=NCF_CSV_FILE,
+                     database=database,
+                     target_file=VALIDATED_NCF_FILE,
+                     chunksize=chunksize,
+                     jobs=jobs)
+        console.log(f'NCF file is populated and validated! Result: {VALIDATED_NCF_FILE}')
 
 
     # with console.status("[bold green]Uploading validated file to Google sheet...") as status:
@@ -842,6 +1488,6 @@ if __name__ == "__main__":
     #     console.log(f'Sheet URL: {sheet_url}')
 
     # Print CLI helper if the code was not called with any argument
-    if not (debug or reload_db):
+    if not (debug or reload_db or validate or revalidate):
         console.print('\n\nCLI info:', style='bold red')
         parser.print_help()
\ No newline at end of file
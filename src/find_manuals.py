@@ -6,12 +6,13 @@ import logging
 import re
 import shutil
 import sys
+from collections import namedtuple
 from functools import partial
 from itertools import groupby
 from multiprocessing import Pool
 from operator import itemgetter
 from pathlib import Path, PurePath
-from typing import Dict, List, Optional, Union
+from typing import Dict, Iterable, List, Optional, Union
 
 # from fuzzywuzzy import fuzz, process
 from rich.console import Console
@@ -43,6 +44,18 @@ LOG_FOLDER = CURRENT_FILEPATH / 'logs'
 LOG_FOLDER.mkdir(exist_ok=True)
 FOUND_MANUALS_RESULT_FILE = LOG_FOLDER / 'found_manuals.csv'
 NOT_FOUND_MANUALS_RESULT_FILE = LOG_FOLDER / 'not_found_manuals.csv'
+# Columns added to the input columns in the result files
+RESULT_COLUMNS = ['matched_manual', 'comment']
+
+# Result of an item, returned by the workers: the result file it belongs in and its line
+ManualResult = namedtuple('ManualResult', 'found line')
+
+# Comment of the not found items, by result of `find_match()`
+IGNORED = 'ignore'
+NO_BRAND_MANUALS = 'no-brand'
+NOT_FOUND_COMMENTS = {IGNORED: 'Ignored.',
+                      NO_BRAND_MANUALS: 'Empty brand of does not have manuals for this brand.',
+                      None: 'Not found any matched installation manual.'}
 
 
 def init_argparse() -> argparse.ArgumentParser:
@@ -71,20 +84,27 @@ def import_item_list(file):
 
 
 def extract_installation_manual(file):
-    # Remove the not found result file and log file if exists
-    FOUND_MANUALS_RESULT_FILE.unlink(missing_ok=True)
-    NOT_FOUND_MANUALS_RESULT_FILE.unlink(missing_ok=True)
-
     items_needed_manuals = import_item_list(file)
+    # Same columns in both result files, whatever the results
+    fieldnames = list(items_needed_manuals[0]) if items_needed_manuals else []
+    fieldnames += [column for column in RESULT_COLUMNS if column not in fieldnames]
 
     directory = load_directory_file()
     # breakpoint()
 
+    # The result files are only written here, in the order of the input items, as the results come back
+    with ManualResultWriter(fieldnames) as result_writer:
+        find_installation_manuals(items_needed_manuals, directory, result_writer)
+
+
+def find_installation_manuals(items_needed_manuals: List[Dict[str, str]],
+                              directory: Dict[str, List[Dict[str, str]]],
+                              result_writer: 'ManualResultWriter') -> None:
     # Synchronouse fashion, easy for debug
     if parsing_mode == 'sequential':
         for item in items_needed_manuals:
             try:
-                find_installation_manual(item, directory=directory)
+                result_writer.write(find_installation_manual(item, directory=directory))
             except Exception as error:
                 log.error(f'{item=}')
                 log.exception(error)
@@ -116,6 +136,7 @@ def extract_installation_manual(file):
                                      items_needed_manuals,
                                      chunksize=8)
                     for result in results:
+                        result_writer.write(result)
                         progress.advance(task_id)
 
             except Exception as error:
@@ -127,28 +148,24 @@ def extract_installation_manual(file):
 
 
 def find_installation_manual(item: Dict[str, str],
-                             directory: List[Dict[str, str]]) -> None:
+                             directory: Dict[str, List[Dict[str, str]]]) -> ManualResult:
+    """Copy the installation manual of an item and return its result line, written by the parent process"""
     manual_path = find_match(item, directory)
-    if manual_path == 'ignore':
-        # Write ignored item to log
-        item.update({'comment': 'Ignored.'})
-        write_items_to_csv(file=NOT_FOUND_MANUALS_RESULT_FILE, lines=[item])
-    elif manual_path:
-        copy_manual(item=item,
-                    manual_path=manual_path,
-                    out_dir=OUTPUT_MANUAL_FOLDER)
-        # Write the match image file to log
-        item.update({'matched_manual': Path(manual_path).relative_to(INPUT_MANUAL_FOLDER)})
-        write_items_to_csv(file=FOUND_MANUALS_RESULT_FILE, lines=[item])
-    else:
-        # Write not found item to log
-        item.update({'comment': 'Not found any matched installation manual.'})
-        write_items_to_csv(file=NOT_FOUND_MANUALS_RESULT_FILE, lines=[item])
+    if manual_path in NOT_FOUND_COMMENTS:
+        return ManualResult(found=False, line={**item, 'comment': NOT_FOUND_COMMENTS[manual_path]})
+
+    copy_manual(item=item,
+                manual_path=manual_path,
+                out_dir=OUTPUT_MANUAL_FOLDER)
+    # Log the matched manual file
+    return ManualResult(found=True,
+                        line={**item, 'matched_manual': str(Path(manual_path).relative_to(INPUT_MANUAL_FOLDER))})
 
 
 def find_match(item: Dict[str, str],
-               directory: List[Dict[str, str]]
+               directory: Dict[str, List[Dict[str, str]]]
                ) -> Optional[Union[str, PurePath]]:
+    """Return the manual file of the item, `IGNORED` or `NO_BRAND_MANUALS`, or None if not found"""
     sku_to_ignore = ['SDLOGS-ODCOUG', 'HDLOGS-ODCOUG',
                      'LOGS-DRTWOOD-48', 'LOGS-DRTWOOD-60', 'LOGS-DRTWOOD-72',
                      'DRTWOOD-JADE',
@@ -156,14 +173,11 @@ def find_match(item: Dict[str, str],
                      ]
     if (item.get('manufacturerSKU') in sku_to_ignore
         or item.get('c__productCategory', '').lower() == 'Media Kits'.lower()):
-        return 'ignore'
+        return IGNORED
 
     brand = item['brand']
     if not brand or not directory.get(brand):
-        # Write not found item to log
-        item.update({'comment': 'Empty brand of does not have manuals for this brand.'})
-        write_items_to_csv(file=NOT_FOUND_MANUALS_RESULT_FILE, lines=[item])
-        return None
+        return NO_BRAND_MANUALS
 
     matched_manuals = find_fuzzy(item=item,
                                  brand_directory=directory[brand])
@@ -288,19 +302,47 @@ def copy_manual(item: Dict,
         log.error(error)
 
 
-def write_items_to_csv(file, lines):
-    '''Write item without found images into csv file'''
-    file_exists = Path(file).exists()
-    with open(Path(file), 'a') as csvfile:
-        headers = list(lines[0].keys())
-        writer = csv.DictWriter(csvfile, delimiter=',',
-                                lineterminator='\n',
-                                fieldnames=headers)
+class ManualResultWriter:
+    """Write the results of `find_installation_manual()` into the found and not found result files
+
+    Both files are opened once, replacing the previous results, and written through one buffered writer each
+    with the same header, `fieldnames`. A column missing from a line is left empty
 
-        if not file_exists:
-            writer.writeheader()  # file doesn't exist yet, write a header
+    Parameters
+    ----------
+    fieldnames : Iterable[str]
+        the columns of the result files
+    found_file : PurePath, optional
+        by default `FOUND_MANUALS_RESULT_FILE`
+    not_found_file : PurePath, optional
+        by default `NOT_FOUND_MANUALS_RESULT_FILE`
+    """
 
-        writer.writerows(lines)
+    def __init__(self,
+                 fieldnames: Iterable[str],
+                 found_file: PurePath = FOUND_MANUALS_RESULT_FILE,
+                 not_found_file: PurePath = NOT_FOUND_MANUALS_RESULT_FILE) -> None:
+        self.fieldnames = list(fieldnames)
+        self.files = {True: found_file, False: not_found_file}
+        self.outputs = {}
+        self.writers = {}
+
+    def __enter__(self) -> 'ManualResultWriter':
+        for found, file in self.files.items():
+            self.outputs[found] = open(file, 'w', newline='')
+            self.writers[found] = csv.DictWriter(self.outputs[found], delimiter=',',
+                                                 lineterminator='\n',
+                                                 fieldnames=self.fieldnames,
+                                                 extrasaction='ignore')
+            self.writers[found].writeheader()
+        return self
+
+    def write(self, result: ManualResult) -> None:
+        self.writers[result.found].writerow(result.line)
+
+    def __exit__(self, *exc_info) -> None:
+        for output in self.outputs.values():
+            output.close()
 
 
 if __name__ == '__main__':
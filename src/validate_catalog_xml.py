@@ -0,0 +1,297 @@
+# __Author__: Khoi Van 2021
+
+import argparse
+import logging
+import sys
+from collections import Counter, namedtuple
+from pathlib import Path, PurePath
+from typing import Dict, Iterable, List, Optional, Set
+from xml.parsers import expat
+
+from rich.console import Console
+from rich.logging import RichHandler
+from rich.table import Table
+
+from create_xml_object import NAPOLEON_XML_FILE, ORIGINAL_DATA_FOLDER, open_catalog_file
+
+console = Console()
+
+# Set logger using Rich: https://rich.readthedocs.io/en/latest/logging.html
+logging.basicConfig(
+    level="INFO",
+    format="%(message)s",
+    datefmt="[%X]",
+    handlers=[RichHandler(rich_tracebacks=True)]
+)
+log = logging.getLogger("rich")
+
+
+PRODUCT_STRUCTURE_FILE = ORIGINAL_DATA_FOLDER / 'productStructureExample-6.4.21.xml'
+
+# Element paths inside `<product>`, e.g. 'custom-attributes/custom-attribute':
+# the paths found in the example products, and the paths found in every one of them
+ProductStructure = namedtuple('ProductStructure', 'allowed required')
+
+# An error found in a catalog XML, at the line of the element it is about
+ValidationError = namedtuple('ValidationError', 'line check product_id message')
+
+# Size of the chunks read from the file, expat keeps no more than one chunk and the current product
+READ_SIZE = 1 << 20
+
+
+def init_argparse() -> argparse.ArgumentParser:
+    """Creating CLI helper"""
+    parser = argparse.ArgumentParser(
+        usage="python %(prog)s [OPTIONS]",
+        description="Check the structure of a generated catalog XML before importing it."
+    )
+    parser.add_argument('-f', '--file',
+                        help=f'Catalog XML file to check, can be gzipped (default: {NAPOLEON_XML_FILE.name}).',
+                        type=Path,
+                        default=NAPOLEON_XML_FILE)
+    parser.add_argument('-s', '--structure',
+                        help=f'Catalog XML with the expected product structure (default: {PRODUCT_STRUCTURE_FILE.name}).',
+                        type=Path,
+                        default=PRODUCT_STRUCTURE_FILE)
+    parser.add_argument('-r', '--reference',
+                        help='Other catalog XML files (e.g. the current catalog) whose product IDs '
+                             'can also be referenced by a productSetId.',
+                        type=Path,
+                        nargs='*',
+                        default=[])
+    parser.add_argument('-n', '--max-errors',
+                        help='Maximum number of errors printed (default: 50).',
+                        type=int,
+                        default=50)
+    return parser
+
+
+class CatalogXmlValidator:
+    """Check a catalog XML file product by product, streaming it with `expat`
+
+    Only the current product, the product IDs and the productSetId references are kept in memory.
+    The checks, named in the errors:
+
+    - 'missing-product-id': a `<product>` without 'product-id'
+    - 'duplicate-product-id': a 'product-id' already used by a previous `<product>`
+    - 'empty-custom-attribute': a `<custom-attribute>` without value
+    - 'unresolved-product-set-id': a productSetId that is not the ID of any product of the file or `known_ids`
+    - 'unexpected-element': an element that no product of the structure has at this path
+    - 'missing-element': an element that every product of the structure has
+    - 'not-well-formed': the file is not XML from this line on, the rest of the file is not checked
+
+    Parameters
+    ----------
+    structure : Optional[ProductStructure], optional
+        the expected product structure, from `load_product_structure()`;
+        without it, the elements of the products are not checked, by default None
+    known_ids : Iterable[str], optional
+        product IDs defined elsewhere that a productSetId can reference, by default ()
+    """
+
+    def __init__(self, structure: Optional[ProductStructure] = None, known_ids: Iterable[str] = ()) -> None:
+        self.structure = structure
+        self.known_ids = frozenset(known_ids)
+        self.parser = None
+        self.errors = []
+        self.product_ids = set()
+        # (productSetId, line, product ID) of every product, resolved once all the IDs are known
+        self.product_set_ids = []
+        # Path inside its `<product>` of each open element, see `start_element()`
+        self.stack = []
+        self.product_id = None
+        self.product_line = None
+        self.product_paths = set()
+        # [attribute-id, line, text pieces] of the open `<custom-attribute>`
+        self.custom_attribute = None
+
+    def validate(self, xml_file: PurePath) -> List[ValidationError]:
+        """Check `xml_file`, gzipped if it ends with '.gz', and return the errors sorted by line"""
+        self.parser = expat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        with open_catalog_file(xml_file) as fin:
+            try:
+                while True:
+                    chunk = fin.read(READ_SIZE)
+                    self.parser.Parse(chunk, not chunk)
+                    if not chunk:
+                        break
+            except expat.ExpatError as error:
+                # Nothing after the error can be read
+                self.add_error('not-well-formed', expat.ErrorString(error.code), line=error.lineno)
+
+        for product_set_id, line, product_id in self.product_set_ids:
+            if product_set_id not in self.product_ids and product_set_id not in self.known_ids:
+                self.add_error('unresolved-product-set-id', f'productSetId "{product_set_id}" is not a product',
+                               line=line, product_id=product_id)
+        return sorted(self.errors, key=lambda error: error.line)
+
+    def add_error(self, check: str, message: str, line: Optional[int] = None, product_id: Optional[str] = None) -> None:
+        self.errors.append(ValidationError(line or self.parser.CurrentLineNumber,
+                                           check,
+                                           product_id or self.product_id,
+                                           message))
+
+    def start_element(self, name: str, attributes: Dict[str, str]) -> None:
+        # Path of the element inside its `<product>`: '' for the `<product>` itself, None outside of a product
+        parent = self.stack[-1] if self.stack else None
+        if parent:
+            path = f'{parent}/{name}'
+        elif parent == '':
+            path = name
+        elif len(self.stack) == 1 and name == 'product':
+            path = ''
+            self.start_product(attributes)
+        else:
+            path = None
+        self.stack.append(path)
+        if not path:
+            return
+
+        self.product_paths.add(path)
+        if self.structure and path not in self.structure.allowed:
+            self.add_error('unexpected-element', f'<{path}> is not in the product structure')
+        if path == 'custom-attributes/custom-attribute':
+            self.custom_attribute = [attributes.get('attribute-id'), self.parser.CurrentLineNumber, []]
+            # Only the text of the custom attributes is needed
+            self.parser.CharacterDataHandler = self.character_data
+
+    def start_product(self, attributes: Dict[str, str]) -> None:
+        self.product_id = attributes.get('product-id')
+        self.product_line = self.parser.CurrentLineNumber
+        self.product_paths = set()
+        if not self.product_id:
+            self.add_error('missing-product-id', '<product> without product-id')
+        elif self.product_id in self.product_ids:
+            self.add_error('duplicate-product-id', f'product-id "{self.product_id}" is already used')
+        else:
+            self.product_ids.add(self.product_id)
+
+    def character_data(self, data: str) -> None:
+        self.custom_attribute[2].append(data)
+
+    def end_element(self, name: str) -> None:
+        path = self.stack.pop()
+        if path == 'custom-attributes/custom-attribute':
+            self.parser.CharacterDataHandler = None
+            attribute_id, line, pieces = self.custom_attribute
+            value = ''.join(pieces).strip()
+            if not value:
+                self.add_error('empty-custom-attribute', f'custom-attribute "{attribute_id}" is empty', line=line)
+            elif attribute_id == 'productSetId':
+                self.product_set_ids.append((value, line, self.product_id))
+            self.custom_attribute = None
+        elif path == '':
+            self.end_product()
+
+    def end_product(self) -> None:
+        if self.structure:
+            for path in sorted(self.structure.required - self.product_paths):
+                self.add_error('missing-element', f'<{path}> is missing', line=self.product_line)
+        self.product_id = None
+
+
+def load_product_structure(xml_file: PurePath = PRODUCT_STRUCTURE_FILE) -> ProductStructure:
+    """Read the element paths of the products of an example catalog XML, streaming it"""
+    product_paths = []
+    stack = []
+
+    def start_element(name: str, attributes: Dict[str, str]) -> None:
+        stack.append(name)
+        if len(stack) == 2 and name == 'product':
+            product_paths.append(set())
+        elif len(stack) > 2 and stack[1] == 'product':
+            product_paths[-1].add('/'.join(stack[2:]))
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = lambda name: stack.pop()
+    with open_catalog_file(xml_file) as fin:
+        parser.ParseFile(fin)
+
+    allowed = frozenset().union(*product_paths)
+    required = frozenset.intersection(*map(frozenset, product_paths)) if product_paths else frozenset()
+    return ProductStructure(allowed, required)
+
+
+def load_product_ids(xml_files: Iterable[PurePath]) -> Set[str]:
+    """Return the product IDs of catalog XML files, streaming them"""
+    product_ids = set()
+    depth = 0
+
+    def start_element(name: str, attributes: Dict[str, str]) -> None:
+        nonlocal depth
+        depth += 1
+        if depth == 2 and name == 'product' and attributes.get('product-id'):
+            product_ids.add(attributes['product-id'])
+
+    def end_element(name: str) -> None:
+        nonlocal depth
+        depth -= 1
+
+    for xml_file in xml_files:
+        parser = expat.ParserCreate()
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        with open_catalog_file(xml_file) as fin:
+            parser.ParseFile(fin)
+    return product_ids
+
+
+def validate_catalog_xml(xml_file: PurePath,
+                         structure_file: Optional[PurePath] = PRODUCT_STRUCTURE_FILE,
+                         reference_files: Iterable[PurePath] = ()) -> List[ValidationError]:
+    """Check a catalog XML file, see `CatalogXmlValidator`
+
+    Parameters
+    ----------
+    xml_file : PurePath
+        file path to the catalog XML, gzipped if it ends with '.gz'
+    structure_file : Optional[PurePath], optional
+        file path to a catalog XML with the expected product structure,
+        by default `PRODUCT_STRUCTURE_FILE`; None to not check the elements
+    reference_files : Iterable[PurePath], optional
+        other catalog XML files whose product IDs can be referenced by a productSetId, by default ()
+
+    Returns
+    -------
+    List[ValidationError]
+        The errors, sorted by line
+    """
+    structure = load_product_structure(structure_file) if structure_file else None
+    validator = CatalogXmlValidator(structure=structure, known_ids=load_product_ids(reference_files))
+    return validator.validate(xml_file)
+
+
+def print_errors(errors: List[ValidationError], max_errors: int = 50) -> None:
+    summary = Table(title='Catalog XML errors')
+    summary.add_column('Check', no_wrap=True)
+    summary.add_column('Errors', justify='right')
+    for check, count in Counter(error.check for error in errors).most_common():
+        summary.add_row(check, f'{count:,}')
+    console.print(summary)
+
+    table = Table(title=f'First {min(max_errors, len(errors))} of {len(errors):,} errors')
+    table.add_column('Line', justify='right')
+    table.add_column('Check', no_wrap=True)
+    table.add_column('Product')
+    table.add_column('Message')
+    for error in errors[:max_errors]:
+        table.add_row(f'{error.line:,}', error.check, error.product_id or '', error.message)
+    console.print(table)
+
+
+if __name__ == "__main__":
+    parser = init_argparse()
+    args = parser.parse_args()
+
+    errors = validate_catalog_xml(xml_file=args.file,
+                                  structure_file=args.structure,
+                                  reference_files=args.reference)
+    if not errors:
+        log.info(f'"{args.file.name}" has no error.')
+        sys.exit(0)
+    print_errors(errors, max_errors=args.max_errors)
+    sys.exit(1)
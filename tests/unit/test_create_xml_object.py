@@ -0,0 +1,540 @@
+# __Author__: Khoi Van 2021
+
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+sys.path.append(os.path.realpath('src'))
+
+from pathlib import Path
+
+import pytest
+import xmltodict
+from src.create_xml_object import (BRAND, TEMPLATE_CATALOG_TYPE, CatalogGenerationError, CatalogItem, CatalogSections,
+                                   CatalogXmlWriter, Item, MissingCatalogInfo, Option_Product, Variation_Product,
+                                   check_failures, generate_catalog_fragments, generate_planned_products,
+                                   generate_catalog_products,
+                                   get_catalog_file, get_fuel_ignition_matrix, get_item_extra_info,
+                                   get_parent_set_names, get_parent_skus, get_variation_master_step_names,
+                                   get_series_attributes, get_unit_sku_with_specific_fuel_ignition,
+                                   get_units_with_same_series_number, is_shared_variation_product,
+                                   is_step_variation_product,
+                                   load_csv_info, load_db,
+                                   load_xml_info, plan_brand_items, plan_catalog_items, plan_categories, render_product, write_xml,
+                                   write_xml_delta, write_xml_shards)
+
+
+CURRENT_FILEPATH = Path(__file__).resolve().parent.parent.parent
+DATA_FOLDER = CURRENT_FILEPATH / 'src' / 'data'
+CSV_EXTRA_INFO_FILE = DATA_FOLDER / 'original' / 'ncfCatalogTemplate.csv'
+XML_EXTRA_INFO_FILE = DATA_FOLDER / 'original' / 'productStructureExample-6.4.21.xml'
+DATABASE_FILE = DATA_FOLDER / '_build' / 'napoleon-database.json'
+
+
+@pytest.fixture(scope='module')
+def database():
+    return load_db(DATABASE_FILE)
+
+
+@pytest.fixture(scope='module')
+def csv_extra_info():
+    return load_csv_info(CSV_EXTRA_INFO_FILE)
+
+
+@pytest.fixture(scope='module')
+def xml_extra_info():
+    return load_xml_info(XML_EXTRA_INFO_FILE)
+
+
+@pytest.mark.parametrize(
+    "sku", ['2200-1', 'GD82NT', 'gd82nt', 'PVA52', 'not-a-sku']
+)
+def test_load_csv_info_index(csv_extra_info, sku):
+    lines, index = csv_extra_info
+    # Same as scanning every row
+    expect = {key: value
+              for line in lines
+              if line.get('manufacturerSKU').lower() == sku.lower()
+              for key, value in line.items()}
+    assert index.get(sku.lower(), {}) == expect
+
+
+def test_load_xml_info_index(xml_extra_info):
+    _, index = xml_extra_info
+    with open(XML_EXTRA_INFO_FILE) as fd:
+        products = xmltodict.parse(fd.read())['catalog']['product']
+
+    # Same as `xmltodict` for the fields used by the `Item` classes
+    for product in products:
+        expect = {key: value
+                  for other in products
+                  if other['@product-id'] == product['@product-id']
+                  for key, value in other.items()
+                  if key in ('@product-id', 'upc', 'page-attributes')}
+        assert index[product['@product-id']] == expect
+
+
+def test_load_xml_info_catalog(tmp_path):
+    xml_file = tmp_path / 'catalog.xml'
+    xml_file.write_text('''<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.demandware.com/xml/impex/catalog/2006-10-31" catalog-id="ncf-m-catalog">
+    <header><image-settings/></header>
+    <product product-id="a"><upc>123</upc></product>
+    <category-assignment category-id="gas" product-id="a">
+        <primary-flag>true</primary-flag>
+    </category-assignment>
+    <category-assignment category-id="wood" product-id="a"/>
+    <product-option option-id="selectOptionFuelType"/>
+</catalog>''')
+    removed_sections = {}
+    catalog, _ = load_xml_info(xml_file, removed_sections=removed_sections)
+    expect = xmltodict.parse(xml_file.read_text())['catalog']
+    assert removed_sections == {tag: [expect.pop(tag)] for tag in ('header', 'product-option')}
+    expect['product'] = None
+    assert catalog == expect
+    assert list(catalog) == list(expect)
+
+
+def test_get_item_extra_info_returns_copies(csv_extra_info, xml_extra_info):
+    _, csv_index = csv_extra_info
+    _, xml_index = xml_extra_info
+    extra_info = get_item_extra_info(csv_index, xml_index, sku='PVA52')
+    extra_info['csv']['ID'] = 'changed'
+    assert csv_index['pva52']['ID'] != 'changed'
+
+
+@pytest.mark.parametrize(
+    "products", [
+        [],
+        [{'@product-id': 'a', 'upc': None}],
+        [{'@product-id': 'a', 'upc': '123', 'display-name': {'@xml:lang': 'x-default', '#text': 'Café < 42" & co'}},
+         {'@product-id': 'b', 'custom-attributes': {'custom-attribute': [{'@attribute-id': 'sku', '#text': 'B'},
+                                                                         {'@attribute-id': 'empty', '#text': None}]},
+          'options': {'shared-option': []}}],
+    ]
+)
+def test_write_xml_same_as_xmltodict(tmp_path, products):
+    catalog = {'@xmlns': 'http://www.demandware.com/xml/impex/catalog/2006-10-31',
+               '@catalog-id': 'ncf-m-catalog',
+               'header': {'image-settings': None},
+               'product': None,
+               'category-assignment': [{'@category-id': 'gas', '@product-id': 'a'},
+                                       {'@category-id': 'wood', '@product-id': 'a', 'primary-flag': 'true'}]}
+    target_file = tmp_path / 'catalog.xml'
+    write_xml(target_file, catalog, ({'product': product} for product in products))
+
+    expect = {'catalog': {**catalog, 'product': products}}
+    expect = xmltodict.unparse(expect, encoding='UTF-8', pretty=True, short_empty_elements=True, indent='    ')
+    assert target_file.read_bytes() == expect.encode('utf-8')
+
+
+def test_write_xml_keeps_previous_catalog_on_error(tmp_path):
+    target_file = tmp_path / 'catalog.xml.gz'
+    write_xml(target_file, {'@catalog-id': 'ncf-m-catalog'}, [{'product': {'@product-id': 'a'}}])
+    previous = target_file.read_bytes()
+
+    def products():
+        yield {'product': {'@product-id': 'b'}}
+        raise KeyError('product_category')
+
+    with pytest.raises(KeyError):
+        write_xml(target_file, {'@catalog-id': 'ncf-m-catalog'}, products())
+    assert target_file.read_bytes() == previous
+    assert [file.name for file in tmp_path.iterdir()] == ['catalog.xml.gz']
+
+
+def test_catalog_xml_writer_empty_catalog(tmp_path):
+    catalog = {'@catalog-id': 'ncf-m-catalog'}
+    target_file = tmp_path / 'catalog.xml'
+    with CatalogXmlWriter(target_file, catalog):
+        pass
+    expect = xmltodict.unparse({'catalog': catalog}, encoding='UTF-8', pretty=True,
+                               short_empty_elements=True, indent='    ')
+    assert target_file.read_bytes() == expect.encode('utf-8')
+
+
+@pytest.mark.parametrize(
+    "sku", ['AX42NTE', 'OLKAX42', 'not-a-sku']
+)
+def test_item_to_xml_same_as_xmltodict(database, csv_extra_info, xml_extra_info, sku):
+    extra_info = get_item_extra_info(csv_extra_info[1], xml_extra_info[1], sku=sku)
+    data = Item(sku=sku, catalog_info=database, extra_info=extra_info, display_name=' Log Set ').to_xml()
+    # The dict is already what `xmltodict` reads back from its XML, in the same order
+    parsed = xmltodict.parse(xmltodict.unparse(data))
+    assert parsed == data
+    assert list(parsed['product']) == list(data['product'])
+
+
+@pytest.mark.parametrize(
+    "item_class, sku", [
+        (Option_Product, 'AX42NTE'),
+        (Variation_Product, 'OLKAX42'),
+    ]
+)
+def test_to_xml(database, csv_extra_info, xml_extra_info, item_class, sku):
+    extra_info = get_item_extra_info(csv_extra_info[1], xml_extra_info[1], sku=sku)
+    data = item_class(sku=sku, brand='Napoleon', catalog_info=database, extra_info=extra_info).to_xml()
+    assert data['product']['manufacturer-sku'] == {'#text': sku}
+    assert {'@attribute-id': 'sku', '#text': sku} in data['product']['custom-attributes']['custom-attribute']
+
+
+def test_plan_catalog_items(database):
+    plan = plan_catalog_items(database)
+    assert len(plan) == len(database['series']) + 1
+    skus = [item.sku for items in plan for item in items]
+    assert len(skus) == len(set(skus))
+    assert {item.product_type for item in plan[-1]} == {'Product'}
+    assert {item.catalog_type for item in plan[-1]} == {'products'}
+
+
+def test_generate_catalog_products_in_parallel_keeps_order(database, csv_extra_info, xml_extra_info):
+    expect = list(generate_catalog_products(database, csv_extra_info[1], xml_extra_info[1]))
+    answer = list(generate_catalog_products(database, csv_extra_info[1], xml_extra_info[1], jobs=3))
+    assert answer == expect
+    # Every kind of item is generated
+    product_types = {attribute['#text']
+                     for product in expect
+                     for attribute in product['product']['custom-attributes']['custom-attribute']
+                     if attribute['@attribute-id'] == 'productTypeNonoperative'}
+    assert product_types == {'Option Product', 'Product', 'Variation Product'}
+
+
+@pytest.mark.parametrize(
+    "series, ignition_type, venting, top_and_rear_venting", [
+        ('series-7', 'Electronic Ignition', 'Top', False),
+        ('series-16', 'Electronic or Millivolt Ignition', 'Top & Rear', False),
+        ('series-10', 'Electronic Ignition', 'Top or Rear', True),
+        ('series-23', '', '', False),    # Wood Fireplace
+    ]
+)
+def test_get_series_attributes(database, series, ignition_type, venting, top_and_rear_venting):
+    attributes = get_series_attributes(database)[series]
+    assert attributes.ignition_types['units'] == ignition_type
+    assert attributes.venting == venting
+    assert attributes.top_and_rear_venting == top_and_rear_venting
+
+
+def test_fuel_ignition_matrix_same_as_first_match(database):
+    units = [details['manufacturerSku']
+             for series in database['series'].values()
+             for line in series['units']
+             for details in line['details']
+             if details and details.get('productTypeNonoperative') == 'Option Product']
+    for sku in units:
+        same_series_number = get_units_with_same_series_number(sku=sku, database=database)
+        matrix = get_fuel_ignition_matrix(sku=sku, database=database)
+        for fuel in ['propane', 'natural gas', None]:
+            for ignition in ['electronic', 'millivolt']:
+                requirements = {'gas_fuel_type': fuel, 'ignition_type': ignition} if fuel else {'ignition_type': ignition}
+                expect = get_unit_sku_with_specific_fuel_ignition(requirements=requirements, units=same_series_number)
+                assert matrix.get((fuel, ignition), '') == expect
+
+
+def test_variation_product_category_from_ncf_template(database, csv_extra_info, xml_extra_info):
+    _, csv_index = csv_extra_info
+    _, xml_index = xml_extra_info
+    # Variations the database does not categorize
+    skus = [details['manufacturerSku']
+            for series in database['series'].values()
+            for line in series.get('variations', [])
+            for details in line['details']
+            if details and 'product_category' not in details]
+
+    def make_variation(sku):
+        extra_info = get_item_extra_info(csv_extra_info=csv_index, xml_extra_info=xml_index, sku=sku)
+        return Variation_Product(sku=sku, brand=BRAND, catalog_info=database, extra_info=extra_info)
+
+    sku = next(sku for sku in skus if csv_index.get(sku.lower(), {}).get('c__productCategory'))
+    assert make_variation(sku).product_category == csv_index[sku.lower()]['c__productCategory']
+    sku = next(sku for sku in skus if not csv_index.get(sku.lower(), {}).get('c__productCategory'))
+    with pytest.raises(MissingCatalogInfo):
+        make_variation(sku).to_xml()
+
+
+def test_check_failures():
+    failures = [(CatalogItem('Variation Product', 'A', 'variations'), "MissingCatalogInfo('...')")]
+    check_failures(failures, total=10, max_failures=0.1)
+    with pytest.raises(CatalogGenerationError):
+        check_failures(failures * 2, total=10, max_failures=0.1)
+
+
+def test_variation_product_attributes_are_lazy(database, csv_extra_info, xml_extra_info):
+    extra_info = get_item_extra_info(csv_extra_info[1], xml_extra_info[1], sku='OLKAX42')
+    product = Variation_Product(sku='OLKAX42', brand='Napoleon', catalog_info=database, extra_info=extra_info)
+    assert 'parentSku' not in vars(product)
+    # Same as deriving the attributes from the `parentSku` text
+    assert product.parentSku == get_parent_skus(sku='OLKAX42', database=database)
+    assert product.parentSetName == get_parent_set_names(parent_skus=product.parentSku)
+    assert product.variationMasterStepName == get_variation_master_step_names(
+        parent_skus=product.parentSku, product_category=product.product_category)
+    assert product.isSharedVariationProduct == is_shared_variation_product(parent_skus=product.parentSku)
+    assert product.isStepVariationProduct == is_step_variation_product(parent_skus=product.parentSku)
+    assert 'parentSku' in vars(product)
+
+
+def test_generate_catalog_fragments_only_recreates_changed_items(tmp_path, database, csv_extra_info, xml_extra_info):
+    cache_file = tmp_path / 'napoleon.fragments.json'
+    expect = [render_product(product['product'])
+              for product in generate_catalog_products(database, csv_extra_info[1], xml_extra_info[1])]
+    assert list(generate_catalog_fragments(database, csv_extra_info[1], xml_extra_info[1], cache_file)) == expect
+
+    # Change the current XML entry of one item
+    xml_index = dict(xml_extra_info[1])
+    sku, item_id = next((item.sku, extra_info['xml']['@product-id'])
+                        for items in plan_catalog_items(database)
+                        for item in items
+                        for extra_info in [get_item_extra_info(csv_extra_info[1], xml_index, sku=item.sku)]
+                        if extra_info['xml'])
+    xml_index[item_id] = {**xml_index[item_id], 'upc': '012345678905'}
+    before = json.loads(cache_file.read_text())['fragments']
+
+    answer = list(generate_catalog_fragments(database, csv_extra_info[1], xml_index, cache_file, jobs=2))
+    assert answer == [render_product(product['product'])
+                      for product in generate_catalog_products(database, csv_extra_info[1], xml_index)]
+    after = json.loads(cache_file.read_text())['fragments']
+    assert [key for key in after if after[key] != before[key]] == [sku]
+
+
+@pytest.mark.parametrize(
+    "max_bytes, max_products, shard_products", [
+        (None, 2, [2, 2, 1]),
+        (None, 10, [5]),
+        (1, None, [1, 1, 1, 1, 1]),
+        (250, 2, [2, 2, 1]),
+    ]
+)
+def test_write_xml_shards(tmp_path, max_bytes, max_products, shard_products):
+    catalog = {'@xmlns': 'http://www.demandware.com/xml/impex/catalog/2006-10-31',
+               '@catalog-id': 'ncf-m-catalog',
+               'product': None,
+               'category-assignment': {'@category-id': 'gas', '@product-id': 'a'}}
+    products = [{'@product-id': f'{index}', 'upc': f'{index}' * 10} for index in range(5)]
+    target_file = tmp_path / 'napoleon.xml'
+    manifest = write_xml_shards(target_file, catalog, ({'product': product} for product in products),
+                                max_bytes=max_bytes, max_products=max_products, jobs=2)
+
+    assert manifest == json.loads((tmp_path / 'napoleon.manifest.json').read_text())
+    assert manifest['products'] == len(products)
+    assert [shard['products'] for shard in manifest['shards']] == shard_products
+
+    answer = []
+    for number, shard in enumerate(manifest['shards'], start=1):
+        assert shard['file'] == f'napoleon-{number:03d}.xml'
+        content = (tmp_path / shard['file']).read_bytes()
+        assert shard['sha256'] == hashlib.sha256(content).hexdigest()
+        parsed = xmltodict.parse(content, force_list=('product',))['catalog']
+        assert parsed['@catalog-id'] == 'ncf-m-catalog'
+        # The other sections are only in the last shard
+        assert ('category-assignment' in parsed) == (number == len(manifest['shards']))
+        answer.extend(parsed['product'])
+    assert answer == products
+
+
+def test_write_xml_shards_kept_on_error(tmp_path):
+    def products():
+        for product_id in 'abc':
+            yield {'product': {'@product-id': product_id}}
+        raise KeyError('product_category')
+
+    target_file = tmp_path / 'catalog.xml'
+    write_xml_shards(target_file, {'@catalog-id': 'ncf-m-catalog'},
+                     [{'product': {'@product-id': product_id}} for product_id in 'xy'], max_products=1)
+    previous = {path.name: path.read_bytes() for path in tmp_path.iterdir()}
+    assert sorted(previous) == ['catalog-001.xml', 'catalog-002.xml', 'catalog.manifest.json']
+
+    with pytest.raises(KeyError):
+        write_xml_shards(target_file, {'@catalog-id': 'ncf-m-catalog'}, products(), max_products=1)
+    # The shards and manifest of the previous run are untouched, no shard of the failed run is left
+    assert {path.name: path.read_bytes() for path in tmp_path.iterdir()} == previous
+
+
+def test_write_xml_shards_removes_previous_shards(tmp_path):
+    target_file = tmp_path / 'napoleon.xml'
+    products = [{'product': {'@product-id': f'{index}'}} for index in range(3)]
+    write_xml_shards(target_file, {'@catalog-id': 'ncf-m-catalog'}, products, max_products=1)
+    assert len(list(tmp_path.glob('napoleon-*.xml'))) == 3
+    write_xml_shards(target_file, {'@catalog-id': 'ncf-m-catalog'}, products, max_products=2)
+    assert sorted(path.name for path in tmp_path.glob('napoleon-*.xml')) == ['napoleon-001.xml', 'napoleon-002.xml']
+
+
+def test_write_xml_delta(tmp_path):
+    def category(name):
+        return {'custom-attributes': {'custom-attribute': {'@attribute-id': 'productCategory', '#text': name}}}
+
+    catalog = {'@xmlns': 'http://www.demandware.com/xml/impex/catalog/2006-10-31',
+               '@catalog-id': 'ncf-m-catalog',
+               'product': None}
+    attributes = [{'@attribute-id': 'sku', '#text': 'A'}, {'@attribute-id': 'series', '#text': 'Ascent'}]
+    current = [{'@product-id': 'a', 'brand': 'Napoleon', 'custom-attributes': {'custom-attribute': attributes}},
+               {'@product-id': 'b', 'brand': 'Napoleon', 'upc': '1'},
+               {'@product-id': 'c', 'brand': 'Napoleon'},
+               {'@product-id': 'd', 'brand': 'Dimplex'},
+               {'@product-id': 'f', 'brand': 'Napoleon', **category('Gas')}]
+    current_xml_file = tmp_path / 'current.xml'
+    write_xml(current_xml_file, catalog, ({'product': product} for product in current),
+              sections=CatalogSections(categories=['Gas']))
+
+    generated = [
+        # Same product, only the order of the custom attributes differs
+        {'@product-id': 'a', 'brand': 'Napoleon', 'custom-attributes': {'custom-attribute': attributes[::-1]}},
+        {'@product-id': 'b', 'brand': 'Napoleon', 'upc': '2'},
+        {'@product-id': 'e', 'brand': 'Napoleon', **category('Gas')},
+        # Only the category assignment changes
+        {'@product-id': 'f', 'brand': 'Napoleon', **category('Logs')},
+    ]
+    target_file = tmp_path / 'napoleon.delta.xml'
+    delta = write_xml_delta(target_file, catalog, ({'product': product} for product in generated), current_xml_file,
+                            sections=CatalogSections(categories=['Gas', 'Logs']))
+
+    assert delta == {'new': ['e'], 'changed': ['b', 'f'], 'removed': ['c']}
+    assert json.loads((tmp_path / 'napoleon.delta.json').read_text()) == delta
+    parsed = xmltodict.parse(target_file.read_bytes(), force_list=('product', 'category-assignment'))['catalog']
+    assert [product['@product-id'] for product in parsed['product']] == ['b', 'e', 'f']
+    assert [category['@category-id'] for category in parsed['category']] == ['gas', 'logs']
+    assert [(assignment['@category-id'], assignment['@product-id'])
+            for assignment in parsed['category-assignment']] == [('gas', 'e'), ('logs', 'f')]
+
+
+def test_item_to_xml_fills_template_per_item(database):
+    first = Item(sku='a', catalog_info=database, extra_info={}, upc='1', display_name='First').to_xml()
+    second = Item(sku='b', catalog_info=database, extra_info={}, display_name='', classification_category='logs').to_xml()
+    assert first['product']['upc'] == '1'
+    assert first['product']['display-name'] == {'@xml:lang': 'x-default', '#text': 'First'}
+    assert second['product']['upc'] is None
+    assert second['product']['display-name'] == {'@xml:lang': 'x-default'}
+    assert second['product']['classification-category']['#text'] == 'logs'
+    assert list(first['product']) == list(second['product'])
+
+
+def test_gzipped_catalog_files(tmp_path):
+    catalog = {'@xmlns': 'http://www.demandware.com/xml/impex/catalog/2006-10-31',
+               '@catalog-id': 'ncf-m-catalog',
+               'product': None}
+    products = [{'product': {'@product-id': 'a', 'upc': '123', 'page-attributes': None}}]
+    write_xml(tmp_path / 'napoleon.xml', catalog, products)
+    write_xml(tmp_path / 'napoleon.xml.gz', catalog, products, compresslevel=1)
+
+    content = (tmp_path / 'napoleon.xml.gz').read_bytes()
+    assert gzip.decompress(content) == (tmp_path / 'napoleon.xml').read_bytes()
+    assert load_xml_info(tmp_path / 'napoleon.xml.gz') == load_xml_info(tmp_path / 'napoleon.xml')
+    # Same bytes every time
+    write_xml(tmp_path / 'napoleon.xml.gz', catalog, products, compresslevel=1)
+    assert (tmp_path / 'napoleon.xml.gz').read_bytes() == content
+
+
+@pytest.mark.parametrize(
+    "catalog_file, name_suffix, keep_suffix, expect", [
+        ('napoleon.xml', '.manifest.json', False, 'napoleon.manifest.json'),
+        ('napoleon.xml.gz', '.manifest.json', False, 'napoleon.manifest.json'),
+        ('napoleon.xml', '-001', True, 'napoleon-001.xml'),
+        ('napoleon.xml.gz', '.delta', True, 'napoleon.delta.xml.gz'),
+        ('ncf-mc-all-6.4.21-bu.xml', '.json', False, 'ncf-mc-all-6.4.21-bu.json'),
+    ]
+)
+def test_get_catalog_file(catalog_file, name_suffix, keep_suffix, expect):
+    assert get_catalog_file(Path('out') / catalog_file, name_suffix, keep_suffix=keep_suffix) == Path('out') / expect
+
+
+def test_catalog_sections(tmp_path):
+    def make_product(product_id, category, product_type='Unit', parent_sku='', options=()):
+        attributes = {'sku': product_id.upper(), 'productCategory': category,
+                      'productTypeNonoperative': product_type, 'parentSku': parent_sku}
+        return {'@product-id': product_id,
+                'display-name': {'@xml:lang': 'x-default', '#text': f'Name {product_id}'},
+                'custom-attributes': {'custom-attribute': [{'@attribute-id': attribute_id, '#text': value or None}
+                                                           for attribute_id, value in attributes.items()]},
+                'options': {'shared-option': [{'@option-id': option_id} for option_id in options]}}
+
+    templates = {
+        'product-option': [{'@option-id': 'selectOptionFuelType', 'sort-mode': 'position'},
+                           {'@option-id': 'selectOptionIgnitionType', 'sort-mode': 'price'}],
+        'variation-attribute': [{'@attribute-id': 'selectVariant-media', '@variation-attribute-id': 'media',
+                                 'display-name': {'@xml:lang': 'x-default', '#text': 'Media Kits'},
+                                 'variation-attribute-values': {'variation-attribute-value': []}}],
+        'category': [{'@category-id': 'root', 'online-flag': 'true'}],
+    }
+    sections = CatalogSections(templates, categories=['Gas Fireplaces', 'Media Kits', 'Front Accents', None])
+    catalog = {'@catalog-id': 'ncf-m-catalog', 'product': None,
+               'category-assignment': {'@category-id': 'old', '@product-id': 'x'}}
+    target_file = tmp_path / 'catalog.xml'
+    write_xml(target_file, catalog, [
+        {'product': make_product('a', 'Gas Fireplaces', options=['selectOptionFuelType'])},
+        render_product(make_product('b', 'Media Kits', 'Variation Product', parent_sku='A')),
+        {'product': make_product('c', 'Front Accents', 'Variation Product', parent_sku='A')},
+        {'product': make_product('d', 'Front Accents', 'Variation Product')},
+        {'product': make_product('e', 'Not Planned')},
+    ], sections=sections)
+
+    generated = xmltodict.parse(target_file.read_text(), force_list=('variation-attribute-value',))['catalog']
+    # The order of the schema: header, category*, product*, product-option*, variation-attribute*,
+    # category-assignment*
+    assert list(generated) == ['@catalog-id', 'category', 'product', 'product-option', 'variation-attribute',
+                               'category-assignment']
+    assert generated['product-option'] == {'@option-id': 'selectOptionFuelType', 'sort-mode': 'position'}
+    assert [(attribute['@attribute-id'], [value['@value'] for value in
+                                          attribute['variation-attribute-values']['variation-attribute-value']])
+            for attribute in generated['variation-attribute']] == [('selectVariant-frontAccents', ['C']),
+                                                                   ('selectVariant-media', ['B'])]
+    assert [category['@category-id'] for category in generated['category']] == [
+        'root', 'front-accents', 'gas-fireplaces', 'media-kits']
+    assert generated['category'][1]['parent'] == 'root'
+    assert [(assignment['@category-id'], assignment['@product-id'])
+            for assignment in generated['category-assignment']] == [
+        ('gas-fireplaces', 'a'), ('media-kits', 'b'), ('front-accents', 'c'), ('front-accents', 'd')]
+
+
+def test_write_xml_shards_categories_in_every_shard(tmp_path):
+    sections = CatalogSections({'category': [{'@category-id': 'root'}]}, categories=['Media Kits'])
+    products = [{'product': {'@product-id': product_id,
+                             'custom-attributes': {'custom-attribute': {'@attribute-id': 'productCategory',
+                                                                        '#text': 'Media Kits'}}}}
+                for product_id in 'abc']
+    target_file = tmp_path / 'catalog.xml'
+    manifest = write_xml_shards(target_file, {'@catalog-id': 'ncf-m-catalog'}, products, max_products=2,
+                                sections=sections)
+
+    shards = [xmltodict.parse((tmp_path / shard['file']).read_text(), force_list=('product', 'category'))['catalog']
+              for shard in manifest['shards']]
+    assert [list(shard) for shard in shards] == [['@catalog-id', 'category', 'product'],
+                                                 ['@catalog-id', 'category', 'product', 'category-assignment']]
+    assert all([category['@category-id'] for category in shard['category']] == ['root', 'media-kits']
+               for shard in shards)
+
+
+def test_plan_brand_items(database, csv_extra_info):
+    csv_lines, _ = csv_extra_info
+    plan = plan_brand_items(csv_lines, {BRAND: database}, brands=['Skytech', BRAND])
+    skytech = [line['manufacturerSKU'] for line in csv_lines if line['brand'] == 'Skytech']
+    assert [item.sku for item in plan[0]] == skytech
+    assert {(item.catalog_type, item.brand) for item in plan[0]} == {(TEMPLATE_CATALOG_TYPE, 'Skytech')}
+    assert plan[1:] == plan_catalog_items(database)
+
+
+def test_plan_categories(database, csv_extra_info):
+    csv_lines, csv_index = csv_extra_info
+    plan = plan_brand_items(csv_lines, {BRAND: database}, brands=['Skytech', BRAND])
+    categories = plan_categories(plan, {BRAND: database}, csv_index)
+    skytech = {line['c__productCategory'] for line in csv_lines if line['brand'] == 'Skytech'} - {''}
+    assert skytech <= set(categories)
+    assert len(categories) == len(set(categories))
+    assert plan_categories([[CatalogItem('Product', 'not-a-sku', 'units')]], {BRAND: database}, {}) == []
+
+
+def test_generate_brand_products(database, csv_extra_info, xml_extra_info):
+    csv_lines, csv_index = csv_extra_info
+    _, xml_index = xml_extra_info
+    plan = plan_brand_items(csv_lines, {BRAND: database}, brands=['Skytech', 'DuraVent'])
+    products = list(generate_planned_products(plan, {BRAND: database}, csv_index, xml_index))
+    brands = [product['product']['brand']['#text'] for product in products]
+    assert brands == sorted(brands, key=['Skytech', 'DuraVent'].index)
+
+    product = products[0]['product']
+    row = csv_index[product['manufacturer-sku']['#text'].lower()]
+    assert product['@product-id'] == row['ID']
+    assert product['display-name']['#text'] == row['name__default'].rstrip('|').strip()
+    custom_attributes = {attribute['@attribute-id']: attribute['#text']
+                         for attribute in product['custom-attributes']['custom-attribute']}
+    assert custom_attributes['productCategory'] == row['c__productCategory']
+    assert all(custom_attributes.values())
@@ -10,15 +10,20 @@ from pathlib import Path
 from typing import Dict
 
 import pytest
-from src.extract_napoleon_data_from_catalog import (check_base_sku, check_parent_sku,
+import pandas as pd
+from src.extract_napoleon_data_from_catalog import (build_sku_table, check_base_sku, check_parent_sku,
                                         is_shared_variation_product,
                                         is_step_variation_product, is_unit,
-                                        required_or_optional_variation)
+                                        required_or_optional_variation,
+                                        create_validation_pool, get_sku_resolver, open_validated_ncf_writer,
+                                        revalidate_ncf, validate_ncf, ValidationReport,
+                                        validate_ncf_data, validate_ncf_rows)
 
 
 CURRENT_FILEPATH = Path(__file__).resolve().parent.parent.parent
 DATA_FOLDER = CURRENT_FILEPATH / 'src' / 'data'
 DATABASE_FILE = DATA_FOLDER / '_build' / 'napoleon-crude-data.json'
+NCF_CSV_FILE = DATA_FOLDER / 'original' / 'ncfCatalogTemplate.csv'
 
 
 @pytest.fixture
@@ -286,3 +291,156 @@ def test_required_or_optional_variation(database, row, expect):
     row['c__isStepVariationProduct'] = is_step_variation_product(row)
     answer = required_or_optional_variation(row, database)
     assert answer == expect
+
+
+@pytest.mark.parametrize(
+    "sku, expect", [
+        ('GDSLL-KT', ('GDSLL-KT', 'variation')),
+        ('gdsll-kt', ('GDSLL-KT', 'variation')),    # Typo in input file, should have been uppercase
+        ('S20i', ('S20i', 'unit')),
+        ('s20i', (None, None)),                     # Cannot fix with a simple `str.upper()`
+        ('2200-1', ('2200-1', 'unit')),
+        ('PVA52', ('PVA52', 'product')),
+        ('W565-0274-SER', (None, None)),
+        ('', (None, None)),
+    ]
+)
+def test_sku_resolver(database, sku, expect):
+    resolver = get_sku_resolver(database)
+    assert (resolver.resolve(sku), resolver.kind(sku)) == expect
+
+
+def test_sku_location(database):
+    resolver = get_sku_resolver(database)
+    location = resolver.locate('2200-1', kind='unit')
+    series_line = database['series'][location.series][location.section][location.line]
+    assert location.section == 'units'
+    assert series_line['details'][location.column] is location.record
+    assert location.record['manufacturerSku'] == '2200-1'
+
+    location = resolver.locate('PVA52', kind='product')
+    assert (location.series, location.section) == (None, 'products')
+    assert location.record is database['products']['PVA52']
+
+
+def test_validate_ncf_data_matches_row_functions(database):
+    ncf_data = pd.read_csv(NCF_CSV_FILE, dtype=object)
+    # The per-row functions cannot handle missing SKU
+    ncf_data['manufacturerSKU'] = ncf_data['manufacturerSKU'].fillna('')
+
+    expect = ncf_data.copy()
+    expect['c__unitTrueOrFalse'] = expect.apply(is_unit, axis=1, args=(database,))
+    expect['c__baseSku'] = expect.apply(check_base_sku, axis=1, args=(database,))
+    expect['c__parentSku'] = expect.apply(check_parent_sku, axis=1, args=(database,))
+    expect['c__isSharedVariationProduct'] = expect.apply(is_shared_variation_product, axis=1)
+    expect['c__isStepVariationProduct'] = expect.apply(is_step_variation_product, axis=1)
+    expect['c__requiredOrOptionalVariation'] = expect.apply(required_or_optional_variation, axis=1, args=(database,))
+
+    answer = validate_ncf_data(ncf_data.copy(), build_sku_table(database))
+    columns = ['c__unitTrueOrFalse', 'c__baseSku', 'c__parentSku', 'c__isSharedVariationProduct',
+               'c__isStepVariationProduct', 'c__requiredOrOptionalVariation']
+    assert answer[columns].equals(expect[columns])
+
+
+def test_validate_ncf_rows_in_parallel_keeps_order(database):
+    ncf_data = pd.read_csv(NCF_CSV_FILE, dtype=object)
+    sku_table = build_sku_table(database)
+
+    expect = validate_ncf_data(ncf_data.copy(), sku_table)
+    with create_validation_pool(sku_table, jobs=3) as pool:
+        answer = validate_ncf_rows(ncf_data.copy(), sku_table, pool=pool, jobs=3)
+    assert answer.equals(expect)
+
+
+def test_revalidate_ncf_only_changed_rows(database, tmp_path):
+    template_file = tmp_path / 'ncfCatalogTemplate.csv'
+    ncf_data = pd.read_csv(NCF_CSV_FILE, dtype=object)
+    ncf_data.to_csv(template_file, index=False)
+
+    target_file = tmp_path / 'revalidated.csv'
+    assert revalidate_ncf(template_file, database, target_file) == len(ncf_data)
+    assert revalidate_ncf(template_file, database, target_file) == 0
+
+    # Edit two rows of the template
+    ncf_data.loc[0, 'manufacturerSKU'] = 'PVA52'
+    ncf_data.loc[1, 'manufacturerSKU'] = 'GD82NT'
+    ncf_data.to_csv(template_file, index=False)
+    assert revalidate_ncf(template_file, database, target_file) == 2
+    with open(tmp_path / 'revalidated.report.json', 'r') as fin:
+        assert json.load(fin)['is_unit']['rows'] == 2
+
+    # Change one database entry, only the rows with that SKU are revalidated
+    variation = database['variations']['BLKS']
+    variation['variation_parents'] = variation['variation_parents'][:1]
+    expect_count = (ncf_data['manufacturerSKU'].isin(['BLKS', 'blks'])).sum()
+    assert revalidate_ncf(template_file, database, target_file) == expect_count
+
+    expect_file = tmp_path / 'validated.csv'
+    validate_ncf(template_file, database, expect_file)
+    assert target_file.read_text() == expect_file.read_text()
+
+
+@pytest.mark.parametrize("rows", [None, 0])
+def test_validate_ncf_in_chunks_same_as_full(database, tmp_path, rows):
+    template_file = tmp_path / 'ncfCatalogTemplate.csv'
+    pd.read_csv(NCF_CSV_FILE, dtype=object, nrows=rows).to_csv(template_file, index=False)
+
+    expect_file = tmp_path / 'validated.csv'
+    validate_ncf(template_file, database, expect_file)
+    chunked_file = tmp_path / 'validated-chunks.csv'
+    validate_ncf(template_file, database, chunked_file, chunksize=700)
+    assert chunked_file.read_text() == expect_file.read_text()
+
+
+def test_validate_ncf_in_chunks_to_excel(database, tmp_path):
+    expect_file = tmp_path / 'validated.csv'
+    validate_ncf(NCF_CSV_FILE, database, expect_file)
+
+    excel_file = tmp_path / 'validated.xlsx'
+    validate_ncf(NCF_CSV_FILE, database, excel_file, chunksize=1000)
+
+    expect = pd.read_csv(expect_file, dtype=object, keep_default_na=False)
+    answer = pd.read_excel(excel_file, dtype=object).fillna('')
+    assert answer.equals(expect)
+
+
+@pytest.mark.parametrize("file_name", ['validated.csv', 'validated.xlsx'])
+@pytest.mark.parametrize("chunks", [0, 1])
+def test_chunk_writer_discards_output_on_error(tmp_path, file_name, chunks):
+    target_file = tmp_path / file_name
+    with pytest.raises(ValueError):
+        with open_validated_ncf_writer(target_file) as writer:
+            for _ in range(chunks):
+                writer.write(pd.DataFrame({'ID': ['a'], 'manufacturerSKU': ['A']}))
+            raise ValueError('validation failed')
+    assert list(tmp_path.iterdir()) == []
+
+    # The output of a previous run stays as it was
+    with open_validated_ncf_writer(target_file) as writer:
+        writer.write(pd.DataFrame({'ID': ['b'], 'manufacturerSKU': ['B']}))
+    previous = target_file.read_bytes()
+    with pytest.raises(ValueError):
+        with open_validated_ncf_writer(target_file) as writer:
+            for _ in range(chunks):
+                writer.write(pd.DataFrame({'ID': ['a'], 'manufacturerSKU': ['A']}))
+            raise ValueError('validation failed')
+    assert list(tmp_path.iterdir()) == [target_file]
+    assert target_file.read_bytes() == previous
+
+
+def test_validation_report(database):
+    ncf_data = pd.read_csv(NCF_CSV_FILE, dtype=object)
+    sku_table = build_sku_table(database)
+
+    report = ValidationReport()
+    with create_validation_pool(sku_table, jobs=2) as pool:
+        answer = validate_ncf_rows(ncf_data, sku_table, pool=pool, jobs=2, report=report)
+    result = report.to_dict()
+
+    assert list(result) == ['sku_lookup', 'is_unit', 'check_base_sku', 'check_parent_sku',
+                            'is_shared_variation_product', 'is_step_variation_product',
+                            'required_or_optional_variation']
+    assert all(stats['rows'] == len(ncf_data) for stats in result.values())
+    assert result['is_unit']['values']['TRUE'] == (answer['c__unitTrueOrFalse'] == 'TRUE').sum()
+    assert result['check_base_sku']['values']['Not found'] == (answer['c__baseSku'] == 'Not found').sum()
+    assert sum(result['check_parent_sku']['values'].values()) == len(ncf_data)
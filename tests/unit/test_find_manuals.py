@@ -0,0 +1,60 @@
+# __Author__: Khoi Van 2021
+
+import os
+import sys
+
+sys.path.append(os.path.realpath('src'))
+
+import csv
+
+from src.find_manuals import ManualResult, ManualResultWriter, find_installation_manual
+
+
+FIELDNAMES = ['manufacturerSKU', 'brand', 'c__productCategory', 'matched_manual', 'comment']
+
+
+def read_result_file(file):
+    with open(file, 'r', newline='') as fin:
+        return list(csv.reader(fin))
+
+
+def test_manual_result_writer(tmp_path):
+    found_file = tmp_path / 'found_manuals.csv'
+    not_found_file = tmp_path / 'not_found_manuals.csv'
+    items = [{'manufacturerSKU': 'GX70', 'brand': 'Napoleon', 'c__productCategory': 'Gas Fireplaces'},
+             {'manufacturerSKU': 'MK-1', 'brand': 'Napoleon', 'c__productCategory': 'Media Kits'},
+             {'manufacturerSKU': 'B36', 'brand': 'Napoleon', 'c__productCategory': 'Gas Fireplaces'},
+             {'manufacturerSKU': 'X1', 'brand': '', 'c__productCategory': 'Gas Fireplaces'},
+             {'manufacturerSKU': 'STFSO18', 'brand': 'Napoleon', 'c__productCategory': ''}]
+    results = [ManualResult(found=True, line={**items[0], 'matched_manual': 'napoleon/gx70.pdf'}),
+               # Ignored, and without manual of the brand in the (empty) directory
+               find_installation_manual(items[1], directory={}),
+               ManualResult(found=True, line={**items[2], 'matched_manual': 'napoleon/b36.pdf'}),
+               find_installation_manual(items[3], directory={}),
+               find_installation_manual(items[4], directory={})]
+
+    with ManualResultWriter(FIELDNAMES, found_file=found_file, not_found_file=not_found_file) as result_writer:
+        for result in results:
+            result_writer.write(result)
+
+    assert read_result_file(found_file) == [
+        FIELDNAMES,
+        ['GX70', 'Napoleon', 'Gas Fireplaces', 'napoleon/gx70.pdf', ''],
+        ['B36', 'Napoleon', 'Gas Fireplaces', 'napoleon/b36.pdf', '']]
+    assert read_result_file(not_found_file) == [
+        FIELDNAMES,
+        ['MK-1', 'Napoleon', 'Media Kits', '', 'Ignored.'],
+        ['X1', '', 'Gas Fireplaces', '', 'Empty brand of does not have manuals for this brand.'],
+        ['STFSO18', 'Napoleon', '', '', 'Ignored.']]
+
+
+def test_manual_result_writer_without_results(tmp_path):
+    found_file = tmp_path / 'found_manuals.csv'
+    not_found_file = tmp_path / 'not_found_manuals.csv'
+    found_file.write_text('previous results\n')
+
+    with ManualResultWriter(FIELDNAMES, found_file=found_file, not_found_file=not_found_file):
+        pass
+
+    assert read_result_file(found_file) == [FIELDNAMES]
+    assert read_result_file(not_found_file) == [FIELDNAMES]
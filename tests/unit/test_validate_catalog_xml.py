@@ -0,0 +1,104 @@
+# __Author__: Khoi Van 2021
+
+import gzip
+import os
+import sys
+
+sys.path.append(os.path.realpath('src'))
+
+from pathlib import Path
+
+import pytest
+from src.validate_catalog_xml import (CatalogXmlValidator, ProductStructure, load_product_ids,
+                                      load_product_structure, validate_catalog_xml)
+
+
+CURRENT_FILEPATH = Path(__file__).resolve().parent.parent.parent
+DATA_FOLDER = CURRENT_FILEPATH / 'src' / 'data'
+PRODUCT_STRUCTURE_FILE = DATA_FOLDER / 'original' / 'productStructureExample-6.4.21.xml'
+
+CATALOG = '''<?xml version="1.0" encoding="UTF-8"?>
+<catalog xmlns="http://www.demandware.com/xml/impex/catalog/2006-10-31" catalog-id="ncf-m-catalog">
+{}
+</catalog>
+'''
+
+
+def write_catalog(tmp_path, products: str, name: str = 'catalog.xml') -> Path:
+    xml_file = tmp_path / name
+    xml_file.write_text(CATALOG.format(products))
+    return xml_file
+
+
+def test_product_structure_example_is_valid():
+    assert validate_catalog_xml(PRODUCT_STRUCTURE_FILE) == []
+
+
+def test_load_product_structure():
+    structure = load_product_structure(PRODUCT_STRUCTURE_FILE)
+    assert 'custom-attributes/custom-attribute' in structure.required
+    assert 'product-set-products/product-set-product' in structure.allowed
+    assert 'product-set-products/product-set-product' not in structure.required
+    assert structure.required <= structure.allowed
+
+
+@pytest.mark.parametrize(
+    "products, expect", [
+        ('<product product-id="a"/>\n<product product-id="b"/>', []),
+        ('<product/>', [(3, 'missing-product-id', None)]),
+        ('<product product-id="a"/>\n<product product-id="a"/>', [(4, 'duplicate-product-id', 'a')]),
+        ('''<product product-id="a">
+    <custom-attributes>
+        <custom-attribute attribute-id="sku">A</custom-attribute>
+        <custom-attribute attribute-id="skuNG"/>
+        <custom-attribute attribute-id="skuLP">  </custom-attribute>
+    </custom-attributes>
+</product>''', [(6, 'empty-custom-attribute', 'a'), (7, 'empty-custom-attribute', 'a')]),
+        ('''<product product-id="a">
+    <custom-attributes>
+        <custom-attribute attribute-id="productSetId">b-set</custom-attribute>
+    </custom-attributes>
+</product>
+<product product-id="b">
+    <custom-attributes>
+        <custom-attribute attribute-id="productSetId">a</custom-attribute>
+    </custom-attributes>
+</product>''', [(5, 'unresolved-product-set-id', 'a')]),
+        ('<product product-id="a">\n<upc>1</upc>\n</product>\n<product product-id="b">', [(7, 'not-well-formed', 'b')]),
+    ]
+)
+def test_catalog_xml_validator(tmp_path, products, expect):
+    errors = CatalogXmlValidator().validate(write_catalog(tmp_path, products))
+    assert [(error.line, error.check, error.product_id) for error in errors] == expect
+
+
+def test_catalog_xml_validator_structure(tmp_path):
+    structure = ProductStructure(allowed=frozenset({'upc', 'images', 'images/image-group'}),
+                                 required=frozenset({'upc'}))
+    xml_file = write_catalog(tmp_path, '''<product product-id="a">
+    <upc>1</upc>
+    <images><image-group><image/></image-group></images>
+    <brand>Napoleon</brand>
+</product>
+<product product-id="b"/>''')
+    errors = CatalogXmlValidator(structure=structure).validate(xml_file)
+    assert [(error.line, error.check, error.message) for error in errors] == [
+        (5, 'unexpected-element', '<images/image-group/image> is not in the product structure'),
+        (6, 'unexpected-element', '<brand> is not in the product structure'),
+        (8, 'missing-element', '<upc> is missing'),
+    ]
+
+
+def test_validate_catalog_xml_with_references(tmp_path):
+    reference_file = write_catalog(tmp_path, '<product product-id="a-set"/>', name='current.xml')
+    assert load_product_ids([reference_file]) == {'a-set'}
+
+    xml_file = tmp_path / 'catalog.xml.gz'
+    xml_file.write_bytes(gzip.compress(CATALOG.format('''<product product-id="a">
+    <custom-attributes>
+        <custom-attribute attribute-id="productSetId">a-set</custom-attribute>
+    </custom-attributes>
+</product>''').encode()))
+    assert [error.check for error in validate_catalog_xml(xml_file, structure_file=None)] == [
+        'unresolved-product-set-id']
+    assert validate_catalog_xml(xml_file, structure_file=None, reference_files=[reference_file]) == []